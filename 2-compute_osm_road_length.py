@@ -1,9 +1,7 @@
 import os
 import rtree
-import openpyxl
 import pandas as pd
 from shapely import wkt
-from geopy.distance import geodesic
 from shapely.geometry import LineString, Point
 
 # Extract coordinates from LINESTRING
@@ -55,6 +53,7 @@ def is_same_direction(geometry1, geometry2):
 
 # Core function to compute total road length for a given class
 def compute(road_type, file_path):
+    from geopy.distance import geodesic
     df = pd.read_csv(file_path, low_memory=False)
     roads = df[df['fclass'].isin([road_type, f"{road_type}_link"])]
     roads = roads[~roads['geometry'].str.contains('POINT', na=False)]
@@ -120,6 +119,8 @@ def compute(road_type, file_path):
 
 # Main function
 def main():
+    import openpyxl
+
     # Configuration: update these paths to your environment
     base_input_dir = "/your_output_path/20{year}/road/{name}_osm_road.csv"
     base_output_dir = "/your_path/to/output"
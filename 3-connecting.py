@@ -1,9 +1,7 @@
 import numpy as np
-import seaborn as sns
 import pandas as pd
 from shapely.geometry import LineString, Point, MultiLineString
 from shapely import wkt
-import matplotlib.pyplot as plt
 
 def process_geometry(location_type_dict, geom, row_type):
     """
@@ -1,14 +1,12 @@
 import numpy as np
-import seaborn as sns
 import pandas as pd
 from shapely.geometry import LineString, Point
 from shapely import wkt
 import rtree
-from geopy.distance import geodesic
-import matplotlib.pyplot as plt
 
 def geodesic_length(linestring):
     """Calculate the total geodesic length (in km) of a LineString by summing distances between adjacent points."""
+    from geopy.distance import geodesic
     coords = list(linestring.coords)
     total_length = sum(
         geodesic((coords[i][1], coords[i][0]), (coords[i+1][1], coords[i+1][0])).km
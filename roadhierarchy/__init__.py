@@ -0,0 +1,7 @@
+"""
+Importable compute engine for the road hierarchy analysis.
+
+The numbered scripts in the repository root are the reference
+implementations of each stage. This package parses a city once and
+runs the same stages on shared NumPy arrays and spatial indexes.
+"""
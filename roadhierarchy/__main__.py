@@ -0,0 +1,170 @@
+"""
+Command line entry point.
+
+    python -m roadhierarchy city ROAD_CSV [--stage engine|junctions|flows] [--rail RAIL_CSV] [--metric utm|aeqd]
+                                 [--grid CELL] [--tiled] [--simplify METRES] [--output DIR]
+                                 [--store ROOT --country NAME --year YEAR]
+    python -m roadhierarchy worker QUEUE_DIR [--heartbeat S] [--timeout S] [--max-attempts N]
+                                             [--task-timeout S] [--memory MB --slots N]
+    python -m roadhierarchy STAGE
+
+The city command runs one per-city stage (by default the fused engine)
+on one city, for work queues that spawn one short process per city. The
+worker command pulls such tasks from a shared queue directory (see
+workqueue.py). STAGE runs the main() of a stage module (see STAGES).
+Only the module that is run gets imported, so plotting and statistics
+libraries are never loaded by a city task.
+"""
+
+import argparse
+import importlib
+import os
+
+STAGES = ['encoding', 'engine', 'junctions', 'flows', 'scaling', 'bootstrap', 'sami', 'lisa', 'clustering', 'raster',
+          'workqueue', 'costmodel', 'equivalence', 'partition', 'kernels', 'transit', 'spacing', 'simplify']
+
+
+def city_name(road_path):
+    """City name of a road CSV (or compact .npz) path."""
+    return os.path.splitext(os.path.basename(road_path))[0].replace('_osm_road', '')
+
+
+def run_city(road_path, rail_path=None, metric=None, output_dir='.', grid_cell=None, store=None, tiled=False,
+             simplify=None):
+    """
+    Analyze one city and write its lengths, connection matrices and parallel
+    matches as CSV (and its density grid). store, if given, is a (root,
+    country, year) tuple of the result store the results are written to.
+    """
+    import pandas as pd
+    from .density import save_grid
+    from .engine import CONNECTING_TYPES, analyze
+
+    name = city_name(road_path)
+    result = analyze(_read_city(road_path, rail_path, simplify, output_dir), metric, grid_cell, tiled)
+    os.makedirs(output_dir, exist_ok=True)
+    pd.DataFrame([result.lengths]).to_csv(os.path.join(output_dir, f"{name}_lengths.csv"), index=False)
+    pd.DataFrame(result.matrix, index=result.matrix_types, columns=result.matrix_types).to_csv(
+        os.path.join(output_dir, f"{name}_connection_matrix.csv"))
+    pd.DataFrame(result.counts, index=CONNECTING_TYPES, columns=CONNECTING_TYPES).to_csv(
+        os.path.join(output_dir, f"{name}_raw_connections.csv"))
+    matches = result.matches
+    if matches.empty:
+        matches = pd.DataFrame([{'osm_id': 0, 'match_type': 'none', 'type': 'none', 'geometry': 'NONE'}])
+    matches.to_csv(os.path.join(output_dir, f"{name}_matrix.csv"), index=False, encoding='utf-8')
+    if result.grid is not None:
+        save_grid(result.grid, os.path.join(output_dir, f"{name}_density.npz"))
+    if store is not None:
+        from .store import result_name, result_records, write_results
+        root, country, year = store
+        write_results(root, result_records(result, country, name, year), result_name(country, 'engine', name))
+    print(f"{name} done")
+
+
+def _read_city(road_path, rail_path=None, simplify=None, output_dir='.'):
+    """Read a city; with simplify (metres), simplify it and write the errors of the simplification as CSV."""
+    from .citydata import CityData
+    from .encoding import load_city
+    city = load_city(road_path) if road_path.endswith('.npz') else CityData.from_csv(road_path, rail_path)
+    if simplify:
+        from .simplify import simplify_city
+        city, _, errors = simplify_city(city, simplify)
+        os.makedirs(output_dir, exist_ok=True)
+        errors.to_csv(os.path.join(output_dir, f"{city_name(road_path)}_simplification.csv"), index=False)
+    return city
+
+
+def run_junctions(road_path, rail_path=None, output_dir='.', store=None, simplify=None):
+    """Junction statistics of one city: degree distribution, class summary and touch shares as CSV (and in the store)."""
+    from .junctions import junction_statistics
+
+    name = city_name(road_path)
+    degrees, summary, shares = junction_statistics(_read_city(road_path, rail_path, simplify, output_dir))
+    os.makedirs(output_dir, exist_ok=True)
+    degrees.to_csv(os.path.join(output_dir, f"{name}_junction_degrees.csv"), index=False)
+    summary.to_csv(os.path.join(output_dir, f"{name}_junction_summary.csv"), index=False)
+    shares.to_csv(os.path.join(output_dir, f"{name}_touch_shares.csv"), index=False)
+    if store is not None:
+        from .junctions import junction_records
+        from .store import result_name, write_results
+        root, country, year = store
+        rows = junction_records(degrees, summary, shares, country, name, year)
+        write_results(root, rows, result_name(country, 'junctions', name))
+    print(f"{name} junctions done")
+
+
+def run_flows(road_path, rail_path=None, output_dir='.', store=None, tiled=False, simplify=None):
+    """Flow shares of one city as CSV (and in the store)."""
+    from .flows import city_flows
+
+    name = city_name(road_path)
+    _, shares = city_flows(_read_city(road_path, rail_path, simplify, output_dir), tiled=tiled)
+    os.makedirs(output_dir, exist_ok=True)
+    shares.to_csv(os.path.join(output_dir, f"{name}_flow_shares.csv"), index=False)
+    if store is not None:
+        import pandas as pd
+        from .store import records, result_name, write_results
+        root, country, year = store
+        rows = [records(shares, country, name, year, metric, 'fclass', value=metric)
+                for metric in ['flow_share', 'flow_km_share']]
+        write_results(root, pd.concat(rows, ignore_index=True), result_name(country, 'flows', name))
+    print(f"{name} flows done")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m roadhierarchy', description="Road hierarchy analysis.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    city = commands.add_parser('city', help="analyze one city")
+    city.add_argument('road', help="clipped road CSV of the city, or its compact .npz")
+    city.add_argument('--stage', choices=['engine', 'junctions', 'flows'], default='engine', help="per-city stage to run")
+    city.add_argument('--rail', default=None, help="clipped railway CSV of the city")
+    city.add_argument('--metric', choices=['utm', 'aeqd'], default=None, help="use a local metric projection (engine)")
+    city.add_argument('--grid', type=float, default=None, help="density grid cell size in metres (engine)")
+    city.add_argument('--tiled', action='store_true', help="bound the working memory of very large cities (engine, flows)")
+    city.add_argument('--simplify', type=float, default=None,
+                      help="simplify line interiors first, with this tolerance in metres")
+    city.add_argument('--output', default='.', help="output directory")
+    city.add_argument('--store', default=None, help="result store to write to (with --country and --year)")
+    city.add_argument('--country', default=None, help="country of the city, for the result store")
+    city.add_argument('--year', type=int, default=None, help="year of the data, for the result store")
+    worker = commands.add_parser('worker', help="run tasks from a shared queue directory")
+    worker.add_argument('queue', help="queue directory shared by the coordinator and the workers")
+    worker.add_argument('--id', default=None, help="worker name (default host-pid)")
+    worker.add_argument('--heartbeat', type=float, default=10, help="seconds between lease heartbeats")
+    worker.add_argument('--timeout', type=float, default=60, help="seconds without heartbeat before a lease is reassigned")
+    worker.add_argument('--max-attempts', type=int, default=3, help="attempts per task before it is marked failed")
+    worker.add_argument('--task-timeout', type=float, default=None,
+                        help="seconds after which a running task is killed and marked failed")
+    worker.add_argument('--wait', action='store_true', help="keep polling when the queue is empty")
+    worker.add_argument('--memory', type=float, default=None, help="memory budget (MB) for the predicted peaks of concurrent tasks")
+    worker.add_argument('--slots', type=int, default=1, help="tasks run at the same time")
+    for stage in STAGES:
+        commands.add_parser(stage, help=f"run roadhierarchy.{stage}.main()")
+    args = parser.parse_args()
+
+    if args.command == 'city':
+        if args.store and (args.country is None or args.year is None):
+            parser.error("--store needs --country and --year")
+        ignored = [option for option, value, stages in [
+            ('--metric', args.metric, ['engine']), ('--grid', args.grid, ['engine']),
+            ('--tiled', args.tiled, ['engine', 'flows']),
+        ] if value and args.stage not in stages]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} not supported by --stage {args.stage}")
+        store = (args.store, args.country, args.year) if args.store else None
+        if args.stage == 'engine':
+            run_city(args.road, args.rail, args.metric, args.output, args.grid, store, args.tiled, args.simplify)
+        elif args.stage == 'junctions':
+            run_junctions(args.road, args.rail, args.output, store, args.simplify)
+        else:
+            run_flows(args.road, args.rail, args.output, store, args.tiled, args.simplify)
+    elif args.command == 'worker':
+        from .workqueue import run_worker
+        run_worker(args.queue, args.id, args.heartbeat, args.timeout, args.max_attempts, until_empty=not args.wait,
+                   memory_budget=args.memory, slots=args.slots, task_timeout=args.task_timeout)
+    else:
+        importlib.import_module(f'.{args.command}', __package__).main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Bootstrap and jackknife confidence intervals for the scaling exponents.
+
+The covariance-based interval of curve_fit assumes well-behaved log-log
+residuals, which does not hold for the smallest cities. Here cities are
+resampled with replacement and beta is refitted for every replicate;
+the replicates of a group are drawn and fitted as one NumPy array
+operation, and the groups are spread over a process pool. Percentile
+and BCa intervals are reported for every (country, year, road_type).
+Replicates that draw a single distinct population (no slope) are
+dropped, and their number is reported with the intervals.
+"""
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from .scaling import GROUP, load_store_tables
+
+INTERVAL_COLUMNS = [
+    'n', 'beta', 'boot_se', 'jack_se', 'dropped',
+    'percentile_low', 'percentile_high', 'bca_low', 'bca_high',
+]
+
+# ----- Replicates -----
+
+def slopes(lx, ly):
+    """Least-squares slopes along the last axis of log-log samples (NaN when x is constant)."""
+    cx = lx - lx.mean(axis=-1, keepdims=True)
+    cy = ly - ly.mean(axis=-1, keepdims=True)
+    sxy, sxx = (cx * cy).sum(axis=-1), (cx * cx).sum(axis=-1)
+    # Exact test on the values: the mean of equal values need not round to them
+    varies = lx.max(axis=-1) > lx.min(axis=-1)
+    return np.divide(sxy, sxx, out=np.full(np.shape(sxx), np.nan), where=varies)
+
+def bootstrap_slopes(lx, ly, n_boot, rng, chunk=1000):
+    """
+    Slopes of n_boot resamples of the cities, drawn chunk replicates at a
+    time. Resamples without two distinct x values have NaN slopes.
+    """
+    n = len(lx)
+    out = np.empty(n_boot)
+    for start in range(0, n_boot, chunk):
+        stop = min(start + chunk, n_boot)
+        idx = rng.integers(0, n, size=(stop - start, n))
+        out[start:stop] = slopes(lx[idx], ly[idx])
+    return out
+
+def jackknife_slopes(lx, ly):
+    """Leave-one-out slopes, from the closed-form sums without each city."""
+    n = len(lx)
+    sx, sy = lx.sum() - lx, ly.sum() - ly
+    sxx, sxy = (lx * lx).sum() - lx * lx, (lx * ly).sum() - lx * ly
+    m = n - 1
+    # Without city i, x is constant if x takes at most one other value
+    values, inverse, counts = np.unique(lx, return_inverse=True, return_counts=True)
+    varies = (len(values) > 2) | ((len(values) == 2) & (counts[inverse] > 1))
+    return np.divide(sxy - sx * sy / m, sxx - sx * sx / m, out=np.full(n, np.nan), where=varies)
+
+# ----- Intervals -----
+
+def percentile_interval(boot, level=0.95):
+    """Percentile bootstrap interval (NaN replicates ignored)."""
+    alpha = (1 - level) / 2
+    return tuple(np.nanquantile(boot, [alpha, 1 - alpha]))
+
+def bca_interval(estimate, boot, jack, level=0.95):
+    """Bias-corrected and accelerated bootstrap interval (NaN replicates ignored)."""
+    from scipy.stats import norm
+    alpha = (1 - level) / 2
+    boot, jack = boot[np.isfinite(boot)], jack[np.isfinite(jack)]
+    if not len(boot) or not len(jack):
+        return np.nan, np.nan
+    z0 = norm.ppf(np.clip(np.mean(boot < estimate), 1e-10, 1 - 1e-10))
+    d = jack.mean() - jack
+    denominator = 6 * (d ** 2).sum() ** 1.5
+    a = (d ** 3).sum() / denominator if denominator else 0.0
+    z = norm.ppf([alpha, 1 - alpha])
+    q = norm.cdf(z0 + (z0 + z) / (1 - a * (z0 + z)))
+    return tuple(np.quantile(boot, q))
+
+def _group_intervals(args):
+    """Bootstrap and jackknife summary of one group (runs in a worker process)."""
+    key, lx, ly, n_boot, level, seed = args
+    beta = float(slopes(lx, ly))
+    boot = bootstrap_slopes(lx, ly, n_boot, np.random.default_rng(seed))
+    jack = jackknife_slopes(lx, ly)
+    n = len(lx)
+    return key + (
+        n, beta,
+        np.nanstd(boot, ddof=1),
+        np.sqrt((n - 1) / n * np.nansum((jack - np.nanmean(jack)) ** 2)),
+        int(np.isnan(boot).sum()),
+        *percentile_interval(boot, level),
+        *bca_interval(beta, boot, jack, level),
+    )
+
+def bootstrap_scaling(table, n_boot=10000, level=0.95, processes=None, seed=0, min_cities=6,
+                      x='population', y='length', by=GROUP):
+    """
+    Bootstrap intervals of beta for every group of a tidy length table.
+
+    Returns one row per group with the point estimate, the bootstrap and
+    jackknife standard errors, the number of dropped (degenerate)
+    replicates, and the percentile and BCa intervals.
+    Results are reproducible for a given seed and number of groups.
+    """
+    table = table[(table[x] > 0) & (table[y] > 0)]
+    groups = [(key, g) for key, g in table.groupby(by, sort=True) if len(g) >= min_cities]
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    tasks = [
+        (tuple(key), np.log10(g[x].to_numpy(dtype=float)), np.log10(g[y].to_numpy(dtype=float)), n_boot, level, s)
+        for (key, g), s in zip(groups, seeds)
+    ]
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        rows = list(pool.map(_group_intervals, tasks, chunksize=max(1, len(tasks) // 64)))
+
+    return pd.DataFrame(rows, columns=list(by) + INTERVAL_COLUMNS)
+
+# ----- Result store -----
+
+def save_intervals(intervals, root):
+    """Write bootstrap intervals to the result store (metrics bootstrap_*, no city)."""
+    from .store import result_name, table_records, write_results
+    for country, group in intervals.groupby('country'):
+        rows = table_records(group, INTERVAL_COLUMNS, 'bootstrap_', city='')
+        write_results(root, rows, result_name(country, 'bootstrap'))
+
+def load_intervals(root, country=None, year=None):
+    """Read the bootstrap_scaling layout back from the result store."""
+    from .store import read_table
+    intervals = read_table(root, INTERVAL_COLUMNS, 'bootstrap_', country, year=year)
+    return intervals[GROUP + INTERVAL_COLUMNS].astype({'n': int, 'dropped': int})
+
+# ----- Main -----
+
+def main():
+    """
+    Bootstrap the scaling exponents of every country, year and road type
+    on the lengths in the result store and write the intervals to it.
+    Replace file paths with your own data.
+    """
+    store_path = '/your_path/to/output/results'
+    population_path = '/your_path/to/{country}_population.xlsx'  # columns: city, year, population
+
+    table = load_store_tables(store_path, population_path)
+    intervals = bootstrap_scaling(table, n_boot=10000)
+    save_intervals(intervals, store_path)
+    print(f"Bootstrap intervals of {len(intervals)} groups saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+import numpy as np
+import pandas as pd
+import shapely
+from functools import cached_property
+
+from .kernels import kernels
+from .projection import project_coords
+
+# Columns of the clipped city CSVs used by the analysis stages
+COLUMNS = ['osm_id', 'fclass', 'geometry']
+
+# Shapely geometry type ids
+POINT = 0
+LINESTRING = 1
+MULTILINESTRING = 5
+
+
+def strip_link(fclass):
+    """Remove the '_link' suffix from an array of road classes."""
+    return pd.Series(fclass, dtype=object).str.replace(r'_link$', '', regex=True).to_numpy(dtype=object)
+
+
+def class_codes(values, road_types):
+    """Map class names to their index in road_types, -1 when not listed."""
+    return pd.Categorical(values, categories=list(road_types)).codes.astype(np.int64)
+
+
+def read_city_frame(road_path, rail_path=None):
+    """Read the road CSV (and optionally the railway CSV) of a city into one frame."""
+    paths = [road_path] if rail_path is None else [road_path, rail_path]
+    frames = [
+        pd.read_csv(path, usecols=lambda c: c in COLUMNS, low_memory=False)
+        for path in paths
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_geometries(type_id, part_feature, part_offsets, coords):
+    """
+    Shapely geometries of the features from the ragged arrays, in
+    vectorized calls. Points, LineStrings and MultiLineStrings are
+    rebuilt; other types, and missing geometries, become None.
+    """
+    geoms = np.full(len(type_id), None, dtype=object)
+    counts = np.diff(part_offsets)
+    part_type = type_id[part_feature]
+
+    is_point = (part_type == POINT) & (counts > 0)
+    geoms[part_feature[is_point]] = shapely.points(coords[part_offsets[:-1][is_point]])
+
+    is_line = np.isin(part_type, [LINESTRING, MULTILINESTRING]) & (counts >= 2)
+    parts = np.flatnonzero(is_line)
+    n = counts[parts]
+    line_index = np.repeat(np.arange(len(parts)), n)
+    coord_index = np.arange(n.sum()) + np.repeat(part_offsets[parts] - (np.cumsum(n) - n), n)
+    lines = shapely.linestrings(coords[coord_index], indices=line_index)
+    single = part_type[parts] == LINESTRING
+    geoms[part_feature[parts[single]]] = lines[single]
+    multi = ~single
+    if multi.any():
+        owners, index = np.unique(part_feature[parts[multi]], return_inverse=True)
+        geoms[owners] = shapely.multilinestrings(lines[multi], indices=index)
+
+    empty = (geoms == None) & np.isin(type_id, [LINESTRING, MULTILINESTRING])  # noqa: E711
+    geoms[empty] = shapely.from_wkt(np.where(type_id[empty] == LINESTRING, 'LINESTRING EMPTY', 'MULTILINESTRING EMPTY'))
+    return geoms
+
+
+class CityData:
+    """
+    Road and railway features of one city, read and parsed once.
+
+    WKT geometries are parsed in a single vectorized call and flattened
+    into ragged arrays: `coords` holds every vertex, `part_offsets`
+    delimits the line parts and `part_feature` maps every part back to
+    its row. Derived arrays (centroids, segments, lengths, the spatial
+    index) are computed on first use and shared by all stages.
+
+    Coordinates are longitude/latitude degrees unless the city was
+    projected with to_metric, in which case `units` is 'metre' and
+    `crs` names the local projection. With `tile_size` set, the candidate
+    pairs are queried and handed to the stages in tiles of that many
+    features instead of all at once, which bounds their working memory
+    for very large cities.
+
+    The first `road_features` rows come from the road file and the rest
+    from the railway file; road lengths are counted on the road rows only.
+    """
+
+    def __init__(self, frame, road_features=None):
+        frame = frame.reset_index(drop=True)
+        self.frame = frame
+        self.road_features = len(frame) if road_features is None else road_features
+        self.osm_id = frame['osm_id'].to_numpy()
+        self.fclass = frame['fclass'].fillna('').astype(str).to_numpy(dtype=object)
+        self.road_class = strip_link(self.fclass)
+
+        wkt = frame['geometry'].where(frame['geometry'].notna(), None).to_numpy(dtype=object)
+        self.geoms = shapely.from_wkt(wkt, on_invalid='ignore')
+        self.type_id = shapely.get_type_id(self.geoms)
+
+        parts, self.part_feature = shapely.get_parts(self.geoms, return_index=True)
+        self.coords, self.coord_part = shapely.get_coordinates(parts, return_index=True)
+        counts = np.bincount(self.coord_part, minlength=len(parts))
+        self.part_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.crs = None
+        self.units = 'degree'
+        self._trees = {}
+        self._pairs = {}
+        self._projected = {}
+        self._connections = {}
+        self.quantized = None
+        self.tile_size = None
+
+    @classmethod
+    def from_csv(cls, road_path, rail_path=None):
+        """Read and parse the city CSV files."""
+        road = read_city_frame(road_path)
+        if rail_path is None:
+            return cls(road)
+        return cls(pd.concat([road, read_city_frame(rail_path)], ignore_index=True), len(road))
+
+    @classmethod
+    def from_arrays(cls, osm_id, fclass, type_id, part_feature, part_offsets, coords, quantized=None, geoms=None,
+                    classes=None, road_features=None):
+        """
+        City from its ragged arrays, without WKT (e.g. decoded from the
+        compact coordinate encoding). quantized holds the exact integer
+        coordinates, used to identify shared vertices; geoms, if not
+        given, are built with build_geometries on first use. With classes,
+        fclass holds integer codes into classes, and the class name arrays
+        are only built when used. The attribute frame and coord_part are
+        also built on first use. road_features defaults to all rows.
+        """
+        city = object.__new__(cls)
+        city.osm_id = np.asarray(osm_id)
+        city.road_features = len(city.osm_id) if road_features is None else int(road_features)
+        if classes is None:
+            city.fclass = pd.Series(fclass, dtype=object).fillna('').astype(str).to_numpy(dtype=object)
+            city.road_class = strip_link(city.fclass)
+        else:
+            city.fclass_codes, city.classes = np.asarray(fclass), np.asarray(classes, dtype=object)
+        city.type_id = np.asarray(type_id)
+        city.part_feature = np.asarray(part_feature)
+        city.part_offsets = np.asarray(part_offsets)
+        city.coords = coords
+        if geoms is not None:
+            city.geoms = geoms
+        city.crs = None
+        city.units = 'degree'
+        city._trees, city._pairs, city._projected, city._connections = {}, {}, {}, {}
+        city.quantized = quantized
+        city.tile_size = None
+        return city
+
+    def __len__(self):
+        return len(self.osm_id)
+
+    def to_metric(self, kind='utm'):
+        """
+        Copy of the city projected into a local metric CRS ('utm' or 'aeqd').
+
+        The projected city is cached, so the coordinates are transformed
+        once per city and projection. Shared-vertex ids are carried over
+        from the geographic coordinates.
+        """
+        if self.units == 'metre':
+            return self
+        if kind not in self._projected:
+            coords, crs = project_coords(self.coords, kind)
+            city = object.__new__(CityData)
+            # Lazy attributes are carried over only once built
+            city.__dict__.update({
+                name: self.__dict__[name] for name in ['frame', 'fclass', 'road_class', 'fclass_codes', 'classes']
+                if name in self.__dict__
+            })
+            city.__dict__.update({
+                'osm_id': self.osm_id, 'road_features': self.road_features, 'type_id': self.type_id,
+                'part_feature': self.part_feature, 'coord_part': self.coord_part,
+                'part_offsets': self.part_offsets, 'vertex_id': self.vertex_id,
+                'coords': coords, 'crs': crs, 'units': 'metre',
+                '_trees': {}, '_pairs': {}, '_projected': {}, '_connections': self._connections,
+                'quantized': self.quantized, 'tile_size': self.tile_size,
+            })
+            city.geoms = shapely.transform(self.geoms, lambda _: coords)
+            self._projected[kind] = city
+        return self._projected[kind]
+
+    def geometry_wkt(self, rows):
+        """WKT of the given rows: the input text, or written from the geometries for cities built from arrays."""
+        if 'frame' in self.__dict__ and 'geometry' in self.frame:
+            return self.frame['geometry'].take(rows).to_numpy()
+        return shapely.to_wkt(self.geoms[rows], rounding_precision=-1)
+
+    # ----- Features -----
+
+    @cached_property
+    def frame(self):
+        """Attribute frame (osm_id, fclass) of cities built from arrays."""
+        return pd.DataFrame({'osm_id': self.osm_id, 'fclass': self.fclass})
+
+    @cached_property
+    def fclass(self):
+        """Class names, from the class codes of cities built from arrays with classes."""
+        return self.classes[self.fclass_codes]
+
+    @cached_property
+    def road_class(self):
+        """Classes without the '_link' suffix."""
+        if 'fclass_codes' in self.__dict__:
+            return strip_link(self.classes)[self.fclass_codes]
+        return strip_link(self.fclass)
+
+    @cached_property
+    def coord_part(self):
+        """Part index of every vertex."""
+        return np.repeat(np.arange(len(self.part_offsets) - 1), np.diff(self.part_offsets))
+
+    @cached_property
+    def geoms(self):
+        """Shapely geometries; parsed from WKT, or built from the arrays of cities created with from_arrays."""
+        return build_geometries(self.type_id, self.part_feature, self.part_offsets, self.coords)
+
+    @cached_property
+    def lines(self):
+        """Row indices of non-empty LineString features."""
+        num_coords = shapely.get_num_coordinates(self.geoms)
+        return np.flatnonzero((self.type_id == LINESTRING) & (num_coords >= 2))
+
+    @cached_property
+    def first_part(self):
+        """Index of the first part of every feature."""
+        return np.searchsorted(self.part_feature, np.arange(len(self)))
+
+    @cached_property
+    def endpoints(self):
+        """Start and end coordinates of every line feature, as (n, 2) arrays."""
+        start = np.full((len(self), 2), np.nan)
+        end = np.full((len(self), 2), np.nan)
+        part = self.first_part[self.lines]
+        start[self.lines] = self.coords[self.part_offsets[part]]
+        end[self.lines] = self.coords[self.part_offsets[part + 1] - 1]
+        return start, end
+
+    @cached_property
+    def centroids(self):
+        """Centroids of every line feature, NaN for other rows."""
+        centroids = np.full((len(self), 2), np.nan)
+        centroids[self.lines] = shapely.get_coordinates(shapely.centroid(self.geoms[self.lines]))
+        return centroids
+
+    @cached_property
+    def planar_lengths(self):
+        """Lengths in coordinate units, as returned by shapely."""
+        return shapely.length(self.geoms)
+
+    @cached_property
+    def vertex_id(self):
+        """
+        Shared-vertex id of every coordinate, -1 for unsupported geometry types.
+
+        Vertices are identified by their exact coordinates. Points get their
+        own ids, as 3-connecting.py keys them by their WKT instead of the
+        coordinate tuple. With exact integer coordinates (quantized), each
+        vertex is one int64 key and the ids come from a 1-D unique.
+        """
+        feature_type = self.type_id[self.part_feature[self.coord_part]]
+        supported = np.isin(feature_type, [POINT, LINESTRING, MULTILINESTRING])
+        vertex_id = np.full(len(self.coords), -1, dtype=np.int64)
+        if not supported.any():
+            return vertex_id
+        is_point = feature_type[supported] == POINT
+        if self.quantized is not None and np.abs(self.quantized).max(initial=0) < 2 ** 31:
+            q = self.quantized[supported].astype(np.int64) + 2 ** 31
+            keys = (q[:, 0].astype(np.uint64) << np.uint64(32)) | q[:, 1].astype(np.uint64)
+            ids = np.empty(len(keys), dtype=np.int64)
+            line_keys, ids[~is_point] = np.unique(keys[~is_point], return_inverse=True)
+            ids[is_point] = np.unique(keys[is_point], return_inverse=True)[1] + len(line_keys)
+            vertex_id[supported] = ids
+        else:
+            keys = np.column_stack([self.coords[supported], is_point])
+            vertex_id[supported] = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+        return vertex_id
+
+    # ----- Segments -----
+
+    @cached_property
+    def segment_start(self):
+        """Index into coords of the first vertex of every segment."""
+        is_last = np.zeros(len(self.coords), dtype=bool)
+        ends = self.part_offsets[1:]
+        is_last[ends[ends > self.part_offsets[:-1]] - 1] = True
+        return np.flatnonzero(~is_last)
+
+    @cached_property
+    def segment_feature(self):
+        """Row index of every segment."""
+        return self.part_feature[self.coord_part[self.segment_start]]
+
+    @cached_property
+    def segment_lengths(self):
+        """Length (km) of every segment: geodesic, or planar once projected."""
+        p1 = self.coords[self.segment_start]
+        p2 = self.coords[self.segment_start + 1]
+        if self.units == 'metre':
+            dist = np.hypot(p2[:, 0] - p1[:, 0], p2[:, 1] - p1[:, 1])
+        else:
+            dist = kernels().geodesic_distance(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1])
+        return dist / 1000
+
+    @cached_property
+    def feature_lengths(self):
+        """Length (km) of every feature, summed over its parts."""
+        return kernels().ragged_sum(self.segment_lengths, self.segment_feature, len(self))
+
+    def segment_lines(self, segments):
+        """Two-point LineStrings of the given segments (indices into the segment arrays)."""
+        start = self.segment_start[segments]
+        return shapely.linestrings(np.stack([self.coords[start], self.coords[start + 1]], axis=1))
+
+    # ----- Spatial index -----
+
+    def centroid_tree(self, offset=0.001):
+        """STRtree over boxes of size offset centred on the line centroids."""
+        if offset not in self._trees:
+            cx, cy = self.centroids[self.lines].T
+            half = offset / 2
+            boxes = shapely.box(cx - half, cy - half, cx + half, cy + half)
+            self._trees[offset] = shapely.STRtree(boxes)
+        return self._trees[offset]
+
+    def _query_tiles(self, offset, step):
+        """Candidate pairs of the centroid boxes, queried step boxes at a time."""
+        tree = self.centroid_tree(offset)
+        boxes = tree.geometries
+        # A city without lines still yields one (empty) tile
+        for start in range(0, max(len(boxes), 1), step):
+            src, dst = tree.query(boxes[start:start + step], predicate='intersects')
+            src += start
+            keep = src < dst
+            yield self.lines[src[keep]], self.lines[dst[keep]]
+
+    def candidate_pairs(self, offset=0.001):
+        """
+        Line feature pairs (i < j) whose centroid boxes intersect, i.e. the
+        candidates returned by the R-tree queries of the scripts.
+        """
+        if offset not in self._pairs:
+            pairs = list(self._query_tiles(offset, self.tile_size or max(len(self.lines), 1)))
+            empty = np.empty(0, dtype=np.int64)
+            self._pairs[offset] = (np.concatenate([p[0] for p in pairs] or [empty]),
+                                   np.concatenate([p[1] for p in pairs] or [empty]))
+        return self._pairs[offset]
+
+    def pair_tiles(self, offset=0.001):
+        """
+        Candidate pairs in tiles. Without tile_size (or with the pairs
+        already cached) all pairs come as one tile; otherwise the pairs of
+        tile_size features at a time, which are not kept, so a stage that
+        reduces every tile before the next never holds all pairs.
+        """
+        if self.tile_size is None or offset in self._pairs:
+            yield self.candidate_pairs(offset)
+        else:
+            yield from self._query_tiles(offset, self.tile_size)
@@ -0,0 +1,199 @@
+"""
+Clustering of cities by their hierarchy residual profiles.
+
+Each city is described by its vector of SAMI residuals over the road
+types. Profiles are standardized per road type and clustered with
+k-means (several restarts, run on a process pool) or Ward hierarchical
+clustering; k is chosen by silhouette score or gap statistic. Clusters
+are numbered 1..k by decreasing size, as Fig7.py expects.
+Cross-country similarity of the cluster profiles is one matrix product
+of the row-normalized mean profiles.
+"""
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.hierarchy import fcluster, linkage
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+
+from .sami import load_residuals
+
+# Road types of the residual profiles (rail excluded, as in Fig7.py)
+PROFILE_TYPES = ['motorway*', 'primary', 'secondary', 'tertiary', 'residential*', 'footway']
+
+# ----- Profiles -----
+
+def residual_profiles(sami, country, year, road_types=PROFILE_TYPES):
+    """City x road type residuals of one country and year, cities with missing values dropped."""
+    subset = sami[(sami['country'] == country) & (sami['year'] == year) & sami['road_type'].isin(road_types)]
+    return subset.pivot_table(index='city', columns='road_type', values='residual')[list(road_types)].dropna()
+
+def standardize(profiles):
+    """Z-score every column of a profile table."""
+    values = profiles.to_numpy(dtype=float)
+    std = values.std(axis=0)
+    return (values - values.mean(axis=0)) / np.where(std == 0, 1, std)
+
+# ----- Clustering -----
+
+def _kmeans_run(args):
+    """One k-means restart (runs in a worker process)."""
+    X, k, seed = args
+    model = KMeans(n_clusters=k, n_init=1, random_state=seed).fit(X)
+    return k, model.inertia_, model.labels_
+
+def _relabel(labels):
+    """Number clusters 1..k by decreasing size."""
+    values, counts = np.unique(labels, return_counts=True)
+    order = values[np.argsort(-counts, kind='stable')]
+    mapping = np.empty(labels.max() + 1, dtype=int)
+    mapping[order] = np.arange(1, len(order) + 1)
+    return mapping[labels]
+
+def kmeans_all(X, ks, n_init=10, seed=0, processes=None, pool=None):
+    """
+    Best of n_init k-means restarts for every k in ks.
+    Returns {k: (inertia, labels)}.
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(n_init * len(ks))
+    tasks = [(X, k, int(s)) for k, s in zip(np.repeat(ks, n_init), seeds)]
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=processes) as own_pool:
+            runs = list(own_pool.map(_kmeans_run, tasks))
+    else:
+        runs = list(pool.map(_kmeans_run, tasks))
+
+    best = {}
+    for k, inertia, labels in runs:
+        if k not in best or inertia < best[k][0]:
+            best[k] = (inertia, labels)
+    return best
+
+def hierarchical(X, ks):
+    """Ward clustering cut at every k in ks. Returns {k: (inertia, labels)}."""
+    tree = linkage(X, method='ward')
+    result = {}
+    for k in ks:
+        labels = fcluster(tree, k, criterion='maxclust') - 1
+        result[k] = (within_dispersion(X, labels), labels)
+    return result
+
+def within_dispersion(X, labels):
+    """Sum of squared distances of the points to their cluster means."""
+    counts = np.bincount(labels)
+    sums = np.zeros((len(counts), X.shape[1]))
+    np.add.at(sums, labels, X)
+    centres = sums / np.maximum(counts, 1)[:, None]
+    return ((X - centres[labels]) ** 2).sum()
+
+def gap_statistic(X, results, n_refs=10, seed=0):
+    """
+    Gap statistic of every clustering in results ({k: (inertia, labels)}),
+    with reference data drawn uniformly in the bounding box of X and
+    clustered by k-means. Returns {k: (gap, s_k)}.
+    """
+    rng = np.random.default_rng(seed)
+    low, high = X.min(axis=0), X.max(axis=0)
+    gaps = {}
+    for k, (inertia, _) in results.items():
+        ref = [
+            KMeans(n_clusters=k, n_init=1, random_state=int(rng.integers(2 ** 31))).fit(
+                rng.uniform(low, high, size=X.shape)).inertia_
+            for _ in range(n_refs)
+        ]
+        log_ref = np.log(ref)
+        gaps[k] = (log_ref.mean() - np.log(inertia), log_ref.std() * np.sqrt(1 + 1 / n_refs))
+    return gaps
+
+def choose_k(X, results, criterion='silhouette', seed=0):
+    """Pick k by the highest silhouette score, or by the first gap(k) >= gap(k+1) - s(k+1)."""
+    ks = sorted(results)
+    if criterion == 'silhouette':
+        scores = {k: silhouette_score(X, results[k][1]) for k in ks if k > 1}
+        return max(scores, key=scores.get)
+    if criterion == 'gap':
+        gaps = gap_statistic(X, results, seed=seed)
+        for k, k_next in zip(ks, ks[1:]):
+            if gaps[k][0] >= gaps[k_next][0] - gaps[k_next][1]:
+                return k
+        return ks[-1]
+    raise ValueError(f"Unknown criterion {criterion!r}")
+
+def cluster_cities(sami, ks=range(2, 9), method='kmeans', criterion='silhouette',
+                   n_init=10, seed=0, processes=None, road_types=PROFILE_TYPES):
+    """
+    Cluster the cities of every country and year.
+
+    Returns a table with one row per city: country, year, city, label
+    (1..k by decreasing cluster size) and the chosen k.
+    """
+    ks = [k for k in ks if k > 1]
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for (country, year), _ in sami.groupby(['country', 'year'], sort=True):
+            profiles = residual_profiles(sami, country, year, road_types)
+            X = standardize(profiles)
+            candidates = [k for k in ks if k < len(X)]
+            if not candidates:
+                continue
+            if method == 'kmeans':
+                fits = kmeans_all(X, candidates, n_init, seed, pool=pool)
+            elif method == 'hierarchical':
+                fits = hierarchical(X, candidates)
+            else:
+                raise ValueError(f"Unknown method {method!r}")
+            k = choose_k(X, fits, criterion, seed)
+            results.append(pd.DataFrame({
+                'country': country, 'year': year, 'city': profiles.index,
+                'label': _relabel(fits[k][1]), 'k': k,
+            }))
+    return pd.concat(results, ignore_index=True)
+
+# ----- Profiles of the clusters -----
+
+def cluster_means(sami, labels, country, year, road_types=PROFILE_TYPES):
+    """Mean residual profile of every cluster of one country and year (rows indexed by label)."""
+    profiles = residual_profiles(sami, country, year, road_types)
+    subset = labels[(labels['country'] == country) & (labels['year'] == year)].set_index('city')['label']
+    return profiles.join(subset, how='inner').groupby('label').mean()
+
+def cluster_similarity(a, b):
+    """Cosine similarity between every row of a and every row of b."""
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return a @ b.T
+
+# ----- Result store -----
+
+def save_clusters(labels, root):
+    """Write cluster labels to the result store (metrics cluster_label and cluster_k, no road type)."""
+    from .store import result_name, table_records, write_results
+    for country, group in labels.groupby('country'):
+        rows = table_records(group, ['label', 'k'], 'cluster_', road_type=None)
+        write_results(root, rows, result_name(country, 'clusters'))
+
+def load_clusters(root, country=None, year=None):
+    """Read the cluster_cities layout back from the result store."""
+    from .store import read_table
+    labels = read_table(root, ['label', 'k'], 'cluster_', country, year=year)
+    return labels[['country', 'year', 'city', 'label', 'k']].astype({'label': int, 'k': int})
+
+# ----- Main -----
+
+def main():
+    """
+    Cluster the cities of every country and year by their residual
+    profiles, read from and written to the result store.
+    Replace file paths with your own data.
+    """
+    store_path = '/your_path/to/output/results'
+
+    labels = cluster_cities(load_residuals(store_path))
+    save_clusters(labels, store_path)
+    print(f"Cluster labels of {len(labels)} city rows saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
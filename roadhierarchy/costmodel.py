@@ -0,0 +1,215 @@
+"""
+Runtime and memory cost model of the per-city tasks.
+
+City sizes span about three orders of magnitude, so the order in which
+the work queue hands out cities matters: a Shanghai-sized task started
+last finishes long after everything else, and two of them on one host
+can run it out of memory. Every finished queue task records its runtime
+and peak memory (done/*.json, see workqueue.py) next to cheap features
+of its input: file size, row count and the class mix. Per stage (and
+per tiled or untiled run) log runtime and log peak memory are fitted as
+linear functions of log rows, log file size and the class shares.
+
+plan_tasks uses the model before publishing: each task gets its
+predicted runtime, which the workers use to claim the largest tasks
+first, and its predicted peak memory (a high quantile of the fit), which
+they use to pack tasks up to their memory budget. Tasks predicted to
+need more than a share of a worker's budget are switched to tiled mode
+(engine and flows only). Until runs are recorded, rough default
+coefficients are used; until a stage has enough tiled runs for a model
+of its own, tiled memory is the untiled prediction scaled by the median
+ratio measured on the tiled runs recorded so far.
+"""
+
+import glob
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+from .citydata import strip_link
+
+# Classes whose shares describe the class mix
+MIX_CLASSES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential', 'service', 'footway']
+FEATURES = ['log_rows', 'log_mb'] + [f'share_{c}' for c in MIX_CLASSES]
+# With fewer recorded runs than this, only the size features are used
+MIN_RUNS_FULL = 20
+# Memory of an interpreter with the libraries loaded (MB), the floor of the predictions
+BASE_MB = 150
+# Normal quantile of the memory predictions (95%)
+MEMORY_Z = 1.645
+# Stages whose city command honours --tiled
+TILED_STAGES = ['engine', 'flows']
+
+# tiled_memory: ratio of the memory of tiled runs to the prediction of the
+# untiled model, fitted on the recorded tiled runs (1 until there are any)
+StageModel = namedtuple('StageModel', ['features', 'seconds', 'memory', 'seconds_sd', 'memory_sd', 'runs',
+                                       'tiled_memory'], defaults=(1.0,))
+
+# Rough cold-start models: seconds and memory (MB) proportional to the rows and the file size
+DEFAULT_MODELS = {
+    'engine': StageModel(['log_rows', 'log_mb'], [np.log(1e-4), 1.0, 0.0], [np.log(12.0), 0.0, 1.0], 1.0, 0.5, 0),
+    'junctions': StageModel(['log_rows', 'log_mb'], [np.log(3e-5), 1.0, 0.0], [np.log(8.0), 0.0, 1.0], 1.0, 0.5, 0),
+    'flows': StageModel(['log_rows', 'log_mb'], [np.log(2.5e-6), 1.5, 0.0], [np.log(10.0), 0.0, 1.0], 1.0, 0.5, 0),
+}
+
+# ----- Features -----
+
+def city_features(road_path, rail_path=None):
+    """
+    Cheap features of a city's input: rows, size (MB) and the share of
+    every MIX_CLASSES class. Only the fclass column is read.
+    """
+    paths = [p for p in [road_path, rail_path] if p]
+    size = sum(os.path.getsize(p) for p in paths)
+    if road_path.endswith('.npz'):
+        with np.load(road_path) as data:
+            fclass = data['fclass']
+    else:
+        fclass = pd.concat([pd.read_csv(p, usecols=['fclass'])['fclass'] for p in paths], ignore_index=True)
+    shares = pd.Series(strip_link(fclass)).value_counts(normalize=True)
+    features = {'rows': len(fclass), 'file_mb': size / 2 ** 20}
+    features.update({f'share_{c}': float(shares.get(c, 0.0)) for c in MIX_CLASSES})
+    return features
+
+def design_matrix(frame, columns):
+    """Rows x (intercept + columns) matrix of a feature table (or one feature dict)."""
+    if isinstance(frame, dict):
+        frame = pd.DataFrame([frame])
+    values = {
+        'log_rows': np.log1p(frame['rows'].to_numpy(dtype=float)),
+        'log_mb': np.log(frame['file_mb'].to_numpy(dtype=float) + 1e-3),
+    }
+    return np.column_stack([np.ones(len(frame))] + [
+        values[c] if c in values else frame[c].to_numpy(dtype=float) for c in columns
+    ])
+
+# ----- Fitting -----
+
+def load_runs(queue_root):
+    """Finished tasks of a work queue with their features, runtime and peak memory."""
+    rows = []
+    for path in glob.glob(os.path.join(queue_root, 'done', '*.json')):
+        with open(path) as f:
+            record = json.load(f)
+        if 'features' in record:
+            rows.append(dict(record['features'], stage=record['stage'], tiled='--tiled' in record['args'],
+                             seconds=record['seconds'], max_rss_mb=record['max_rss_mb']))
+    return pd.DataFrame(rows)
+
+def _fit(X, y, ridge=1e-3):
+    """Ridge least squares (the intercept is not penalized). Returns coefficients and residual sd."""
+    penalty = ridge * np.eye(X.shape[1])
+    penalty[0, 0] = 0
+    beta = np.linalg.solve(X.T @ X + penalty, X.T @ y)
+    resid = y - X @ beta
+    return beta, float(np.sqrt(resid @ resid / max(len(y) - X.shape[1], 1)))
+
+def fit_cost_model(runs):
+    """
+    Model per (stage, tiled) fitted on recorded runs (from load_runs). The
+    untiled model of a stage with tiled runs also carries their memory
+    ratio (with the default model if the stage has too few untiled runs).
+    """
+    models = {}
+    for (stage, tiled), group in runs.groupby(['stage', 'tiled']):
+        if len(group) < 3:
+            continue
+        columns = FEATURES if len(group) >= MIN_RUNS_FULL else ['log_rows', 'log_mb']
+        X = design_matrix(group, columns)
+        seconds, seconds_sd = _fit(X, np.log(group['seconds'].to_numpy()))
+        memory, memory_sd = _fit(X, np.log(group['max_rss_mb'].to_numpy()))
+        models[(stage, bool(tiled))] = StageModel(columns, seconds.tolist(), memory.tolist(),
+                                                  seconds_sd, memory_sd, len(group))
+
+    # Memory ratio of the tiled runs to the untiled model of their stage
+    for stage, group in runs[runs['tiled']].groupby('stage'):
+        untiled = models.get((stage, False)) or DEFAULT_MODELS[stage]
+        X = design_matrix(group, untiled.features)
+        ratio = np.log(group['max_rss_mb'].to_numpy()) - X @ np.array(untiled.memory)
+        models[(stage, False)] = untiled._replace(tiled_memory=float(np.exp(np.median(ratio))))
+    return models
+
+def predict(models, stage, features, tiled=False):
+    """Predicted runtime (s) and peak memory (MB, a high quantile) of a task."""
+    model = models.get((stage, tiled))
+    factor = 1.0
+    if model is None:
+        model = models.get((stage, False)) or DEFAULT_MODELS[stage]
+        factor = model.tiled_memory if tiled else 1.0
+    X = design_matrix(features, model.features)[0]
+    seconds = float(np.exp(X @ model.seconds))
+    memory = float(np.exp(X @ model.memory + MEMORY_Z * model.memory_sd)) * factor
+    return seconds, max(memory, BASE_MB)
+
+def save_cost_model(models, path):
+    """Write a fitted model to JSON."""
+    with open(path, 'w') as f:
+        json.dump([dict(model._asdict(), stage=stage, tiled=tiled) for (stage, tiled), model in models.items()], f)
+
+def load_cost_model(path):
+    """Read a model written by save_cost_model (an empty model if there is none yet)."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        entries = json.load(f)
+    return {(e.pop('stage'), e.pop('tiled')): StageModel(**e) for e in entries}
+
+# ----- Planning -----
+
+def plan_tasks(tasks, models, memory_budget=None, tile_share=0.5):
+    """
+    Add the features, predicted runtime and peak memory to queue tasks
+    (from workqueue.city_task). Tasks predicted to need more than
+    tile_share of memory_budget (MB) run in tiled mode if their stage
+    supports it (TILED_STAGES). Returns the tasks, largest first.
+    """
+    features = {}
+    for task in tasks:
+        args = task['args']
+        rail = args[args.index('--rail') + 1] if '--rail' in args else None
+        key = (args[0], rail)
+        if key not in features:
+            features[key] = city_features(*key)
+        task['features'] = features[key]
+        task['seconds'], task['memory_mb'] = predict(models, task['stage'], task['features'], '--tiled' in args)
+        if (memory_budget and task['memory_mb'] > tile_share * memory_budget
+                and task['stage'] in TILED_STAGES and '--tiled' not in args):
+            task['args'] = args + ['--tiled']
+            task['seconds'], task['memory_mb'] = predict(models, task['stage'], task['features'], tiled=True)
+    return sorted(tasks, key=lambda task: -task['seconds'])
+
+def fit_report(models, runs):
+    """Median absolute error (%) of the runtime and memory predictions per stage on the recorded runs."""
+    rows = []
+    for (stage, tiled), group in runs.groupby(['stage', 'tiled']):
+        predicted = np.array([predict(models, stage, row, bool(tiled)) for row in group.to_dict('records')])
+        rows.append({
+            'stage': stage, 'tiled': tiled, 'runs': len(group),
+            'seconds_error': 100 * np.median(np.abs(predicted[:, 0] / group['seconds'].to_numpy() - 1)),
+            'memory_over': 100 * np.median(predicted[:, 1] / group['max_rss_mb'].to_numpy() - 1),
+        })
+    return pd.DataFrame(rows)
+
+# ----- Main -----
+
+def main():
+    """
+    Fit the cost model on the runs recorded in a work queue and save it
+    for the next plan_tasks. Replace file paths with your own data.
+    """
+    queue_path = '/shared/queue'
+    model_path = '/shared/queue/cost_model.json'
+
+    runs = load_runs(queue_path)
+    if runs.empty:
+        print(f"No recorded runs in {queue_path}")
+        return
+    models = fit_cost_model(runs)
+    save_cost_model(models, model_path)
+    print(fit_report(models, runs).to_string(index=False))
+    print(f"Cost model saved to {model_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Spatial density grids of the deduplicated road length.
+
+Totals per class hide where in a city each class is concentrated. Here
+the segments of the lines counted by road_lengths are split exactly at
+the boundaries of a regular metric grid (e.g. 500 m cells in the city's
+UTM zone): the crossings of every segment with the grid lines are
+generated as one ragged array, sorted within each segment, and each
+piece adds its share of the segment's length to its cell with one
+bincount. Lengths are the same (geodesic or planar) segment lengths as
+the totals, so the grid of a class sums to its total. Only non-empty
+cells are kept, as compact arrays saved per city and year.
+"""
+
+import numpy as np
+from collections import namedtuple
+
+from .citydata import class_codes
+
+DensityGrid = namedtuple('DensityGrid', ['cell', 'crs', 'origin', 'shape', 'road_types', 'code', 'row', 'col', 'length'])
+
+# ----- Splitting -----
+
+def split_segments(p1, p2, cell):
+    """
+    Pieces of the segments p1 -> p2 between the lines of a grid of the
+    given cell size. Returns the segment of every piece, its midpoint and
+    the fraction of the segment it covers.
+    """
+    c1, c2 = np.floor(p1 / cell), np.floor(p2 / cell)
+    low = np.minimum(c1, c2)
+    crossings = np.abs(c2 - c1).astype(np.int64)
+    m = len(p1)
+
+    segs, ts = [np.arange(m), np.arange(m)], [np.zeros(m), np.ones(m)]
+    for axis in (0, 1):
+        n = crossings[:, axis]
+        seg = np.repeat(np.arange(m), n)
+        k = low[seg, axis] + 1 + np.arange(len(seg)) - (np.cumsum(n) - n)[seg]
+        segs.append(seg)
+        ts.append((k * cell - p1[seg, axis]) / (p2 - p1)[seg, axis])
+
+    seg, t = np.concatenate(segs), np.concatenate(ts)
+    order = np.lexsort([t, seg])
+    seg, t = seg[order], t[order]
+    same = seg[1:] == seg[:-1]
+    seg, t0, t1 = seg[1:][same], t[:-1][same], t[1:][same]
+    piece = t1 > t0
+    seg, t0, t1 = seg[piece], t0[piece], t1[piece]
+    mid = p1[seg] + ((t0 + t1) / 2)[:, None] * (p2 - p1)[seg]
+    return seg, mid, t1 - t0
+
+# ----- Grids -----
+
+def density_grid(city, counted, road_types, cell=500, kind='utm'):
+    """
+    Length (km) of every road class in the cells of a metric grid.
+
+    counted selects the features (e.g. from counted_features). Cells are
+    laid out in the city's local projection (kind), or in its own CRS if
+    the city is already projected; row and column count from the
+    south-west corner (origin, in projected metres).
+    """
+    metric = city if city.units == 'metre' else city.to_metric(kind)
+    code = class_codes(city.road_class, road_types)[city.segment_feature]
+    ok = counted[city.segment_feature] & (code >= 0)
+    start = city.segment_start[ok]
+    p1, p2 = metric.coords[start], metric.coords[start + 1]
+    code, lengths = code[ok], city.segment_lengths[ok]
+
+    if not len(start):
+        empty = np.empty(0, dtype=np.int32)
+        return DensityGrid(cell, metric.crs, (0.0, 0.0), (0, 0), list(road_types),
+                           empty, empty, empty, np.empty(0, dtype=np.float32))
+
+    seg, mid, fraction = split_segments(p1, p2, cell)
+    origin = np.floor(np.minimum(p1.min(axis=0), p2.min(axis=0)) / cell)
+    cells = np.floor(mid / cell) - origin
+    col, row = cells[:, 0].astype(np.int64), cells[:, 1].astype(np.int64)
+    shape = (int(row.max()) + 1, int(col.max()) + 1)
+
+    key = (code[seg] * shape[0] + row) * shape[1] + col
+    totals = np.bincount(key, weights=lengths[seg] * fraction, minlength=len(road_types) * shape[0] * shape[1])
+    filled = np.flatnonzero(totals)
+    cls, rest = np.divmod(filled, shape[0] * shape[1])
+    row, col = np.divmod(rest, shape[1])
+    return DensityGrid(
+        cell, metric.crs, tuple(float(v) for v in origin * cell), shape, list(road_types),
+        cls.astype(np.int32), row.astype(np.int32), col.astype(np.int32), totals[filled].astype(np.float32),
+    )
+
+def to_dense(grid):
+    """Classes x rows x columns array of a density grid (row 0 at the southern edge)."""
+    dense = np.zeros((len(grid.road_types),) + tuple(grid.shape))
+    dense[grid.code, grid.row, grid.col] = grid.length
+    return dense
+
+def save_grid(grid, path):
+    """Write a density grid to a compressed .npz file."""
+    np.savez_compressed(
+        path, cell=grid.cell, crs=str(grid.crs), origin=grid.origin, shape=grid.shape,
+        road_types=grid.road_types, code=grid.code, row=grid.row, col=grid.col, length=grid.length,
+    )
+
+def load_grid(path):
+    """Read a density grid written by save_grid."""
+    with np.load(path) as data:
+        return DensityGrid(
+            float(data['cell']), str(data['crs']), tuple(data['origin'].tolist()), tuple(data['shape'].tolist()),
+            list(data['road_types']), data['code'], data['row'], data['col'], data['length'],
+        )
@@ -0,0 +1,132 @@
+"""
+Compact coordinate storage for city networks.
+
+The clipped city CSVs keep every geometry as WKT text, which is parsed
+again for every stage and run. Here the ragged coordinate arrays of a
+parsed city are stored instead: coordinates are quantized to integers
+on a fixed grid (1e-7 degrees, about 1 cm), and within every line part
+each vertex is stored as the int32 difference from the previous one,
+the first vertex of a part as its absolute value. Consecutive OSM
+vertices are close, so the deltas are small and compress well in the
+.npz file. Decoding is one cumulative sum over all vertices, restarted
+at every part start.
+
+Shared vertices are found on the exact integer coordinates of a decoded
+city, so junctions do not depend on floating point equality.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from collections import namedtuple
+
+from .citydata import LINESTRING, MULTILINESTRING, POINT, CityData, build_geometries
+
+# Quantization step of stored coordinates (degrees)
+PRECISION = 1e-7
+
+EncodedCoords = namedtuple('EncodedCoords', ['deltas', 'part_offsets', 'precision'])
+
+# ----- Encoding -----
+
+def quantize(coords, precision=PRECISION):
+    """Integer grid coordinates (int64) of float coordinates."""
+    return np.rint(np.asarray(coords) * np.rint(1 / precision)).astype(np.int64)
+
+def delta_encode(quantized, part_offsets):
+    """
+    int32 differences between consecutive vertices of every part; the
+    first vertex of each part is kept absolute.
+    """
+    deltas = quantized.copy()
+    deltas[1:] -= quantized[:-1]
+    starts = part_offsets[:-1][np.diff(part_offsets) > 0]
+    deltas[starts] = quantized[starts]
+    if len(deltas) and np.abs(deltas).max() >= 2 ** 31:
+        raise ValueError("Coordinates do not fit in int32 at this precision")
+    return deltas.astype(np.int32)
+
+def delta_decode(deltas, part_offsets):
+    """Integer coordinates (int64) from the deltas of delta_encode."""
+    total = np.cumsum(deltas, axis=0, dtype=np.int64)
+    counts = np.diff(part_offsets)
+    starts = part_offsets[:-1][counts > 0]
+    # Sum of everything before each part start, removed from the whole part
+    before = np.zeros((len(starts), deltas.shape[1]), dtype=np.int64)
+    before[starts > 0] = total[starts[starts > 0] - 1]
+    return total - np.repeat(before, counts[counts > 0], axis=0)
+
+def encode_coords(coords, part_offsets, precision=PRECISION):
+    """Quantized, delta-encoded coordinates of a city's ragged arrays."""
+    return EncodedCoords(delta_encode(quantize(coords, precision), part_offsets), part_offsets, precision)
+
+def decode_coords(encoded):
+    """Integer and float coordinates of encoded coordinates."""
+    quantized = delta_decode(encoded.deltas, encoded.part_offsets)
+    # Dividing by the integer scale gives the double nearest to the decimal
+    # value, the same as parsing the WKT text
+    return quantized, quantized / np.rint(1 / encoded.precision)
+
+# ----- Files -----
+
+def save_city(city, path, precision=PRECISION):
+    """Write the arrays of a (geographic) city to a compressed .npz file."""
+    if city.units != 'degree':
+        raise ValueError("Only geographic cities can be saved")
+    encoded = encode_coords(city.coords, city.part_offsets, precision)
+    # Geometries of other types (rare in road data) are kept as WKT
+    other = np.flatnonzero(~np.isin(city.type_id, [POINT, LINESTRING, MULTILINESTRING]) & (city.type_id >= 0))
+    np.savez_compressed(
+        path, osm_id=city.osm_id, fclass=city.fclass.astype(str), type_id=city.type_id.astype(np.int8),
+        part_feature=city.part_feature.astype(np.int32), part_offsets=city.part_offsets.astype(np.int64),
+        deltas=encoded.deltas, precision=precision, road_features=city.road_features,
+        other_rows=other, other_wkt=shapely.to_wkt(city.geoms[other], rounding_precision=-1).astype(str),
+    )
+
+def load_city(path):
+    """Read a city written by save_city."""
+    with np.load(path) as data:
+        encoded = EncodedCoords(data['deltas'], data['part_offsets'], float(data['precision']))
+        quantized, coords = decode_coords(encoded)
+        type_id, part_feature = data['type_id'].astype(np.int64), data['part_feature'].astype(np.int64)
+        geoms = build_geometries(type_id, part_feature, encoded.part_offsets, coords)
+        geoms[data['other_rows']] = shapely.from_wkt(data['other_wkt'])
+        return CityData.from_arrays(
+            data['osm_id'], data['fclass'].astype(object), type_id, part_feature,
+            encoded.part_offsets, coords, quantized, geoms,
+            road_features=data['road_features'] if 'road_features' in data else None,
+        )
+
+def convert_city(road_path, rail_path, path, precision=PRECISION):
+    """Parse the CSV files of a city once and write them in the compact format."""
+    save_city(CityData.from_csv(road_path, rail_path), path, precision)
+
+# ----- Main -----
+
+def main():
+    """
+    Convert the road and railway CSVs of every city and year to the
+    compact format. Replace file paths with your own data.
+    """
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    rail_csv_path = '/your_output_path/20{year}/railway/{city}_osm_railway.csv'
+    output_path = '/your_output_path/20{year}/compact/{city}.npz'
+
+    city_names = pd.read_excel(city_list_path)['city']
+    for year in range(15, 23):
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            rail_path = rail_csv_path.format(year=year, city=city_clean)
+            path = output_path.format(year=year, city=city_clean)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            convert_city(road_path, rail_path if os.path.exists(rail_path) else None, path)
+        print(f"Cities converted for year 20{year}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""
+Fused per-city analysis engine.
+
+Reads the road and railway data of a city once, parses the geometries
+once and produces, from the shared arrays and spatial index:
+
+- the deduplicated length of every road class (2-compute_osm_road_length.py)
+- the connection matrix of the road hierarchy (3-connecting.py)
+- the parallel-match table (4-parallel.py)
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from collections import namedtuple
+
+from .citydata import CityData, MULTILINESTRING, class_codes
+from .density import density_grid, save_grid
+from .encoding import load_city
+from .kernels import kernels
+
+# Road classes used by each stage (same lists as the scripts)
+LENGTH_TYPES = [
+    'motorway', 'primary', 'secondary', 'tertiary', 'trunk',
+    'residential', 'service', 'footway', 'subway', 'light_rail', 'monorail'
+]
+CONNECTING_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential', 'service', 'footway']
+PARALLEL_TYPES = [
+    'subway', 'light_rail', 'monorail', 'motorway', 'trunk', 'primary', 'secondary',
+    'tertiary', 'residential', 'service', 'footway'
+]
+
+# Distance thresholds of the stages: the scripts' values in degrees, and
+# their metric-mode counterparts in metres (0.001 degree is about 100 m)
+Thresholds = namedtuple('Thresholds', ['search_offset', 'centroid_distance', 'min_distance'])
+THRESHOLDS = {
+    'degree': Thresholds(search_offset=0.001, centroid_distance=0.001, min_distance=0.0003),
+    'metre': Thresholds(search_offset=100, centroid_distance=100, min_distance=30),
+}
+
+# Class groups of the connection matrix: 3-connecting.py merges trunk into
+# motorway and service into residential
+CLASS_GROUPS = {
+    'motorway': ['motorway', 'trunk'],
+    'primary': ['primary'],
+    'secondary': ['secondary'],
+    'tertiary': ['tertiary'],
+    'residential': ['residential', 'service'],
+    'footway': ['footway'],
+}
+
+# Features per spatial query in tiled mode
+TILE_SIZE = 20000
+
+CityResult = namedtuple('CityResult', ['lengths', 'matrix', 'matrix_types', 'matches', 'counts', 'grid'],
+                        defaults=(None,))
+
+# ----- Pairwise geometry -----
+
+def direction_cosines(city, i, j):
+    """Cosine of the angle between the start-to-end vectors of line pairs (0 if degenerate)."""
+    start, end = city.endpoints
+    return kernels().pair_cosines(end - start, i, j)
+
+def same_direction(city, i, j, centroid_distance=0.001, min_distance=0.0003):
+    """Vectorized is_same_direction: pairs that are opposite directions of the same road."""
+    cos_theta = direction_cosines(city, i, j)
+    d = city.centroids[i] - city.centroids[j]
+    mask = (np.hypot(d[:, 0], d[:, 1]) < centroid_distance) & (1 - np.abs(cos_theta) < 0.01) & (cos_theta < 0)
+    distance = shapely.distance(city.geoms[i[mask]], city.geoms[j[mask]])
+    mask[mask] = (distance > 0) & (distance < min_distance)
+    return mask
+
+def aligned(city, i, j, tolerance=0.1):
+    """Vectorized are_aligned: direction vectors at an angle near 0 or 180 degrees."""
+    return 1 - np.abs(direction_cosines(city, i, j)) < tolerance
+
+# ----- Stages -----
+
+def counted_features(city, road_types=LENGTH_TYPES, thresholds=None):
+    """
+    Features counted by road_lengths: lines of the road types, without the
+    shorter line of each opposite-direction duplicate pair and without
+    repeated identical geometries, plus every MultiLineString. Only the
+    rows of the road file are counted, as 2-compute_osm_road_length.py
+    reads the road CSV alone (rows of the railway file never are).
+    """
+    thresholds = thresholds or THRESHOLDS[city.units]
+    codes = class_codes(city.road_class, road_types)
+    codes[city.road_features:] = -1
+    is_line = np.zeros(len(city), dtype=bool)
+    is_line[city.lines] = True
+
+    # Duplicate pairs only occur within a class (class and its _link). Of
+    # every tile of candidates only the last candidate of each line and
+    # the duplicate pairs are kept
+    last = np.full(len(city), -1)
+    dup_i, dup_j = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for i, j in city.pair_tiles(thresholds.search_offset):
+        same = (codes[i] == codes[j]) & (codes[i] >= 0)
+        i, j = i[same], j[same]
+        np.maximum.at(last, i, j)
+        np.maximum.at(last, j, i)
+        dup = same_direction(city, i, j, thresholds.centroid_distance, thresholds.min_distance)
+        dup_i.append(i[dup])
+        dup_j.append(j[dup])
+    i, j = np.concatenate(dup_i), np.concatenate(dup_j)
+
+    # 2-compute_osm_road_length.py updates a set while visiting the lines
+    # in order: a line ends up in the last state written by the last visit
+    # that touches it. For every line, find the pair that decides it: its
+    # last candidate if that comes later, otherwise its last duplicate
+    # (candidates are visited in index order). It is dropped if it loses
+    # that pair and the pair is a duplicate; a line visited in its own
+    # turn also loses ties.
+    line, other = np.concatenate([i, j]), np.concatenate([j, i])
+    last_dup = np.full(len(city), -1)
+    np.maximum.at(last_dup, line, other)
+
+    deciding = np.where(last[line] > line, other == last[line], other == last_dup[line])
+    line, other = line[deciding], other[deciding]
+    own, partner = city.planar_lengths[line], city.planar_lengths[other]
+    loses = np.where(other > line, own < partner, own <= partner)
+    keep = is_line & (codes >= 0)
+    keep[line[loses]] = False
+
+    # Identical geometries are counted once per class
+    kept = np.flatnonzero(keep)
+    wkb = pd.DataFrame({'code': codes[kept], 'wkb': shapely.to_wkb(city.geoms[kept])})
+    keep[kept[wkb.duplicated().to_numpy()]] = False
+
+    # MultiLineStrings are counted in full
+    return keep | ((city.type_id == MULTILINESTRING) & (codes >= 0))
+
+def road_lengths(city, road_types=LENGTH_TYPES, thresholds=None, counted=None):
+    """
+    Total length (km) of every road class, with the shorter line of each
+    opposite-direction duplicate pair removed. Lengths are geodesic, or
+    planar for a city projected to a metric CRS. counted, if given, is
+    the precomputed counted_features mask.
+    """
+    codes = class_codes(city.road_class, road_types)
+    if counted is None:
+        counted = counted_features(city, road_types, thresholds)
+    totals = np.bincount(codes[counted], weights=city.feature_lengths[counted], minlength=len(road_types))
+    return dict(zip(road_types, totals))
+
+def raw_connection_counts(city, road_types=CONNECTING_TYPES):
+    """
+    Number of shared vertices between every pair of road classes.
+
+    The diagonal holds the number of vertices of every class; 3-connecting.py
+    only uses the off-diagonal entries. Counts are cached on the city, so
+    any grouping of the classes is evaluated without recounting.
+    """
+    key = tuple(road_types)
+    if key in city._connections:
+        return city._connections[key]
+    codes = class_codes(city.fclass, road_types)
+    code = codes[city.part_feature[city.coord_part]]
+    ok = (code >= 0) & (city.vertex_id >= 0)
+    n_vertices = int(city.vertex_id.max()) + 1 if len(city.vertex_id) else 0
+
+    # Each vertex becomes a bitmask of its classes; identical masks are counted together
+    masks = kernels().class_masks(city.vertex_id[ok], code[ok], n_vertices)
+    mask_values, mask_counts = np.unique(masks[masks != 0], return_counts=True)
+    bits = (mask_values[:, None] >> np.arange(len(road_types))) & 1
+    city._connections[key] = (bits * mask_counts[:, None]).T @ bits
+    return city._connections[key]
+
+def aggregation_matrix(road_types, groups=CLASS_GROUPS):
+    """
+    Classes x groups matrix P with P[i, g] = 1 when road type i belongs
+    to group g. Road types outside every group are dropped.
+    """
+    P = np.zeros((len(road_types), len(groups)))
+    for g, members in enumerate(groups.values()):
+        P[[list(road_types).index(road_type) for road_type in members], g] = 1
+    if (P.sum(axis=1) > 1).any():
+        raise ValueError("A road type belongs to more than one group")
+    return P
+
+def merge_matrix(matrix, road_types, groups=CLASS_GROUPS):
+    """
+    Aggregate a class x class count matrix into groups as P^T C P.
+    Connections within a group are cleared, as merge_matrix in
+    3-connecting.py does for the merged classes.
+    """
+    P = aggregation_matrix(road_types, groups)
+    merged = P.T @ np.asarray(matrix, dtype=float) @ P
+    np.fill_diagonal(merged, 0)
+    return merged, list(groups)
+
+def grouped_connections(counts, road_types=CONNECTING_TYPES, groups=CLASS_GROUPS):
+    """Row-normalized connection matrix of the class groups, from raw counts."""
+    counts = np.array(counts, dtype=float)
+    np.fill_diagonal(counts, 0)
+    matrix, merged_types = merge_matrix(counts, road_types, groups)
+    row_sums = matrix.sum(axis=1, keepdims=True)
+    matrix = np.divide(matrix, row_sums, out=np.zeros_like(matrix), where=row_sums != 0)
+    return matrix, merged_types
+
+def connection_matrix(city, road_types=CONNECTING_TYPES, groups=CLASS_GROUPS):
+    """Row-normalized connection matrix of the merged road classes."""
+    return grouped_connections(raw_connection_counts(city, road_types), road_types, groups)
+
+def _first_matches(city, order, src, dst):
+    """
+    Matches sorted by (order, src, dst), keeping the first of every target
+    class and osm_id pair. Applied per tile and again to the kept rows of
+    all tiles, it keeps the same rows as applied once to all matches.
+    """
+    sort = np.lexsort([dst, src, order])
+    order, src, dst = order[sort], src[sort], dst[sort]
+    osm_src, osm_dst = city.osm_id[src], city.osm_id[dst]
+    pairs = pd.DataFrame({'order': order, 'low': np.minimum(osm_src, osm_dst), 'high': np.maximum(osm_src, osm_dst)})
+    first = ~pairs.duplicated().to_numpy()
+    return order[first], src[first], dst[first]
+
+def parallel_matches(city, road_types=PARALLEL_TYPES, thresholds=None):
+    """
+    Lines of another class that are aligned with, and close to, a line of
+    each target class. Returns the table written by 4-parallel.py.
+    """
+    thresholds = thresholds or THRESHOLDS[city.units]
+    codes = class_codes(city.road_class, road_types)
+    fclass = pd.Series(city.fclass)
+    is_target = [fclass.str.contains(target, regex=False).to_numpy() for target in road_types]
+
+    found = []
+    for i, j in city.pair_tiles(thresholds.search_offset):
+        ok = aligned(city, i, j)
+        # Either line of an aligned pair can be the target
+        src = np.concatenate([i[ok], j[ok]])
+        dst = np.concatenate([j[ok], i[ok]])
+        dst_code = codes[dst]
+        sel = [is_target[order][src] & (dst_code >= 0) & (dst_code != order) for order in range(len(road_types))]
+        # Each osm_id pair is matched once per target class
+        found.append(_first_matches(
+            city, np.repeat(np.arange(len(road_types)), [s.sum() for s in sel]),
+            np.concatenate([src[s] for s in sel]), np.concatenate([dst[s] for s in sel]),
+        ))
+    order, _, dst = _first_matches(city, *(np.concatenate(arrays) for arrays in zip(*found)))
+
+    matches = pd.DataFrame({
+        'osm_id': city.osm_id[dst],
+        'match_type': np.array(road_types, dtype=object)[order],
+        'type': city.road_class[dst],
+        'geometry': city.geometry_wkt(dst),
+    })
+    return matches.drop_duplicates(subset=['osm_id', 'type']).reset_index(drop=True)
+
+def analyze(city, metric=None, grid_cell=None, tiled=False):
+    """
+    Run all stages on a parsed city. With metric set to 'utm' or 'aeqd',
+    the city is projected to a local metric CRS and the metre thresholds
+    and planar lengths are used. With grid_cell (metres), the counted
+    length of every class is also binned onto a density grid. tiled runs
+    the pair stages one tile of TILE_SIZE features at a time: the
+    candidate pairs of a tile are reduced before the next is queried, so
+    the pairs of the whole city are never held (same results, less peak
+    memory for the largest cities, at the cost of querying them twice).
+    """
+    if metric:
+        city = city.to_metric(metric)
+    if tiled:
+        city.tile_size = TILE_SIZE
+    counted = counted_features(city)
+    lengths = road_lengths(city, counted=counted)
+    grid = density_grid(city, counted, LENGTH_TYPES, grid_cell) if grid_cell else None
+    matrix, matrix_types = connection_matrix(city)
+    counts = raw_connection_counts(city)
+    return CityResult(lengths, matrix, matrix_types, parallel_matches(city), counts, grid)
+
+def analyze_city(road_path, rail_path=None, metric=None, grid_cell=None, tiled=False):
+    """Read a city once (CSV files, or a compact .npz from encoding.save_city) and run all stages on it."""
+    if road_path.endswith('.npz'):
+        return analyze(load_city(road_path), metric, grid_cell, tiled)
+    return analyze(CityData.from_csv(road_path, rail_path), metric, grid_cell, tiled)
+
+def main():
+    """
+    Run the fused analysis for every city and year, writing the results
+    to the result store as well. Replace file paths with your own data.
+    """
+    from .store import result_name, result_records, write_results
+
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    rail_csv_path = '/your_output_path/20{year}/railway/{city}_osm_railway.csv'
+    output_dir = '/your_path/to/output'
+    store_path = '/your_path/to/output/results'
+    metric = None  # 'utm' or 'aeqd' for metre thresholds in a local projection
+    grid_cell = None  # e.g. 500 for 500 m density grids of the counted lengths
+
+    city_names = pd.read_excel(city_list_path)['city']
+
+    for year in range(15, 23):
+        print(f"Processing year: 20{year}")
+        lengths, matrices, counts, names, rows = [], [], [], [], []
+
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            rail_path = rail_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+
+            result = analyze_city(road_path, rail_path if os.path.exists(rail_path) else None, metric, grid_cell)
+            lengths.append([city_clean] + list(result.lengths.values()))
+            matrices.append(result.matrix)
+            counts.append(result.counts)
+            names.append(city_clean)
+            rows.append(result_records(result, country, city_clean, 2000 + year))
+
+            matches = result.matches
+            if matches.empty:
+                matches = pd.DataFrame([{'osm_id': 0, 'match_type': 'none', 'type': 'none', 'geometry': 'NONE'}])
+            matches.to_csv(os.path.join(output_dir, f"20{year}", f"{city_clean}_matrix.csv"), index=False, encoding='utf-8')
+            if result.grid is not None:
+                save_grid(result.grid, os.path.join(output_dir, f"20{year}", f"{city_clean}_density.npz"))
+
+            print(f"{city_clean} done for year 20{year}")
+
+        header = ['City'] + [t.title().replace('_', ' ') for t in LENGTH_TYPES]
+        pd.DataFrame(lengths, columns=header).to_excel(os.path.join(output_dir, f"20{year}_road_lengths.xlsx"), index=False)
+        if matrices:
+            mean_matrix = pd.DataFrame(np.mean(matrices, axis=0), index=result.matrix_types, columns=result.matrix_types)
+            mean_matrix.to_csv(os.path.join(output_dir, f"20{year}_connection_matrix.csv"))
+            # Raw class counts, to evaluate other groupings with grouped_connections
+            np.savez_compressed(os.path.join(output_dir, f"20{year}_raw_connections.npz"),
+                                cities=names, counts=np.stack(counts), road_types=CONNECTING_TYPES)
+            write_results(store_path, pd.concat(rows, ignore_index=True), result_name(country, 'engine'))
+        print(f"Year 20{year} results saved to {output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+Reference-equivalence harness.
+
+The published figures come from the original scripts
+(2-compute_osm_road_length.py, 3-connecting.py, 4-parallel.py). Before a
+faster engine replaces them in production runs it has to give the same
+numbers. This harness runs the scripts' functions (compute,
+process_match, is_same_direction, are_aligned) and the engine side by
+side on the same cities, synthetic or sampled from the real city CSVs,
+and compares
+
+    lengths             every LENGTH_TYPES total, within a relative tolerance
+    connection matrix   every entry of the merged ratio matrix, within an absolute tolerance
+    parallel matches    the (osm_id, match_type, type) sets, up to a number of differences
+    pair predicates     same_direction and aligned on the candidate pairs, exactly
+
+and reports the differences and the speedup of every stage. The scripts
+are loaded from the repository root as modules; their own dependencies
+(rtree, geopy) are needed to run the harness.
+"""
+
+import glob
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import shapely
+from collections import namedtuple
+from functools import lru_cache
+
+from . import engine
+from .citydata import CityData
+
+# Directory of the reference scripts
+REFERENCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_SCRIPTS = {
+    'lengths': '2-compute_osm_road_length.py',
+    'connections': '3-connecting.py',
+    'parallel': '4-parallel.py',
+}
+
+Tolerances = namedtuple('Tolerances', ['length_rtol', 'matrix_atol', 'match_differences'])
+TOLERANCES = Tolerances(length_rtol=1e-6, matrix_atol=1e-9, match_differences=0)
+
+Comparison = namedtuple('Comparison', ['checks', 'timings'])
+
+# ----- Cities -----
+
+def synthetic_city(n=500, seed=0, x0=116.3, y0=39.9, span=0.05):
+    """
+    Synthetic city frame on a 0.0005 degree lattice: straight roads of
+    every class with shared vertices, opposite-direction duplicates
+    (some shorter), aligned parallel roads of other classes, a
+    MultiLineString and a Point.
+    """
+    rng = np.random.default_rng(seed)
+    classes = ['motorway', 'motorway_link', 'trunk', 'primary', 'secondary', 'tertiary',
+               'residential', 'service', 'footway', 'subway', 'unclassified']
+    steps = np.arange(0, span, 0.0005)
+    xs, ys = np.round(steps + x0, 7), np.round(steps + y0, 7)
+
+    def wkt(points):
+        return 'LINESTRING (' + ', '.join(f'{x} {y}' for x, y in points) + ')'
+
+    rows = []
+    for _ in range(n):
+        fclass = classes[rng.integers(len(classes))]
+        x, y = xs[rng.integers(len(xs) - 10)], ys[rng.integers(len(ys) - 10)]
+        horizontal = rng.random() < 0.5
+        dx, dy = (0.0005, 0) if horizontal else (0, 0.0005)
+        points = [(round(x + s * dx, 7), round(y + s * dy, 7)) for s in range(rng.integers(2, 6))]
+        rows.append((fclass, wkt(points)))
+        if rng.random() < 0.2:
+            # Other direction of the same road, 0.0001 apart
+            back = [(px + dy / 5, py + dx / 5) for px, py in points[::-1]]
+            if rng.random() < 0.5 and len(back) > 2:
+                back = back[:-1]
+            rows.append((fclass, wkt(back)))
+        if rng.random() < 0.2:
+            # Parallel road of another class, 0.0002 apart
+            rows.append((classes[rng.integers(len(classes))], wkt([(px + dy * 0.4, py + dx * 0.4) for px, py in points])))
+    rows.append(('residential', f'MULTILINESTRING (({x0} {y0}, {x0 + 0.001} {y0 + 0.001}), '
+                                f'({x0 + 0.002} {y0}, {x0 + 0.003} {y0 + 0.001}))'))
+    rows.append(('primary', f'POINT ({x0} {y0})'))
+    frame = pd.DataFrame(rows, columns=['fclass', 'geometry'])
+    frame.insert(0, 'osm_id', np.arange(1, len(frame) + 1))
+    return frame
+
+def sample_cities(pattern, k=5, seed=0):
+    """k road CSVs drawn at random from the files matching a glob pattern."""
+    paths = sorted(glob.glob(pattern))
+    rng = np.random.default_rng(seed)
+    return [paths[i] for i in sorted(rng.choice(len(paths), size=min(k, len(paths)), replace=False))]
+
+# ----- Reference runs -----
+
+@lru_cache(maxsize=None)
+def reference_script(stage):
+    """The reference script of a stage, loaded as a module."""
+    path = os.path.join(REFERENCE_DIR, REFERENCE_SCRIPTS[stage])
+    spec = importlib.util.spec_from_file_location(f"reference_{stage}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def reference_results(road_path, rail_path=None):
+    """Lengths, connection matrix and match set of the reference scripts, with the seconds of each."""
+    lengths, lengths_seconds = _timed(
+        lambda: {t: reference_script('lengths').compute(t, road_path) for t in engine.LENGTH_TYPES})
+
+    def connections():
+        frame = pd.read_csv(road_path, low_memory=False)
+        return np.array(reference_script('connections').process_match(frame, list(engine.CONNECTING_TYPES)))
+    matrix, matrix_seconds = _timed(connections)
+
+    def parallel():
+        paths = [road_path] if rail_path is None else [road_path, rail_path]
+        frame = pd.concat([pd.read_csv(p, low_memory=False) for p in paths], ignore_index=True)
+        found = []
+        for target in engine.PARALLEL_TYPES:
+            found = reference_script('parallel').process_match(target, frame, engine.PARALLEL_TYPES, found)
+        return match_set(pd.DataFrame(found, columns=['osm_id', 'match_type', 'type', 'geometry']))
+    matches, matches_seconds = _timed(parallel)
+
+    return (lengths, matrix, matches), {
+        'lengths': lengths_seconds, 'connections': matrix_seconds, 'parallel': matches_seconds,
+    }
+
+def engine_results(road_path, rail_path=None):
+    """
+    The same results from the engine, timed per stage. As in analyze, all
+    stages run on one city read from the road and railway files, so the
+    lengths are compared with the road-only reference as production runs
+    compute them.
+    """
+    city, parse_seconds = _timed(CityData.from_csv, road_path, rail_path)
+    lengths, lengths_seconds = _timed(engine.road_lengths, city)
+    (matrix, _), matrix_seconds = _timed(engine.connection_matrix, city)
+    matches, matches_seconds = _timed(engine.parallel_matches, city)
+    return (lengths, matrix, match_set(matches)), {
+        'parse': parse_seconds, 'lengths': lengths_seconds, 'connections': matrix_seconds,
+        'parallel': matches_seconds,
+    }
+
+def match_set(matches):
+    """Set of (osm_id, match_type, type) of a match table, after the scripts' deduplication."""
+    matches = matches.drop_duplicates(subset=['osm_id', 'type'])
+    return set(zip(matches['osm_id'].tolist(), matches['match_type'].tolist(), matches['type'].tolist()))
+
+def predicate_checks(road_path, max_pairs=20000, seed=0):
+    """
+    Pairs of candidate lines on which the vectorized same_direction and
+    aligned disagree with is_same_direction and are_aligned of the scripts.
+    """
+    city = CityData.from_csv(road_path)
+    i, j = city.candidate_pairs(engine.THRESHOLDS['degree'].search_offset)
+    if len(i) > max_pairs:
+        pick = np.random.default_rng(seed).choice(len(i), size=max_pairs, replace=False)
+        i, j = i[pick], j[pick]
+    same = engine.same_direction(city, i, j)
+    aligned = engine.aligned(city, i, j)
+    is_same_direction = reference_script('lengths').is_same_direction
+    are_aligned = reference_script('parallel').are_aligned
+    geoms = city.geoms
+    ref_same = np.array([is_same_direction(geoms[a], geoms[b])[0] for a, b in zip(i, j)], dtype=bool)
+    ref_aligned = np.array([are_aligned(geoms[a], geoms[b]) for a, b in zip(i, j)], dtype=bool)
+    return len(i), int((same != ref_same).sum()), int((aligned != ref_aligned).sum())
+
+# ----- Comparison -----
+
+def compare_city(name, road_path, rail_path=None, tolerances=TOLERANCES):
+    """Checks and timings of one city."""
+    (ref_lengths, ref_matrix, ref_matches), ref_seconds = reference_results(road_path, rail_path)
+    (lengths, matrix, matches), seconds = engine_results(road_path, rail_path)
+
+    checks = []
+    for road_type in engine.LENGTH_TYPES:
+        ref, value = ref_lengths[road_type], lengths[road_type]
+        checks.append(('lengths', road_type, ref, value, abs(value - ref),
+                       np.isclose(value, ref, rtol=tolerances.length_rtol, atol=1e-12)))
+    merged_types = list(engine.CLASS_GROUPS)
+    for a, row in enumerate(merged_types):
+        for b, col in enumerate(merged_types):
+            difference = abs(matrix[a, b] - ref_matrix[a, b])
+            checks.append(('connections', f"{row}-{col}", ref_matrix[a, b], matrix[a, b], difference,
+                           difference <= tolerances.matrix_atol))
+    differences = len(ref_matches ^ matches)
+    checks.append(('parallel', 'matches', len(ref_matches), len(matches), differences,
+                   differences <= tolerances.match_differences))
+    pairs, same_differences, aligned_differences = predicate_checks(road_path)
+    checks.append(('lengths', 'same_direction', pairs, pairs, same_differences, same_differences == 0))
+    checks.append(('parallel', 'aligned', pairs, pairs, aligned_differences, aligned_differences == 0))
+    checks = pd.DataFrame(checks, columns=['stage', 'item', 'reference', 'engine', 'difference', 'ok'])
+
+    timings = pd.DataFrame({
+        'stage': list(ref_seconds) + ['total'],
+        'reference_seconds': list(ref_seconds.values()) + [sum(ref_seconds.values())],
+        'engine_seconds': [seconds[s] for s in ref_seconds] + [sum(seconds.values())],
+    })
+    timings['speedup'] = timings['reference_seconds'] / timings['engine_seconds']
+    return Comparison(checks.assign(city=name), timings.assign(city=name))
+
+def run_harness(cities, tolerances=TOLERANCES):
+    """
+    Compare every (name, road_path, rail_path) city. Returns all checks,
+    all timings and the summary per stage.
+    """
+    comparisons = []
+    for name, road_path, rail_path in cities:
+        comparisons.append(compare_city(name, road_path, rail_path, tolerances))
+        failed = (~comparisons[-1].checks['ok']).sum()
+        print(f"{name}: {'ok' if not failed else f'{failed} differences'}")
+    checks = pd.concat([c.checks for c in comparisons], ignore_index=True)
+    timings = pd.concat([c.timings for c in comparisons], ignore_index=True)
+    return checks, timings, summarize(checks, timings)
+
+def summarize(checks, timings):
+    """Per stage: checks, failures, largest difference and the speedup over all cities."""
+    summary = checks.groupby('stage').agg(
+        checks=('ok', 'size'), failures=('ok', lambda ok: int((~ok).sum())), max_difference=('difference', 'max'))
+    seconds = timings.groupby('stage')[['reference_seconds', 'engine_seconds']].sum()
+    seconds['speedup'] = seconds['reference_seconds'] / seconds['engine_seconds']
+    return seconds.join(summary, how='left').reset_index()
+
+def synthetic_cities(directory, n_cities=5, size=600, seed=0):
+    """
+    Write synthetic cities to CSV files, with a railway file of subway and
+    light rail lines over the same lattice; returns harness (name,
+    road_path, rail_path) tuples.
+    """
+    cities = []
+    for k in range(n_cities):
+        path = os.path.join(directory, f"synthetic{k}_osm_road.csv")
+        rail_path = os.path.join(directory, f"synthetic{k}_osm_railway.csv")
+        synthetic_city(size, seed + k).to_csv(path, index=False)
+        rail = synthetic_city(size // 4, seed + n_cities + k)
+        rail['fclass'] = np.where(np.arange(len(rail)) % 2, 'subway', 'light_rail')
+        rail['osm_id'] += 10 ** 6
+        rail.to_csv(rail_path, index=False)
+        cities.append((f"synthetic{k}", path, rail_path))
+    return cities
+
+# ----- Main -----
+
+def main():
+    """
+    Compare the engine with the reference scripts on synthetic cities and
+    on a sample of real cities, and write the checks and timings. Exits
+    with status 1 if any check fails. Replace file paths with your own data.
+    """
+    road_pattern = '/your_output_path/2020/road/*_osm_road.csv'
+    rail_csv_path = '/your_output_path/2020/railway/{city}_osm_railway.csv'
+    output_dir = '/your_path/to/output/equivalence'
+    n_real, n_synthetic = 5, 5
+
+    with tempfile.TemporaryDirectory() as directory:
+        cities = synthetic_cities(directory, n_synthetic)
+        for road_path in sample_cities(road_pattern, n_real):
+            city = os.path.basename(road_path).replace('_osm_road.csv', '')
+            rail_path = rail_csv_path.format(city=city)
+            cities.append((city, road_path, rail_path if os.path.exists(rail_path) else None))
+        checks, timings, summary = run_harness(cities)
+
+    os.makedirs(output_dir, exist_ok=True)
+    checks.to_csv(os.path.join(output_dir, 'checks.csv'), index=False)
+    timings.to_csv(os.path.join(output_dir, 'timings.csv'), index=False)
+    print(summary.to_string(index=False))
+    if not checks['ok'].all():
+        print(checks[~checks['ok']].to_string(index=False))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Sampled betweenness and hierarchy flows on the road graph.
+
+The graph is built from the deduplicated road segments (the lines
+counted by road_lengths): nodes are shared vertices and every segment is
+an undirected edge weighted by its geodesic length. Edge betweenness is
+estimated by source sampling: shortest-path trees are grown from k
+random sources with scipy's Dijkstra, and the load of every tree edge
+(the number of targets reached through it) is accumulated level by
+level. With k = ln(2m / delta) / (2 epsilon^2) sources, every normalized
+edge betweenness is within epsilon of its exact value with probability
+1 - delta (Hoeffding bound with a union bound over the m edges). Batches
+of sources run on a process pool. The share of the flow carried by each
+fclass is the betweenness summed over its edges.
+
+Ties between equal shortest paths are broken by Dijkstra's predecessor
+choice, so each pair contributes one path.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+
+from .citydata import CityData, class_codes
+from .engine import LENGTH_TYPES, counted_features
+from .shared import SharedData, attach_arrays, shared_arrays
+from .store import records, result_name, write_results
+
+# Road classes of the graph (rail excluded)
+GRAPH_TYPES = [t for t in LENGTH_TYPES if t not in ('subway', 'light_rail', 'monorail')]
+
+# Dijkstra sources per block in tiled mode (each block holds sources x nodes arrays)
+TILED_BLOCK = 4
+
+# ----- Graph -----
+
+def road_graph(city, road_types=GRAPH_TYPES):
+    """
+    Undirected graph of the deduplicated segments of the road types.
+
+    Returns the CSR matrix of edge lengths (km, upper triangle only) and
+    an edge table with the end nodes u < v, feature row, fclass and length.
+    Of parallel segments between the same two nodes the shortest is kept.
+    """
+    features = counted_features(city, LENGTH_TYPES) & (class_codes(city.road_class, road_types) >= 0)
+    start = city.vertex_id[city.segment_start]
+    end = city.vertex_id[city.segment_start + 1]
+    ok = features[city.segment_feature] & (start != end)
+    a, b = np.minimum(start[ok], end[ok]), np.maximum(start[ok], end[ok])
+    feature, length = city.segment_feature[ok], city.segment_lengths[ok]
+
+    # Compact node ids, then one edge per node pair
+    nodes, inverse = np.unique(np.concatenate([a, b]), return_inverse=True)
+    u, v = inverse[:len(a)], inverse[len(a):]
+    order = np.lexsort([length, v, u])
+    u, v, feature, length = u[order], v[order], feature[order], length[order]
+    first = np.ones(len(u), dtype=bool)
+    first[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+    u, v, feature, length = u[first], v[first], feature[first], length[first]
+
+    graph = sparse.csr_matrix((length, (u, v)), shape=(len(nodes), len(nodes)))
+    edges = pd.DataFrame({
+        'u': u, 'v': v, 'feature': feature, 'fclass': city.fclass[feature], 'length': length,
+    })
+    return graph, edges
+
+def sample_size(n_edges, epsilon=0.01, delta=0.1):
+    """Sources needed for all normalized edge betweenness values to be within epsilon with probability 1 - delta."""
+    return int(np.ceil(np.log(2 * max(n_edges, 1) / delta) / (2 * epsilon ** 2)))
+
+# ----- Betweenness -----
+
+def tree_depths(pred):
+    """Hops from the root of every node of a shortest-path tree, by pointer jumping (0 for roots and unreached nodes)."""
+    has_parent = pred >= 0
+    ancestor = np.where(has_parent, pred, np.arange(len(pred)))
+    depth = has_parent.astype(np.int64)
+    while True:
+        next_ancestor = ancestor[ancestor]
+        if np.array_equal(next_ancestor, ancestor):
+            return depth
+        depth = depth + depth[ancestor]
+        ancestor = next_ancestor
+
+def tree_loads(pred):
+    """Number of tree nodes at or below every node reached from the root (0 for the root and unreached nodes)."""
+    reached = pred >= 0
+    size = reached.astype(float)
+    depth = tree_depths(pred)
+    order = np.argsort(-depth[reached], kind='stable')
+    nodes = np.flatnonzero(reached)[order]
+    levels = np.flatnonzero(np.diff(depth[nodes])) + 1
+    # Deepest level first: every node passes its subtree on to its parent
+    for level in np.split(nodes, levels):
+        np.add.at(size, pred[level], size[level])
+    size[~reached] = 0
+    return size
+
+def _edge_keys(u, v, n):
+    return np.minimum(u, v) * n + np.maximum(u, v)
+
+def _source_loads(args):
+    """
+    Summed edge loads of the trees of a batch of sources (runs in a worker
+    process). graph may be the handle of the shared graph arrays.
+    """
+    graph, sources, edge_keys, block = args
+    if isinstance(graph, SharedData):
+        arrays, meta = attach_arrays(graph)
+        graph = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']))
+        edge_keys = arrays['edge_keys']
+    n = graph.shape[0]
+    loads = np.zeros(len(edge_keys))
+    for start in range(0, len(sources), block):
+        _, preds = dijkstra(graph, directed=False, indices=sources[start:start + block], return_predecessors=True)
+        for pred in preds:
+            size = tree_loads(pred)
+            child = np.flatnonzero(size > 0)
+            edge = np.searchsorted(edge_keys, _edge_keys(pred[child], child, n))
+            loads += np.bincount(edge, weights=size[child], minlength=len(edge_keys))
+    return loads
+
+def edge_betweenness(graph, edges, epsilon=0.05, delta=0.1, samples=None, seed=0, processes=None, block=32):
+    """
+    Normalized edge betweenness estimated from sampled sources: the share
+    of the ordered node pairs whose shortest path uses each edge.
+
+    The number of sources is samples, or the sample_size of the error
+    bound (all nodes, i.e. exact, if that is not smaller).
+    """
+    n = graph.shape[0]
+    if n < 2:
+        return np.zeros(len(edges))
+    k = min(samples or sample_size(len(edges), epsilon, delta), n)
+    sources = np.random.default_rng(seed).choice(n, size=k, replace=False)
+
+    edge_keys = _edge_keys(edges['u'].to_numpy(), edges['v'].to_numpy(), n)
+    n_tasks = min(k, (processes or os.cpu_count() or 1) * 4)
+    batches = np.array_split(sources, n_tasks)
+    if processes == 1 or n_tasks == 1:
+        loads = sum(_source_loads((graph, batch, edge_keys, block)) for batch in batches)
+    else:
+        # Workers map the graph from shared memory instead of unpickling a copy per task
+        arrays = {'data': graph.data, 'indices': graph.indices, 'indptr': graph.indptr, 'edge_keys': edge_keys}
+        with shared_arrays(arrays, {'shape': list(graph.shape)}) as shared:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                loads = sum(pool.map(_source_loads, [(shared, batch, None, block) for batch in batches]))
+    return loads / (k * (n - 1))
+
+# ----- Flows -----
+
+def flow_shares(edges, betweenness, by='fclass'):
+    """
+    Share of the sampled shortest-path flow carried by each class: by
+    betweenness (pairs routed) and by betweenness x length (flow-km),
+    next to the class's share of the network length.
+    """
+    flows = edges.assign(flow=betweenness, flow_km=betweenness * edges['length'])
+    shares = flows.groupby(by)[['length', 'flow', 'flow_km']].sum()
+    shares = shares / shares.sum()
+    return shares.rename(columns=lambda c: f"{c}_share").reset_index()
+
+def city_flows(city, epsilon=0.05, delta=0.1, samples=None, seed=0, processes=None, tiled=False):
+    """
+    Edge betweenness and flow shares of one city. Returns the edge table
+    and the shares. tiled trades speed for memory: one process and small
+    blocks of sources.
+    """
+    graph, edges = road_graph(city)
+    if tiled:
+        processes, block = 1, TILED_BLOCK
+    else:
+        block = 32
+    edges['betweenness'] = edge_betweenness(graph, edges, epsilon, delta, samples, seed, processes, block)
+    return edges, flow_shares(edges, edges['betweenness'])
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the flow shares of every city and year and write them to the
+    result store (metrics flow_share and flow_km_share, by fclass).
+    Replace file paths with your own data.
+    """
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    store_path = '/your_path/to/output/results'
+    epsilon, delta = 0.05, 0.1
+
+    city_names = pd.read_excel(city_list_path)['city']
+    for year in range(15, 23):
+        rows = []
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            _, shares = city_flows(CityData.from_csv(road_path), epsilon, delta)
+            for metric in ['flow_share', 'flow_km_share']:
+                rows.append(records(shares, country, city_clean, 2000 + year, metric, 'fclass', value=metric))
+            print(f"{city_clean} done for year 20{year}")
+        if rows:
+            write_results(store_path, pd.concat(rows, ignore_index=True), result_name(country, 'flows'))
+    print(f"Flow shares saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Node-level hierarchy statistics.
+
+3-connecting.py reduces a city to a class-by-class ratio matrix. Here
+every junction (a vertex shared by two or more roads) keeps its degree,
+the set of road classes incident to it (a bitmask over the classes) and
+the highest and lowest class present. The node table comes from grouped
+reductions (unique + bincount) over the node x feature and node x class
+incidence of the segment ends. Per city it is summarized into the degree
+distribution of the junctions of every class and the share of the
+junctions of one class that also touch another (e.g. motorway junctions
+touching residential roads).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+from .citydata import CityData, class_codes
+from .engine import CONNECTING_TYPES
+from .kernels import kernels
+from .store import records, result_name, write_results
+
+# Road classes of the hierarchy, from the highest down
+HIERARCHY_TYPES = CONNECTING_TYPES
+
+# ----- Node table -----
+
+def node_incidence(city, road_types=HIERARCHY_TYPES):
+    """Node, feature and class code of both ends of every segment of the road types."""
+    code = class_codes(city.road_class, road_types)[city.segment_feature]
+    start = city.vertex_id[city.segment_start]
+    end = city.vertex_id[city.segment_start + 1]
+    ok = (code >= 0) & (start != end)
+    node = np.concatenate([start[ok], end[ok]])
+    feature = np.tile(city.segment_feature[ok], 2)
+    return node, feature, np.tile(code[ok], 2)
+
+def node_table(city, road_types=HIERARCHY_TYPES, junctions_only=True):
+    """
+    One row per node: coordinates, degree (incident segments), number of
+    incident roads, bitmask of incident classes (bit i for road_types[i]),
+    number of classes, and the highest and lowest class present.
+    With junctions_only, nodes of a single road are left out.
+    """
+    node, feature, code = node_incidence(city, road_types)
+    n_nodes = int(city.vertex_id.max()) + 1 if len(city.vertex_id) else 0
+    degree = np.bincount(node, minlength=n_nodes)
+
+    node_feature = np.unique(node * len(city) + feature)
+    roads = np.bincount(node_feature // len(city), minlength=n_nodes)
+    node_class = np.unique(node * len(road_types) + code)
+    node_of = node_class // len(road_types)
+    classes = kernels().class_masks(node, code, n_nodes)
+    n_classes = np.bincount(node_of, minlength=n_nodes)
+
+    keep = degree > 0
+    if junctions_only:
+        keep &= roads >= 2
+    ids = np.flatnonzero(keep)
+
+    xy = np.empty((n_nodes, 2))
+    has_id = city.vertex_id >= 0
+    xy[city.vertex_id[has_id]] = city.coords[has_id]
+    mask = classes[ids]
+    highest = np.log2(mask & -mask).astype(int)
+    lowest = np.floor(np.log2(mask)).astype(int)
+    return pd.DataFrame({
+        'node': ids, 'x': xy[ids, 0], 'y': xy[ids, 1],
+        'degree': degree[ids], 'roads': roads[ids],
+        'classes': mask, 'n_classes': n_classes[ids],
+        'highest': pd.Categorical.from_codes(highest, road_types),
+        'lowest': pd.Categorical.from_codes(lowest, road_types),
+    })
+
+def incident_classes(mask, road_types=HIERARCHY_TYPES):
+    """Class names of a bitmask of the node table."""
+    return [road_type for bit, road_type in enumerate(road_types) if mask >> bit & 1]
+
+def class_bits(nodes, road_types=HIERARCHY_TYPES):
+    """Nodes x classes 0/1 incidence matrix."""
+    return (nodes['classes'].to_numpy()[:, None] >> np.arange(len(road_types))) & 1
+
+# ----- Distributions -----
+
+def degree_distribution(nodes, road_types=HIERARCHY_TYPES):
+    """
+    Number of junctions of every degree among the junctions touching each
+    class. Returns a tidy table: road_type, degree, count.
+    """
+    node, cls = np.nonzero(class_bits(nodes, road_types))
+    degree = nodes['degree'].to_numpy()[node]
+    width = int(degree.max()) + 1 if len(degree) else 1
+    counts = np.bincount(cls * width + degree, minlength=len(road_types) * width).reshape(len(road_types), width)
+    cls, degree = np.nonzero(counts)
+    return pd.DataFrame({
+        'road_type': np.array(road_types, dtype=object)[cls], 'degree': degree, 'count': counts[cls, degree],
+    })
+
+def touch_shares(nodes, road_types=HIERARCHY_TYPES):
+    """
+    Share of the junctions touching class a that also touch class b
+    (rows a, columns b); the diagonal is 1 for classes with junctions.
+    """
+    bits = class_bits(nodes, road_types)
+    both = bits.T @ bits
+    total = np.diag(both).astype(float)[:, None]
+    shares = np.divide(both, total, out=np.zeros(both.shape), where=total != 0)
+    return pd.DataFrame(shares, index=list(road_types), columns=list(road_types))
+
+def class_summary(nodes, road_types=HIERARCHY_TYPES):
+    """
+    Per class: number of junctions touching it, their mean degree, and the
+    shares of them where it is the highest or the lowest class present.
+    """
+    bits = class_bits(nodes, road_types)
+    junctions = bits.sum(axis=0)
+    degree = nodes['degree'].to_numpy()
+    highest = np.bincount(nodes['highest'].cat.codes, minlength=len(road_types))
+    lowest = np.bincount(nodes['lowest'].cat.codes, minlength=len(road_types))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({
+            'road_type': list(road_types), 'junctions': junctions,
+            'mean_degree': (bits * degree[:, None]).sum(axis=0) / junctions,
+            'highest_share': highest / junctions, 'lowest_share': lowest / junctions,
+        })
+
+def junction_statistics(city, road_types=HIERARCHY_TYPES):
+    """Degree distribution, class summary and tidy touch shares of one city."""
+    nodes = node_table(city, road_types)
+    shares = touch_shares(nodes, road_types).stack().rename('share').rename_axis(['road_type', 'touches'])
+    return degree_distribution(nodes, road_types), class_summary(nodes, road_types), shares.reset_index()
+
+def junction_records(degrees, summary, shares, country, city, year):
+    """
+    Rows of the result store: the class summary metrics, touch_share (by
+    touched class) and junction_count (by degree, as other_type).
+    """
+    rows = [records(summary, country, city, year, metric, value=metric)
+            for metric in ['junctions', 'mean_degree', 'highest_share', 'lowest_share']]
+    rows.append(records(shares, country, city, year, 'touch_share', other_type='touches', value='share'))
+    rows.append(records(degrees, country, city, year, 'junction_count', other_type='degree', value='count'))
+    return pd.concat(rows, ignore_index=True)
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the junction statistics of every city and year and write
+    them to the result store. Replace file paths with your own data.
+    """
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    store_path = '/your_path/to/output/results'
+
+    city_names = pd.read_excel(city_list_path)['city']
+    for year in range(15, 23):
+        rows = []
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            statistics = junction_statistics(CityData.from_csv(road_path))
+            rows.append(junction_records(*statistics, country, city_clean, 2000 + year))
+        if rows:
+            write_results(store_path, pd.concat(rows, ignore_index=True), result_name(country, 'junctions'))
+        print(f"Junction statistics done for year 20{year}")
+    print(f"Junction statistics saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
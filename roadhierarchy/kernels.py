@@ -0,0 +1,246 @@
+"""
+Numeric kernels of the hot loops, with pluggable backends.
+
+The inner loops of the stages are the geodesic length of every segment
+and its sum per feature (2-compute_osm_road_length.py), the direction
+cosine of every candidate pair (is_same_direction / are_aligned) and the
+class bitmask of every shared vertex (3-connecting.py, junctions). The
+'numpy' backend expresses them with vectorized NumPy and pyproj calls.
+The 'numba' backend compiles the same loops with Numba, if it is
+installed: one pass over the ragged arrays, no temporaries. They are
+compiled single-threaded: Numba's threading layer does not survive the
+fork of the process pools used by the stages (the interpreter hangs at
+exit), and the stages already parallelize over cities. Its geodesic
+distances use Vincenty's inverse formula on the WGS84 ellipsoid, which
+agrees with pyproj (Karney) to well below a millimetre for road segments.
+
+The backend is chosen by the ROADHIERARCHY_KERNELS environment variable
+('numpy', the default, 'numba', or 'auto': Numba when installed) or
+with use_backend. When Numba is missing or fails to compile, the NumPy
+kernels are used. benchmark() times both backends on a city.
+"""
+
+import os
+import time
+import warnings
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+from .projection import geod
+
+KERNELS_ENV = 'ROADHIERARCHY_KERNELS'
+BACKENDS = ['numpy', 'numba']
+
+Kernels = namedtuple('Kernels', ['name', 'geodesic_distance', 'ragged_sum', 'pair_cosines', 'class_masks'])
+
+_backend = None
+
+# ----- NumPy kernels -----
+
+def geodesic_distance(lon1, lat1, lon2, lat2):
+    """WGS84 geodesic distance (m) between point pairs."""
+    return geod().inv(lon1, lat1, lon2, lat2)[2]
+
+def ragged_sum(values, owner, n):
+    """Sum of values per owner (0 .. n-1)."""
+    return np.bincount(owner, weights=values, minlength=n)
+
+def pair_cosines(vectors, i, j):
+    """Cosine of the angle between vectors i and j (0 if either is degenerate)."""
+    v1, v2 = vectors[i], vectors[j]
+    dot = np.einsum('ij,ij->i', v1, v2)
+    magnitude = np.hypot(v1[:, 0], v1[:, 1]) * np.hypot(v2[:, 0], v2[:, 1])
+    return np.divide(dot, magnitude, out=np.zeros_like(dot), where=magnitude != 0)
+
+def class_masks(vertex, code, n):
+    """Bitmask of the codes (< 63) present at every vertex (0 .. n-1)."""
+    width = int(code.max()) + 1 if len(code) else 1
+    pairs = np.unique(vertex * width + code)
+    vertex, code = np.divmod(pairs, width)
+    # In int64: float weights of bincount are only exact up to bit 52
+    masks = np.zeros(n, dtype=np.int64)
+    np.bitwise_or.at(masks, vertex, np.left_shift(np.int64(1), code.astype(np.int64)))
+    return masks
+
+NUMPY_KERNELS = Kernels('numpy', geodesic_distance, ragged_sum, pair_cosines, class_masks)
+
+# ----- Numba kernels -----
+
+def numba_kernels():
+    """The compiled kernels (raises ImportError without Numba)."""
+    import numba
+
+    @numba.njit(cache=True)
+    def _vincenty(lon1, lat1, lon2, lat2):
+        a, f = 6378137.0, 1 / 298.257223563
+        b = a * (1 - f)
+        out = np.empty(len(lon1))
+        for k in range(len(lon1)):
+            L = np.radians(lon2[k] - lon1[k])
+            U1 = np.arctan((1 - f) * np.tan(np.radians(lat1[k])))
+            U2 = np.arctan((1 - f) * np.tan(np.radians(lat2[k])))
+            sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+            lam = L
+            sin_sigma = cos_sigma = sigma = cos2_alpha = cos_2sm = 0.0
+            for _ in range(200):
+                sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+                sin_sigma = np.sqrt((cosU2 * sin_lam) ** 2 + (cosU1 * sinU2 - sinU1 * cosU2 * cos_lam) ** 2)
+                if sin_sigma == 0:
+                    break
+                cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+                sigma = np.arctan2(sin_sigma, cos_sigma)
+                sin_alpha = cosU1 * cosU2 * sin_lam / sin_sigma
+                cos2_alpha = 1 - sin_alpha ** 2
+                cos_2sm = cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha if cos2_alpha != 0 else 0.0
+                C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+                previous = lam
+                lam = L + (1 - C) * f * sin_alpha * (
+                    sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm ** 2)))
+                if abs(lam - previous) < 1e-12:
+                    break
+            if sin_sigma == 0:
+                out[k] = 0.0
+                continue
+            u2 = cos2_alpha * (a * a - b * b) / (b * b)
+            A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+            B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+            delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+                cos_sigma * (-1 + 2 * cos_2sm ** 2)
+                - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+            out[k] = b * A * (sigma - delta_sigma)
+        return out
+
+    @numba.njit(cache=True)
+    def _ragged_sum(values, owner, n):
+        out = np.zeros(n)
+        for k in range(len(values)):
+            out[owner[k]] += values[k]
+        return out
+
+    @numba.njit(cache=True)
+    def _pair_cosines(vectors, i, j):
+        out = np.zeros(len(i))
+        for k in range(len(i)):
+            x1, y1 = vectors[i[k], 0], vectors[i[k], 1]
+            x2, y2 = vectors[j[k], 0], vectors[j[k], 1]
+            magnitude = np.hypot(x1, y1) * np.hypot(x2, y2)
+            if magnitude != 0:
+                out[k] = (x1 * x2 + y1 * y2) / magnitude
+        return out
+
+    @numba.njit(cache=True)
+    def _class_masks(vertex, code, n):
+        out = np.zeros(n, dtype=np.int64)
+        for k in range(len(vertex)):
+            out[vertex[k]] |= np.int64(1) << code[k]
+        return out
+
+    def geodesic_distance(lon1, lat1, lon2, lat2):
+        return _vincenty(*(np.ascontiguousarray(v, dtype=np.float64) for v in (lon1, lat1, lon2, lat2)))
+
+    def ragged_sum(values, owner, n):
+        return _ragged_sum(np.asarray(values, dtype=np.float64), np.asarray(owner, dtype=np.int64), n)
+
+    def pair_cosines(vectors, i, j):
+        return _pair_cosines(np.asarray(vectors, dtype=np.float64), np.asarray(i, dtype=np.int64),
+                             np.asarray(j, dtype=np.int64))
+
+    def class_masks(vertex, code, n):
+        return _class_masks(np.asarray(vertex, dtype=np.int64), np.asarray(code, dtype=np.int64), n)
+
+    return Kernels('numba', geodesic_distance, ragged_sum, pair_cosines, class_masks)
+
+# ----- Backend selection -----
+
+def _load(name):
+    if name == 'numpy':
+        return NUMPY_KERNELS
+    try:
+        kernels = numba_kernels()
+        # Compile now, so that a failure falls back here instead of mid-stage
+        kernels.ragged_sum(np.zeros(1), np.zeros(1, dtype=np.int64), 1)
+        kernels.pair_cosines(np.ones((1, 2)), np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        kernels.class_masks(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), 1)
+        kernels.geodesic_distance(np.zeros(1), np.zeros(1), np.ones(1), np.ones(1))
+        return kernels
+    except ImportError:
+        if name == 'numba':
+            warnings.warn("Numba is not installed; using the NumPy kernels")
+    except Exception as error:
+        warnings.warn(f"Numba kernels failed to compile ({error}); using the NumPy kernels")
+    return NUMPY_KERNELS
+
+def use_backend(name):
+    """Select the kernel backend ('numpy', 'numba' or 'auto'). Returns the kernels in use."""
+    global _backend
+    if name not in BACKENDS + ['auto']:
+        raise ValueError(f"Unknown kernel backend: {name}")
+    _backend = _load(name)
+    return _backend
+
+def kernels():
+    """Kernels of the selected backend."""
+    if _backend is None:
+        use_backend(os.environ.get(KERNELS_ENV, 'numpy'))
+    return _backend
+
+# ----- Benchmark -----
+
+def _best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def benchmark(city, repeat=3):
+    """
+    Seconds of every kernel on the arrays of a city with each available
+    backend (compilation excluded), and the largest difference from NumPy.
+    """
+    from .engine import CONNECTING_TYPES, THRESHOLDS
+    from .citydata import class_codes
+
+    p1, p2 = city.coords[city.segment_start], city.coords[city.segment_start + 1]
+    meters = geodesic_distance(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1]) / 1000
+    start, end = city.endpoints
+    i, j = city.candidate_pairs(THRESHOLDS[city.units].search_offset)
+    code = class_codes(city.fclass, CONNECTING_TYPES)[city.part_feature[city.coord_part]]
+    ok = (code >= 0) & (city.vertex_id >= 0)
+    vertex, code = city.vertex_id[ok], code[ok]
+    n_vertices = int(city.vertex_id.max()) + 1 if len(city.vertex_id) else 0
+    cases = {
+        'geodesic_distance': lambda k: k.geodesic_distance(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1]),
+        'ragged_sum': lambda k: k.ragged_sum(meters, city.segment_feature, len(city)),
+        'pair_cosines': lambda k: k.pair_cosines(end - start, i, j),
+        'class_masks': lambda k: k.class_masks(vertex, code, n_vertices),
+    }
+
+    rows = []
+    for name in BACKENDS:
+        backend = _load(name)
+        if backend.name != name:
+            continue
+        for kernel, case in cases.items():
+            seconds, result = _best_time(lambda: case(backend), repeat)
+            reference = case(NUMPY_KERNELS)
+            difference = np.nanmax(np.abs(result - reference) / np.maximum(np.abs(reference), 1)) if len(result) else 0.0
+            rows.append({'kernel': kernel, 'backend': name, 'size': len(result),
+                         'seconds': seconds, 'max_difference': difference})
+    table = pd.DataFrame(rows)
+    table['speedup'] = table['kernel'].map(table[table['backend'] == 'numpy'].set_index('kernel')['seconds']) / table['seconds']
+    return table
+
+# ----- Main -----
+
+def main():
+    """Benchmark the kernel backends on one city. Replace the file path with your own data."""
+    from .citydata import CityData
+
+    road_csv_path = '/your_output_path/2020/road/Shanghai_osm_road.csv'
+    print(benchmark(CityData.from_csv(road_csv_path)).to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Local Moran's I (LISA) of the SAMI residuals.
+
+Spatial weights are built from city coordinates with a KD-tree, either
+the k nearest neighbours or a distance band, and stored as a sparse
+row-standardized matrix. Local statistics are computed for every city
+and significance is assessed by conditional permutation: the same
+permutation draws are reused for every city, so the permuted spatial
+lags of a block of cities are one array operation. Blocks of cities run
+on a process pool.
+
+Cluster codes follow GeoDa's LISA_CL field: 0 not significant,
+1 High-High, 2 Low-Low, 3 Low-High, 4 High-Low.
+"""
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from .sami import load_residuals
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Road types mapped to the cluster columns of Fig8.py
+LISA_COLUMNS = {'LISA_CL_M': 'motorway*', 'LISA_CL_F': 'footway'}
+# Columns of local_moran, stored as the metrics lisa_*
+LISA_STATS = ['I', 'lag', 'p_value', 'cluster']
+
+# ----- Spatial weights -----
+
+def unit_vectors(lon, lat):
+    """Longitude/latitude (degrees) as 3D unit vectors, so chord distances order like great-circle ones."""
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+def row_standardize(w):
+    """Scale every row of a sparse weights matrix to sum to one (rows without neighbours stay zero)."""
+    row_sums = np.asarray(w.sum(axis=1)).ravel()
+    scale = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums != 0)
+    return sparse.diags(scale) @ w
+
+def knn_weights(lon, lat, k=8):
+    """Row-standardized k-nearest-neighbour weights as a CSR matrix."""
+    points = unit_vectors(lon, lat)
+    n = len(points)
+    k = min(k, n - 1)
+    _, idx = cKDTree(points).query(points, k=k + 1)
+    rows = np.repeat(np.arange(n), k)
+    w = sparse.csr_matrix((np.ones(n * k), (rows, idx[:, 1:].ravel())), shape=(n, n))
+    return row_standardize(w)
+
+def distance_band_weights(lon, lat, threshold_km):
+    """Row-standardized binary weights of the cities within threshold_km (great-circle)."""
+    points = unit_vectors(lon, lat)
+    chord = 2 * np.sin(threshold_km / EARTH_RADIUS_KM / 2)
+    pairs = cKDTree(points).query_pairs(chord, output_type='ndarray')
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    w = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(points), len(points)))
+    return row_standardize(w)
+
+# ----- Local Moran's I -----
+
+def _permuted_lags(args):
+    """Permuted spatial lags of a block of cities (runs in a worker process)."""
+    cities, neighbour_weights, neighbour_count, z, draws = args
+    k = neighbour_weights.shape[1]
+    # Draws index the n - 1 other cities; skip the city itself
+    idx = draws[None, :, :k] + (draws[None, :, :k] >= cities[:, None, None])
+    mask = np.arange(k)[None, :] < neighbour_count[:, None]
+    weights = np.where(mask, neighbour_weights, 0)
+    return np.einsum('cpk,ck->cp', z[idx], weights)
+
+def local_moran(values, w, permutations=999, seed=0, processes=None, block=256, significance=0.05):
+    """
+    Local Moran's I of values under the sparse weights w.
+
+    Returns a DataFrame with the statistic I, the spatial lag of the
+    standardized values, the folded pseudo p-value of the conditional
+    permutation test and the GeoDa cluster code.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    w = sparse.csr_matrix(w)
+    z = (values - values.mean()) / values.std()
+    m2 = (z ** 2).sum() / n
+    lag = w @ z
+    local_i = z * lag / m2
+
+    # Neighbour weights of every city, padded to the largest neighbour count
+    counts = np.diff(w.indptr)
+    k = max(int(counts.max()), 1)
+    padded = np.zeros((n, k))
+    slot = np.arange(w.nnz) - np.repeat(w.indptr[:-1], counts)
+    padded[np.repeat(np.arange(n), counts), slot] = w.data
+
+    # One set of draws without replacement from the n - 1 other cities, shared by all cities
+    rng = np.random.default_rng(seed)
+    draws = np.argpartition(rng.random((permutations, n - 1)), k - 1, axis=1)[:, :k]
+
+    blocks = [np.arange(start, min(start + block, n)) for start in range(0, n, block)]
+    tasks = [(b, padded[b], counts[b], z, draws) for b in blocks]
+    if processes == 1 or len(blocks) == 1:
+        lags = [_permuted_lags(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            lags = list(pool.map(_permuted_lags, tasks))
+    permuted_i = z[:, None] * np.concatenate(lags) / m2
+
+    larger = (permuted_i >= local_i[:, None]).sum(axis=1)
+    larger = np.minimum(larger, permutations - larger)
+    p_value = (larger + 1) / (permutations + 1)
+
+    quadrant = np.select(
+        [(z > 0) & (lag > 0), (z < 0) & (lag < 0), (z < 0) & (lag > 0), (z > 0) & (lag < 0)],
+        [1, 2, 3, 4], default=0,
+    )
+    cluster = np.where((p_value < significance) & (counts > 0), quadrant, 0)
+    return pd.DataFrame({'I': local_i, 'lag': lag, 'p_value': p_value, 'cluster': cluster})
+
+# ----- Batch -----
+
+def lisa_table(sami, coords, road_types=tuple(LISA_COLUMNS.values()), k=8, threshold_km=None,
+               permutations=999, seed=0, processes=None):
+    """
+    LISA of the residuals of every country, year and road type.
+
+    coords has the columns country, city, lon and lat, one row per city:
+    city names repeat across countries. Weights are built once per
+    country from the cities with coordinates (KNN, or a distance band if
+    threshold_km is given). Returns a tidy table with one row per city.
+    """
+    if 'country' not in coords:
+        raise ValueError("coords needs a country column, city names repeat across countries")
+    sami = sami[sami['road_type'].isin(road_types)].dropna(subset=['residual'])
+    sami = sami.merge(coords[['country', 'city', 'lon', 'lat']], on=['country', 'city'], validate='many_to_one')
+    results = []
+    for (country, year, road_type), group in sami.groupby(['country', 'year', 'road_type'], sort=True):
+        group = group.sort_values('city')
+        if threshold_km is None:
+            w = knn_weights(group['lon'].to_numpy(), group['lat'].to_numpy(), k)
+        else:
+            w = distance_band_weights(group['lon'].to_numpy(), group['lat'].to_numpy(), threshold_km)
+        stats = local_moran(group['residual'].to_numpy(), w, permutations, seed, processes)
+        stats.insert(0, 'city', group['city'].to_numpy())
+        stats.insert(0, 'road_type', road_type)
+        stats.insert(0, 'year', year)
+        stats.insert(0, 'country', country)
+        results.append(stats)
+    return pd.concat(results, ignore_index=True)
+
+def lisa_columns(lisa, country, year):
+    """Cluster codes of one country and year as the LISA_CL_* columns read by Fig8.py."""
+    subset = lisa[(lisa['country'] == country) & (lisa['year'] == year)]
+    wide = subset.pivot(index='city', columns='road_type', values='cluster')
+    return wide.rename(columns={v: k for k, v in LISA_COLUMNS.items()})[list(LISA_COLUMNS)].reset_index()
+
+# ----- Result store -----
+
+def save_lisa(lisa, root):
+    """Write a lisa_table to the result store (metrics lisa_*)."""
+    from .store import result_name, table_records, write_results
+    for country, group in lisa.groupby('country'):
+        write_results(root, table_records(group, LISA_STATS, 'lisa_'), result_name(country, 'lisa'))
+
+def load_lisa(root, country=None, year=None, road_type=None):
+    """Read the lisa_table layout back from the result store."""
+    from .store import read_table
+    lisa = read_table(root, LISA_STATS, 'lisa_', country, year=year, road_type=road_type)
+    return lisa[['country', 'year', 'road_type', 'city'] + LISA_STATS].astype({'cluster': int})
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the LISA clusters of every year and road type from the
+    residuals in the result store and write them back to it.
+    Replace file paths with your own data.
+    """
+    store_path = '/your_path/to/output/results'
+    coords_path = '/your_path/to/city_coordinates.xlsx'  # columns: country, city, lon, lat (decimal degrees)
+
+    lisa = lisa_table(load_residuals(store_path), pd.read_excel(coords_path))
+    save_lisa(lisa, store_path)
+    print(f"LISA of {len(lisa)} city rows saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
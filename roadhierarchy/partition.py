@@ -0,0 +1,344 @@
+"""
+Hierarchical spatial partitioning of national and continental layers.
+
+1-clip_osm_by_city.py overlays the whole national layer with every city
+boundary, which does not scale to continental extracts. Here every
+feature is assigned once to a cell of a quadtree over Web Mercator tiles
+(the quadkey scheme of web maps): the deepest cell, down to MAX_LEVEL,
+that contains its whole bounding box. Short roads land in small cells
+and long ones in larger cells, so every feature has exactly one cell.
+
+Cells are stored as (key, level), key being the Morton code of the tile
+(x and y bits interleaved), so the ancestor of a cell is a bit shift and
+its quadkey string is the base-4 digits of the key. Features are written
+into shards, one directory per cell at SHARD_LEVEL (features in coarser
+cells get a shard of their own cell). A city only reads the shards on
+the path from the root to the shard cells covering its boundary. It then
+descends the quadtree from the root, testing only the children of the
+cells that partly cover a boundary polygon, and intersects just the
+features of those cells; features of cells inside the polygon are taken
+whole. Like the overlay, the result has one row per feature and matching
+boundary polygon. Cities are clipped in parallel and the layer is read
+in chunks, so no global overlay is needed.
+"""
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+
+from .citydata import COLUMNS
+from .raster import tile_bounds, web_mercator
+
+# Deepest cell level (about 600 m tiles at the equator) and level of the shards
+MAX_LEVEL = 16
+SHARD_LEVEL = 6
+
+# ----- Cells -----
+
+def _spread_bits(v):
+    """Bits of v (< 2^32) moved to the even positions."""
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def _compact_bits(v):
+    """Inverse of _spread_bits."""
+    v = np.asarray(v, dtype=np.uint64) & np.uint64(0x5555555555555555)
+    for shift, mask in [(1, 0x3333333333333333), (2, 0x0F0F0F0F0F0F0F0F), (4, 0x00FF00FF00FF00FF),
+                        (8, 0x0000FFFF0000FFFF), (16, 0x00000000FFFFFFFF)]:
+        v = (v | (v >> np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def tile_xy(lon, lat, level):
+    """Web Mercator tile column and row of points at a level."""
+    x, y = web_mercator(lon, lat)
+    n = 2 ** level
+    return (np.clip(np.floor(x * n), 0, n - 1).astype(np.int64),
+            np.clip(np.floor(y * n), 0, n - 1).astype(np.int64))
+
+def tile_key(tx, ty):
+    """Morton key of tiles: quadkey digit i is bit i of x plus twice bit i of y."""
+    return (_spread_bits(tx) | (_spread_bits(ty) << np.uint64(1))).astype(np.int64)
+
+def key_tile(key):
+    """Tile column and row of Morton keys."""
+    key = np.asarray(key, dtype=np.uint64)
+    return _compact_bits(key).astype(np.int64), _compact_bits(key >> np.uint64(1)).astype(np.int64)
+
+def ancestor(key, level, to_level):
+    """Key of the cell at to_level containing the cell (key, level)."""
+    return np.asarray(key, dtype=np.int64) >> (2 * (np.asarray(level) - to_level))
+
+def quadkey(key, level):
+    """Quadkey string of a cell."""
+    return ''.join(str((int(key) >> (2 * i)) & 3) for i in range(level - 1, -1, -1))
+
+def quadkey_cell(quadkey_string):
+    """(key, level) of a quadkey string."""
+    key = 0
+    for digit in quadkey_string:
+        key = key * 4 + int(digit)
+    return key, len(quadkey_string)
+
+def cell_bounds(key, level):
+    """Extent (lon_min, lon_max, lat_min, lat_max) of a cell."""
+    tx, ty = key_tile(key)
+    return tile_bounds(level, int(tx), int(ty))
+
+def feature_cells(bounds, max_level=MAX_LEVEL):
+    """
+    Cell of every feature: the deepest cell (down to max_level) containing
+    its bounding box (n x 4 array of xmin, ymin, xmax, ymax). Returns the
+    keys and levels; features without bounds get level -1.
+    """
+    bounds = np.asarray(bounds, dtype=float)
+    valid = ~np.isnan(bounds).any(axis=1)
+    b = np.where(valid[:, None], bounds, 0)
+    # North-west and south-east corners (tile rows grow southwards)
+    k0 = tile_key(*tile_xy(b[:, 0], b[:, 3], max_level))
+    k1 = tile_key(*tile_xy(b[:, 2], b[:, 1], max_level))
+    # The corners share the top levels of their keys; the rest is the depth to go up
+    differing = np.frexp((k0 ^ k1).astype(float))[1]
+    up = (differing + 1) // 2
+    level = np.where(valid, max_level - up, -1)
+    return np.where(valid, k0 >> (2 * up), -1), level
+
+def cell_boxes(keys, level):
+    """Polygons of cells (keys at one level)."""
+    tx, ty = key_tile(keys)
+    lon_min, lon_max, lat_min, lat_max = tile_bounds(level, tx, ty)
+    return shapely.box(lon_min, lat_min, lon_max, lat_max)
+
+def covering_cells(bounds, level):
+    """Keys of the cells at level covering a rectangle (xmin, ymin, xmax, ymax)."""
+    x0, y0 = tile_xy(bounds[0], bounds[3], level)
+    x1, y1 = tile_xy(bounds[2], bounds[1], level)
+    tx, ty = np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1))
+    return tile_key(tx.ravel(), ty.ravel())
+
+def path_codes(keys, level):
+    """
+    Codes (key << 5 | level) of the given cells at level and of all their
+    ancestors: the cells a feature overlapping them can be assigned to.
+    """
+    codes = [np.unique(ancestor(keys, level, k)) << 5 | k for k in range(level + 1)]
+    return np.unique(np.concatenate(codes))
+
+def cell_code(keys, levels):
+    """Codes of (key, level) cells, comparable with path_codes."""
+    return np.asarray(keys, dtype=np.int64) << 5 | np.asarray(levels, dtype=np.int64)
+
+def shard_names(keys, levels, shard_level=SHARD_LEVEL):
+    """Shard of every cell: its quadkey at shard_level, or its own quadkey if coarser ('q' + digits)."""
+    to_level = np.minimum(levels, shard_level)
+    shard = ancestor(keys, levels, to_level)
+    codes = pd.Series(cell_code(shard, to_level))
+    names = {code: 'q' + quadkey(code >> 5, code & 31) for code in codes.unique()}
+    return codes.map(names).to_numpy(dtype=object)
+
+def region_shards(bounds, shard_level=SHARD_LEVEL):
+    """Shards a region can draw features from: the shard cells covering it and their ancestors."""
+    codes = path_codes(covering_cells(bounds, shard_level), shard_level)
+    return ['q' + quadkey(code >> 5, code & 31) for code in codes]
+
+# ----- Partitioning -----
+
+def partition_frame(frame, max_level=MAX_LEVEL, shard_level=SHARD_LEVEL):
+    """Features (osm_id, fclass, WKT geometry) with their cell key, level and shard."""
+    geoms = shapely.from_wkt(frame['geometry'].where(frame['geometry'].notna(), None).to_numpy(dtype=object),
+                             on_invalid='ignore')
+    keys, levels = feature_cells(shapely.bounds(geoms), max_level)
+    frame = frame.assign(cell=keys, level=levels)[frame['geometry'].notna() & (levels >= 0)]
+    return frame.assign(shard=shard_names(frame['cell'].to_numpy(), frame['level'].to_numpy(), shard_level))
+
+def read_layer(path, chunksize=200_000):
+    """
+    Chunks of a layer as frames with osm_id, fclass and WKT geometry:
+    CSV files as written by the clipping, or any file geopandas reads.
+    """
+    if path.endswith('.csv'):
+        yield from pd.read_csv(path, usecols=lambda c: c in COLUMNS, chunksize=chunksize, low_memory=False)
+        return
+    import geopandas as gpd
+    start = 0
+    while True:
+        layer = gpd.read_file(path, rows=slice(start, start + chunksize))
+        if layer.empty:
+            return
+        layer = layer.to_crs("EPSG:4326")
+        yield pd.DataFrame({'osm_id': layer['osm_id'], 'fclass': layer['fclass'], 'geometry': layer.geometry.to_wkt()})
+        start += chunksize
+
+def partition_layer(path, output_dir, max_level=MAX_LEVEL, shard_level=SHARD_LEVEL, chunksize=200_000):
+    """
+    Assign the features of a layer to cells, one chunk at a time, and
+    write them into shard directories (output_dir/{shard}/part-{i}.parquet).
+    Returns the number of features per shard.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    sizes = {}
+    for i, chunk in enumerate(read_layer(path, chunksize)):
+        for shard, features in partition_frame(chunk, max_level, shard_level).groupby('shard', sort=False):
+            directory = os.path.join(output_dir, shard)
+            os.makedirs(directory, exist_ok=True)
+            features.drop(columns='shard').to_parquet(os.path.join(directory, f"{name}-{i}.parquet"), index=False)
+            sizes[shard] = sizes.get(shard, 0) + len(features)
+    return sizes
+
+def read_shards(output_dir, shards):
+    """Features of the given shards of a partitioned layer."""
+    paths = [p for shard in shards for p in sorted(glob.glob(os.path.join(output_dir, shard, '*.parquet')))]
+    if not paths:
+        return pd.DataFrame(columns=COLUMNS + ['cell', 'level'])
+    return pd.concat([pd.read_parquet(p) for p in paths], ignore_index=True)
+
+# ----- Clipping -----
+
+def region_cells(region, max_level=MAX_LEVEL):
+    """
+    Cells of a polygon, descending the quadtree from the root: at every
+    level only the children of the cells that partly cover the polygon
+    are tested. Returns the codes of the cells partly covering it (down
+    to max_level) and, per level, the keys of the cells inside it, whose
+    children are not visited.
+    """
+    shapely.prepare(region)
+    partial, inside = [], []
+    keys = np.zeros(1, dtype=np.int64)
+    for level in range(max_level + 1):
+        boxes = cell_boxes(keys, level)
+        within = shapely.contains_properly(region, boxes)
+        inside.append(keys[within])
+        keys, boxes = keys[~within], boxes[~within]
+        keys = keys[shapely.intersects(region, boxes)]
+        partial.append(cell_code(keys, level))
+        # Children of a cell: its key followed by one more quadkey digit
+        keys = (keys[:, None] * 4 + np.arange(4)).ravel()
+    return np.concatenate(partial), inside
+
+def region_features(region, cells, levels, max_level=MAX_LEVEL):
+    """
+    Features of a partitioned layer (their cells and levels) that can meet
+    a polygon, and those inside it because their cell is.
+    """
+    partial, inside = region_cells(region, max_level)
+    within = np.zeros(len(cells), dtype=bool)
+    for level, keys in enumerate(inside):
+        deep = levels >= level
+        if len(keys) and deep.any():
+            within[deep] |= np.isin(ancestor(cells[deep], levels[deep], level), keys)
+    return within | np.isin(cell_code(cells, levels), partial), within
+
+def _regions(boundary):
+    """Polygons of a boundary given as one geometry or an array of them."""
+    if isinstance(boundary, shapely.Geometry):
+        return np.array([boundary], dtype=object)
+    return np.asarray(boundary, dtype=object)
+
+def clip_region(output_dir, boundary, max_level=MAX_LEVEL, shard_level=SHARD_LEVEL):
+    """
+    Features of a partitioned layer clipped to a boundary, as the
+    intersection in 1-clip_osm_by_city.py: boundary is a polygon or an
+    array of polygons (the matching rows of the overlay layer), and every
+    feature gets one row per polygon it intersects, ordered by feature.
+    Only the shards on the boundary's path and the features of the cells
+    that meet a polygon are read and tested.
+    """
+    regions = _regions(boundary)
+    features = read_shards(output_dir, region_shards(shapely.total_bounds(regions), shard_level))
+    cells = features['cell'].to_numpy(dtype=np.int64)
+    levels = features['level'].to_numpy(dtype=np.int64)
+    selected = [region_features(region, cells, levels, max_level) for region in regions]
+
+    # Only the features some polygon can meet are parsed
+    geoms = np.full(len(features), None, dtype=object)
+    used = np.zeros(len(features), dtype=bool)
+    for candidate, _ in selected:
+        used |= candidate
+    geoms[used] = shapely.from_wkt(features['geometry'].to_numpy(dtype=object)[used])
+
+    rows, polygons, parts = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=object)]
+    for k, (region, (candidate, within)) in enumerate(zip(regions, selected)):
+        edge = np.flatnonzero(candidate & ~within)
+        edge = edge[shapely.intersects(region, geoms[edge])]
+        clipped = geoms[edge].copy()
+        inside = shapely.contains_properly(region, clipped)
+        clipped[~inside] = shapely.intersection(clipped[~inside], region)
+        whole = np.flatnonzero(within)
+        rows += [whole, edge]
+        polygons += [np.full(len(whole) + len(edge), k)]
+        parts += [geoms[whole], clipped]
+    rows, polygons, parts = np.concatenate(rows), np.concatenate(polygons), np.concatenate(parts)
+    keep = ~shapely.is_empty(parts)
+    order = np.lexsort([polygons[keep], rows[keep]])
+    rows, parts = rows[keep][order], parts[keep][order]
+    return pd.DataFrame({
+        'osm_id': features['osm_id'].to_numpy()[rows], 'fclass': features['fclass'].to_numpy()[rows],
+        'geometry': shapely.to_wkt(parts, rounding_precision=-1),
+    })
+
+def _clip_city(args):
+    output_dir, name, boundary, output_path, max_level, shard_level = args
+    clipped = clip_region(output_dir, boundary, max_level, shard_level)
+    clipped.to_csv(output_path.format(name=name), index=False)
+    return name, len(clipped)
+
+def clip_cities(output_dir, boundaries, output_path, max_level=MAX_LEVEL, shard_level=SHARD_LEVEL, processes=None):
+    """
+    Clip a partitioned layer to every (name, polygons) boundary in parallel
+    and write {name} CSVs to output_path. Returns the features per city.
+    """
+    tasks = [(output_dir, name, boundary, output_path, max_level, shard_level) for name, boundary in boundaries]
+    if processes == 1:
+        return dict(map(_clip_city, tasks))
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return dict(pool.map(_clip_city, tasks))
+
+def read_boundaries(path, names, column='region_name'):
+    """
+    Boundary polygons of every city name: the regions whose name starts
+    with it (as in 1-clip_osm_by_city.py), in EPSG:4326.
+    """
+    import geopandas as gpd
+    regions = gpd.read_file(path).to_crs("EPSG:4326")
+    boundaries = []
+    for name in names:
+        matching = regions[regions[column].str.contains(f'^{name}', regex=True, na=False)]
+        if len(matching):
+            boundaries.append((name, matching.geometry.to_numpy()))
+    return boundaries
+
+# ----- Main -----
+
+def main():
+    """
+    Partition the road and railway layers of every year once, then clip
+    every city from the partitions. Replace file paths with your own data.
+    """
+    layer_paths = {
+        'road': '/your_path/to/20{year}/gis_osm_roads_free_1.shp',
+        'railway': '/your_path/to/20{year}/gis_osm_railways_free_1.shp',
+    }
+    boundary_path = '/your_path/to/boundaries.shp'
+    city_list_path = '/your_path/to/data.xlsx'
+    partition_path = '/your_output_path/20{year}/partition/{layer}'
+    output_path = '/your_output_path/20{year}/{layer}/{{name}}_osm_{layer}.csv'
+
+    boundaries = read_boundaries(boundary_path, pd.read_excel(city_list_path)['city'])
+    for year in range(15, 23):
+        for layer, path in layer_paths.items():
+            directory = partition_path.format(year=year, layer=layer)
+            sizes = partition_layer(path.format(year=year), directory)
+            print(f"20{year} {layer}: {sum(sizes.values())} features in {len(sizes)} shards")
+            target = output_path.format(year=year, layer=layer)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            clip_cities(directory, boundaries, target)
+        print(f"20{year}'s clipping done")
+
+if __name__ == '__main__':
+    main()
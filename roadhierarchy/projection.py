@@ -0,0 +1,48 @@
+"""
+Local metric projections for the metric mode of the engine.
+
+Each city is projected once into a local CRS, either its UTM zone or an
+azimuthal equidistant projection centred on the city. CRS and
+transformer objects are cached, so cities sharing a zone share them.
+pyproj is imported on first use.
+"""
+
+import numpy as np
+from functools import lru_cache
+
+PROJECTIONS = ('utm', 'aeqd')
+
+
+def local_crs(lon, lat, kind='utm'):
+    """CRS definition string of the local metric projection around (lon, lat)."""
+    if kind == 'utm':
+        zone = int((lon + 180) // 6) % 60 + 1
+        return f"EPSG:{(32700 if lat < 0 else 32600) + zone}"
+    if kind == 'aeqd':
+        return f"+proj=aeqd +lat_0={lat:.2f} +lon_0={lon:.2f} +datum=WGS84 +units=m +no_defs"
+    raise ValueError(f"Unknown projection {kind!r}, expected one of {PROJECTIONS}")
+
+
+@lru_cache(maxsize=None)
+def transformer(crs):
+    """Cached transformer from WGS84 longitude/latitude to crs."""
+    from pyproj import Transformer
+    return Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+
+@lru_cache(maxsize=None)
+def geod():
+    """WGS84 ellipsoid used for geodesic lengths (same as geopy's default)."""
+    from pyproj import Geod
+    return Geod(ellps='WGS84')
+
+
+def project_coords(coords, kind='utm'):
+    """
+    Project an (n, 2) array of longitude/latitude into the local metric
+    CRS of its centre. Returns the projected array and the CRS string.
+    """
+    lon, lat = np.nanmedian(coords, axis=0) if len(coords) else (0.0, 0.0)
+    crs = local_crs(lon, lat, kind)
+    x, y = transformer(crs).transform(coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y]), crs
@@ -0,0 +1,328 @@
+"""
+Aggregated rendering of national road networks.
+
+Millions of lines cannot be drawn one by one. Here the segments of the
+ragged coordinate arrays of CityData are rasterized straight into
+per-class density grids (road length per cell) with NumPy: every segment
+is sampled at half-cell steps and the samples of all classes are
+accumulated with one bincount. Grids of cities read one at a time add
+up into one national grid. Web Mercator tiles are produced the same way,
+keyed by (zoom, x, y), and coarser zoom levels are summed from finer
+ones. Grids are shaded on a log or histogram-equalized scale, composited
+per class and drawn as map panels in the style of Fig1.py and Fig8.py.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+from .citydata import CityData, class_codes
+from .engine import counted_features, parallel_matches
+
+# Road classes of the density grids, from the top of the hierarchy down
+RASTER_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential', 'service', 'footway']
+
+# Colours of the classes in composites
+RASTER_COLORS = ['#b2182b', '#ef8a62', '#f4a582', '#fddbc7', '#92c5de', '#4393c3', '#2166ac', '#053061']
+
+# Map extents (xmin, xmax, ymin, ymax) of Fig1.py
+EXTENTS = {'China': (70, 139, 15, 55), 'USA': (-128, -66, 22, 54)}
+
+Segments = namedtuple('Segments', ['x0', 'y0', 'x1', 'y1', 'code', 'length'])
+Grid = namedtuple('Grid', ['counts', 'extent', 'road_types'])
+
+# ----- Segments -----
+
+def city_segments(city, road_types=RASTER_TYPES, features=None):
+    """
+    Segments of a city's lines of the road types, with their class code
+    and length (km). features optionally selects rows (boolean mask).
+    """
+    code = class_codes(city.road_class, road_types)[city.segment_feature]
+    ok = code >= 0
+    if features is not None:
+        ok &= features[city.segment_feature]
+    start = city.segment_start[ok]
+    p1, p2 = city.coords[start], city.coords[start + 1]
+    return Segments(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1], code[ok], city.segment_lengths[ok])
+
+def concat_segments(parts):
+    """Concatenate the segments of several cities."""
+    return Segments(*(np.concatenate(field) for field in zip(*parts)))
+
+def sample_segments(x0, y0, x1, y1, step):
+    """
+    Points every step along the segments (at least one per segment).
+    Returns the point coordinates, the index of their segment and the
+    fraction of the segment each point stands for.
+    """
+    n = np.maximum(np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0)) / step), 1).astype(np.int64)
+    seg = np.repeat(np.arange(len(n)), n)
+    # Midpoints of n equal pieces of every segment
+    first = np.cumsum(n) - n
+    t = (np.arange(len(seg)) - first[seg] + 0.5) / n[seg]
+    x = x0[seg] + t * (x1 - x0)[seg]
+    y = y0[seg] + t * (y1 - y0)[seg]
+    return x, y, seg, 1.0 / n[seg]
+
+def _chunks(segments, chunk):
+    """Slices of at most chunk segments."""
+    for start in range(0, len(segments.code), chunk):
+        yield Segments(*(field[start:start + chunk] for field in segments))
+
+# ----- Density grids -----
+
+def grid_shape(extent, resolution):
+    """Rows and columns of a grid of the extent with the given cell size."""
+    xmin, xmax, ymin, ymax = extent
+    return int(np.ceil((ymax - ymin) / resolution - 1e-9)), int(np.ceil((xmax - xmin) / resolution - 1e-9))
+
+def rasterize(segments, extent, resolution, n_classes, counts=None, chunk=1_000_000):
+    """
+    Length (km) of every class in the cells of a regular grid.
+
+    extent is (xmin, xmax, ymin, ymax) and resolution the cell size in
+    coordinate units. Row 0 is the northern edge, as imshow draws it.
+    Segments are rasterized chunk at a time, added to counts if given.
+    """
+    xmin, xmax, ymin, ymax = extent
+    height, width = grid_shape(extent, resolution)
+    if counts is None:
+        counts = np.zeros((n_classes, height, width))
+    flat = counts.reshape(-1)
+
+    for part in _chunks(segments, chunk):
+        x, y, seg, share = sample_segments(part.x0, part.y0, part.x1, part.y1, resolution / 2)
+        col = np.floor((x - xmin) / resolution).astype(np.int64)
+        row = np.floor((ymax - y) / resolution).astype(np.int64)
+        ok = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+        cell = (part.code[seg[ok]] * height + row[ok]) * width + col[ok]
+        flat += np.bincount(cell, weights=(part.length[seg] * share)[ok], minlength=flat.size)
+    return counts
+
+def density_grid(cities, extent, resolution=0.05, road_types=RASTER_TYPES, features=None):
+    """
+    Density grid of the road types over several cities.
+
+    cities is an iterable of CityData (read lazily, one at a time);
+    features, if given, is a function returning the rows of a city to
+    rasterize, e.g. counted_features to keep only deduplicated lines.
+    """
+    counts = np.zeros((len(road_types),) + grid_shape(extent, resolution))
+    for city in cities:
+        mask = features(city) if features is not None else None
+        rasterize(city_segments(city, road_types, mask), extent, resolution, len(road_types), counts)
+    return Grid(counts, extent, list(road_types))
+
+def matched_features(city, matches):
+    """Rows of a city that appear in a parallel-match table."""
+    return np.isin(city.osm_id, matches['osm_id'].to_numpy())
+
+# ----- Tiles -----
+
+def web_mercator(lon, lat):
+    """Longitude/latitude (degrees) as Web Mercator coordinates in [0, 1], y growing southwards."""
+    lat = np.clip(lat, -85.0511, 85.0511)
+    x = (np.asarray(lon) + 180) / 360
+    y = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2
+    return x, y
+
+def tile_bounds(zoom, tx, ty):
+    """Extent (lon_min, lon_max, lat_min, lat_max) of a Web Mercator tile."""
+    n = 2 ** zoom
+    lon = np.array([tx, tx + 1]) / n * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.array([ty + 1, ty]) / n))))
+    return lon[0], lon[1], lat[0], lat[1]
+
+def tile_grids(segments, zoom, n_classes, tile_size=256, tiles=None, chunk=1_000_000):
+    """
+    Density tiles of the segments at one zoom level.
+
+    Returns {(zoom, x, y): counts} with counts of shape
+    (n_classes, tile_size, tile_size) for every tile that holds a road;
+    tiles given are added to.
+    """
+    tiles = {} if tiles is None else tiles
+    pixels = tile_size * 2 ** zoom
+    for part in _chunks(segments, chunk):
+        mx0, my0 = web_mercator(part.x0, part.y0)
+        mx1, my1 = web_mercator(part.x1, part.y1)
+        x, y, seg, share = sample_segments(mx0, my0, mx1, my1, 0.5 / pixels)
+        px = np.clip(np.floor(x * pixels).astype(np.int64), 0, pixels - 1)
+        py = np.clip(np.floor(y * pixels).astype(np.int64), 0, pixels - 1)
+        tile = (px // tile_size) * 2 ** zoom + py // tile_size
+        cell = (part.code[seg] * tile_size + py % tile_size) * tile_size + px % tile_size
+        weight = part.length[seg] * share
+
+        order = np.argsort(tile, kind='stable')
+        tile, cell, weight = tile[order], cell[order], weight[order]
+        keys, starts = np.unique(tile, return_index=True)
+        for key, start, stop in zip(keys, starts, np.append(starts[1:], len(tile))):
+            counts = np.bincount(cell[start:stop], weights=weight[start:stop],
+                                 minlength=n_classes * tile_size * tile_size)
+            tx, ty = divmod(int(key), 2 ** zoom)
+            index = (zoom, tx, ty)
+            counts = counts.reshape(n_classes, tile_size, tile_size)
+            tiles[index] = tiles[index] + counts if index in tiles else counts
+    return tiles
+
+def pyramid(tiles, min_zoom=0):
+    """Add the coarser zoom levels down to min_zoom, each cell the sum of its four children."""
+    tiles = dict(tiles)
+    level = {key: value for key, value in tiles.items() if key[0] == max(k[0] for k in tiles)}
+    while level and next(iter(level))[0] > min_zoom:
+        parents = {}
+        for (zoom, tx, ty), counts in level.items():
+            n_classes, size, _ = counts.shape
+            half = counts.reshape(n_classes, size // 2, 2, size // 2, 2).sum(axis=(2, 4))
+            key = (zoom - 1, tx // 2, ty // 2)
+            if key not in parents:
+                parents[key] = np.zeros_like(counts)
+            rows = slice((ty % 2) * size // 2, (ty % 2 + 1) * size // 2)
+            cols = slice((tx % 2) * size // 2, (tx % 2 + 1) * size // 2)
+            parents[key][:, rows, cols] += half
+        tiles.update(parents)
+        level = parents
+    return tiles
+
+# ----- Shading -----
+
+def shade(counts, how='log'):
+    """Scale counts to [0, 1]: 'linear', 'log' or 'eq_hist' (histogram equalization of non-empty cells)."""
+    counts = np.asarray(counts, dtype=float)
+    out = np.zeros_like(counts)
+    filled = counts > 0
+    if not filled.any():
+        return out
+    if how == 'linear':
+        out[filled] = counts[filled] / counts.max()
+    elif how == 'log':
+        out[filled] = np.log1p(counts[filled]) / np.log1p(counts.max())
+    elif how == 'eq_hist':
+        values = counts[filled]
+        ranks = np.searchsorted(np.sort(values), values, side='right')
+        out[filled] = ranks / len(values)
+    else:
+        raise ValueError(f"Unknown shading {how!r}")
+    return out
+
+def composite(counts, colors=RASTER_COLORS, how='log'):
+    """
+    RGBA image of a per-class grid: every class shaded on its own scale,
+    colours averaged by intensity and the alphas combined as 'over'.
+    """
+    from matplotlib.colors import to_rgb
+    alpha = np.stack([shade(c, how) for c in counts])
+    rgb = np.array([to_rgb(c) for c in colors[:len(counts)]])
+    total = alpha.sum(axis=0)
+    color = np.einsum('khw,kc->hwc', alpha, rgb) / np.where(total == 0, 1, total)[..., None]
+    return np.dstack([color, 1 - np.prod(1 - alpha, axis=0)])
+
+def save_tiles(tiles, directory, colors=RASTER_COLORS, how='log'):
+    """Write the composite of every tile to directory/{zoom}/{x}/{y}.png."""
+    import matplotlib.pyplot as plt
+    for (zoom, tx, ty), counts in tiles.items():
+        path = os.path.join(directory, str(zoom), str(tx))
+        os.makedirs(path, exist_ok=True)
+        plt.imsave(os.path.join(path, f"{ty}.png"), composite(counts, colors, how))
+
+# ----- Map panels -----
+
+def _format_axes(ax, extent, step_x=20, step_y=10):
+    """Limits and degree tick labels as in Fig1.py / Fig8.py."""
+    from matplotlib.ticker import FuncFormatter, MultipleLocator
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.xaxis.set_major_locator(MultipleLocator(step_x))
+    ax.yaxis.set_major_locator(MultipleLocator(step_y))
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, _: f"{abs(x):.0f}°{'E' if x >= 0 else 'W'}"))
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: f"{abs(y):.0f}°{'N' if y >= 0 else 'S'}"))
+
+def plot_density_panels(grid, panels=None, cmap='magma_r', how='log', base_map=None, ncols=3):
+    """
+    One map panel per road type (or per group of road types in panels,
+    e.g. {'Motorway': ['motorway', 'trunk']}), each shaded on its own scale.
+    Returns the matplotlib figure.
+    """
+    import matplotlib.pyplot as plt
+    panels = panels or {t.capitalize(): [t] for t in grid.road_types}
+    nrows = int(np.ceil(len(panels) / ncols))
+    fig, axes = plt.subplots(nrows, ncols, figsize=(4.5 * ncols, 3.3 * nrows), dpi=400, squeeze=False)
+    for ax, (label, types) in zip(axes.flat, panels.items()):
+        counts = grid.counts[[grid.road_types.index(t) for t in types]].sum(axis=0)
+        if base_map is not None:
+            base_map.plot(ax=ax, ec='gray', fc='white', linewidth=0.4)
+        image = np.ma.masked_equal(shade(counts, how), 0)
+        ax.imshow(image, extent=grid.extent, cmap=cmap, vmin=0, vmax=1, interpolation='nearest', zorder=2)
+        _format_axes(ax, grid.extent)
+        ax.set_title(label, fontsize=9)
+    for ax in axes.flat[len(panels):]:
+        ax.axis('off')
+    plt.tight_layout()
+    return fig
+
+def plot_composite(grid, colors=RASTER_COLORS, how='log', overlay=None, overlay_color='black',
+                   base_map=None, ax=None):
+    """
+    All classes composited in one map panel, with an optional second grid
+    (e.g. the parallel-matched lines) drawn on top in one colour.
+    Returns the matplotlib figure.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import to_rgb
+    from matplotlib.patches import Patch
+    if ax is None:
+        _, ax = plt.subplots(figsize=(4.5, 3.3), dpi=400)
+    if base_map is not None:
+        base_map.plot(ax=ax, ec='gray', fc='white', linewidth=0.4)
+    ax.imshow(composite(grid.counts, colors, how), extent=grid.extent, interpolation='nearest', zorder=2)
+    if overlay is not None:
+        alpha = shade(overlay.counts.sum(axis=0), how)
+        layer = np.dstack([np.broadcast_to(to_rgb(overlay_color), alpha.shape + (3,)), alpha])
+        ax.imshow(layer, extent=overlay.extent, interpolation='nearest', zorder=3)
+    _format_axes(ax, grid.extent)
+    ax.legend([Patch(facecolor=c, edgecolor='gray', linewidth=0.5) for c in colors[:len(grid.road_types)]],
+              grid.road_types, loc='lower left', frameon=False, fontsize=6, handletextpad=0.8, labelspacing=0.25)
+    return ax.figure
+
+# ----- Main -----
+
+def main():
+    """
+    Rasterize the deduplicated roads and the parallel-matched lines of
+    every city of one country and year into national grids.
+    Replace file paths with your own data.
+    """
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    rail_csv_path = '/your_output_path/20{year}/railway/{city}_osm_railway.csv'
+    output_dir = '/your_path/to/output/raster'
+    country, year, resolution = 'USA', 22, 0.05
+
+    def cities():
+        for city in pd.read_excel(city_list_path)['city']:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            rail_path = rail_csv_path.format(year=year, city=city_clean)
+            if os.path.exists(road_path):
+                yield CityData.from_csv(road_path, rail_path if os.path.exists(rail_path) else None)
+
+    extent = EXTENTS[country]
+    shape = (len(RASTER_TYPES),) + grid_shape(extent, resolution)
+    roads, matches = Grid(np.zeros(shape), extent, RASTER_TYPES), Grid(np.zeros(shape), extent, RASTER_TYPES)
+    for city in cities():
+        segments = city_segments(city, features=counted_features(city))
+        rasterize(segments, extent, resolution, len(RASTER_TYPES), roads.counts)
+        matched = city_segments(city, features=matched_features(city, parallel_matches(city)))
+        rasterize(matched, extent, resolution, len(RASTER_TYPES), matches.counts)
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.savez_compressed(os.path.join(output_dir, f"{country}_20{year}_density.npz"),
+                        roads=roads.counts, matches=matches.counts, extent=extent, road_types=RASTER_TYPES)
+    plot_density_panels(roads).savefig(os.path.join(output_dir, f"{country}_20{year}_classes.pdf"))
+    plot_composite(roads, overlay=matches).savefig(os.path.join(output_dir, f"{country}_20{year}_matches.pdf"))
+    print(f"Density grids of {country} 20{year} saved to {output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Scale-adjusted metropolitan indicators (SAMIs).
+
+The SAMI of a city is its residual from the scaling law of its country,
+year and road type: log10(length) - (intercept + beta * log10(population)).
+Residuals of every city, road type and year are computed in one
+vectorized merge against the batched fits of scaling.py and stored in
+the result store together with each city's population rank, so top-N
+splits are selections rather than recomputations. Figures 3, 6 and 7
+read them back with load_residuals.
+"""
+
+import numpy as np
+import pandas as pd
+
+from .scaling import GROUP, load_fits, load_store_tables
+
+SAMI_COLUMNS = ['population', 'length', 'residual', 'pop_rank']
+
+# ----- Residuals -----
+
+def compute_sami(table, fits):
+    """
+    SAMI residuals for every row of a tidy length table.
+
+    fits is the output of fit_scaling; only the fits on the raw cities
+    (bin_fit False) are used. Cities without a fit, or with a zero length
+    or population, get a NaN residual.
+    """
+    fits = fits[~fits['bin_fit'].astype(bool)] if 'bin_fit' in fits else fits
+    sami = table.merge(fits[GROUP + ['beta', 'intercept']], on=GROUP, how='left')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = sami['intercept'] + sami['beta'] * np.log10(sami['population'])
+        sami['residual'] = np.log10(sami['length']) - expected
+    sami['residual'] = sami['residual'].replace([np.inf, -np.inf], np.nan)
+    sami['pop_rank'] = (
+        sami.groupby(GROUP)['population'].rank(method='first', ascending=False).astype(int)
+    )
+    return sami.drop(columns=['beta', 'intercept'])
+
+def save_residuals(sami, root):
+    """Write the residual table to the result store (metrics sami_*)."""
+    from .store import result_name, table_records, write_results
+    for country, group in sami.groupby('country'):
+        write_results(root, table_records(group, SAMI_COLUMNS, 'sami_'), result_name(country, 'sami'))
+
+def load_residuals(root, country=None, year=None, road_type=None):
+    """Read the residual table from the result store, optionally filtered on country, year and road type."""
+    from .store import read_table
+    sami = read_table(root, SAMI_COLUMNS, 'sami_', country, year=year, road_type=road_type)
+    sami = sami[['country', 'year', 'city', 'road_type'] + SAMI_COLUMNS]
+    return sami.astype({'pop_rank': int})
+
+# ----- Selections -----
+
+def top_n_split(sami, n):
+    """Split the residuals into the n most populous cities of each group and the others."""
+    top = sami['pop_rank'] <= n
+    return sami[top], sami[~top]
+
+def residual_wide(sami, country, year, value='residual'):
+    """City x road type table of one country and year (road types as columns)."""
+    subset = sami[(sami['country'] == country) & (sami['year'] == year)]
+    return subset.pivot_table(index='city', columns='road_type', values=value)
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the SAMI residuals of every country, year and road type from
+    the lengths and scaling fits in the result store (run scaling first).
+    Replace file paths with your own data.
+    """
+    store_path = '/your_path/to/output/results'
+    population_path = '/your_path/to/{country}_population.xlsx'  # columns: city, year, population
+
+    table = load_store_tables(store_path, population_path)
+    sami = compute_sami(table, load_fits(store_path))
+    save_residuals(sami, store_path)
+    print(f"{len(sami)} residuals saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Scaling-law fits of road length against city population.
+
+Road lengths are held in one tidy table with the columns country, year,
+city, population, road_type and length. The power law
+length = 10^intercept * population^beta is fitted in log-log space for
+every (country, year, road_type) group in one batched call, and the fits
+are written to the result store, which the figure scripts read instead
+of refitting while plotting.
+"""
+
+import numpy as np
+import pandas as pd
+
+GROUP = ['country', 'year', 'road_type']
+FIT_COLUMNS = ['n', 'beta', 'intercept', 'r2', 'beta_se', 'intercept_se', 'cov', 't_value', 'beta_low', 'beta_high',
+               'cities']
+
+# Road type groups shown in the figures (starred types merge two classes)
+FIGURE_TYPES = {
+    'metro': ['subway', 'light_rail', 'monorail'],
+    'motorway*': ['motorway', 'trunk'],
+    'primary': ['primary'],
+    'secondary': ['secondary'],
+    'tertiary': ['tertiary'],
+    'residential*': ['residential', 'service'],
+    'footway': ['footway'],
+}
+
+# ----- Length tables -----
+
+def read_length_table(path, country, year):
+    """Read a yearly road length workbook (City + one column per class) into the tidy layout."""
+    wide = pd.read_excel(path)
+    wide.columns = ['city'] + [c.lower().replace(' ', '_') for c in wide.columns[1:]]
+    table = wide.melt(id_vars='city', var_name='road_type', value_name='length')
+    table.insert(0, 'year', year)
+    table.insert(0, 'country', country)
+    return table
+
+def load_length_tables(length_path, population_path, countries=('China', 'USA'), years=range(15, 23)):
+    """
+    Read the yearly length workbooks of every country, add the city
+    populations (columns city, year, population) and combine the classes
+    into the figure road types.
+    """
+    tables = []
+    for country in countries:
+        population = pd.read_excel(population_path.format(country=country))
+        for year in years:
+            lengths = read_length_table(length_path.format(country=country, year=year), country, 2000 + year)
+            tables.append(lengths.merge(population, on=['city', 'year']))
+    return combine_types(pd.concat(tables, ignore_index=True))
+
+def load_store_tables(store_path, population_path, countries=('China', 'USA'), years=range(15, 23)):
+    """load_length_tables from the result store instead of the yearly workbooks."""
+    from .store import length_table
+    tables = []
+    for country in countries:
+        population = pd.read_excel(population_path.format(country=country))
+        lengths = length_table(store_path, country, [2000 + year for year in years])
+        tables.append(lengths.merge(population, on=['city', 'year']))
+    return combine_types(pd.concat(tables, ignore_index=True))
+
+def combine_types(table, groups=FIGURE_TYPES):
+    """Sum class lengths into the figure road type groups."""
+    mapping = {rt: group for group, types in groups.items() for rt in types}
+    table = table.assign(road_type=table['road_type'].map(mapping)).dropna(subset=['road_type'])
+    keys = [c for c in table.columns if c != 'length']
+    return table.groupby(keys, as_index=False, sort=False)['length'].sum()
+
+# ----- Binning -----
+
+def log_bin(x, y, num):
+    """
+    Mean of y in num - 1 logarithmic bins of x, vectorized log_avg of Fig4.py.
+    Bins are closed on the right and empty bins are dropped.
+    Returns the bin midpoints and the mean values.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    bins = np.logspace(np.log10(x.min()), np.log10(x.max()), num)
+    idx = np.clip(np.digitize(x, bins, right=True), 1, num - 1) - 1
+    counts = np.bincount(idx, minlength=num - 1)
+    sums = np.bincount(idx, weights=y, minlength=num - 1)
+    full = counts > 0
+    midpoints = (bins[:-1] + bins[1:]) / 2
+    return midpoints[full], sums[full] / counts[full]
+
+def log_bin_groups(table, num, x='population', y='length', by=GROUP):
+    """log_bin applied to every group of a tidy table."""
+    binned = []
+    for key, group in table.groupby(by, sort=False):
+        x_bin, y_bin = log_bin(group[x], group[y], num)
+        frame = pd.DataFrame({x: x_bin, y: y_bin})
+        for col, value in zip(by, key):
+            frame[col] = value
+        binned.append(frame)
+    return pd.concat(binned, ignore_index=True)[list(by) + [x, y]]
+
+# ----- Fitting -----
+
+def fit_loglog(table, x='population', y='length', by=GROUP, level=0.95):
+    """
+    Closed-form least-squares fit of log10(y) on log10(x) for every group.
+
+    Returns one row per group with n, beta, intercept, r2, the standard
+    errors and covariance of the coefficients, the t quantile of the
+    level and the confidence interval of beta (t distribution, as curve_fit).
+    """
+    from scipy.stats import t
+    d = table[list(by)].copy()
+    d['lx'] = np.log10(table[x].to_numpy(dtype=float))
+    d['ly'] = np.log10(table[y].to_numpy(dtype=float))
+    grouped = d.groupby(by, sort=True)
+    d['cx'] = d['lx'] - grouped['lx'].transform('mean')
+    d['cy'] = d['ly'] - grouped['ly'].transform('mean')
+    d['sxx'] = d['cx'] ** 2
+    d['sxy'] = d['cx'] * d['cy']
+    d['syy'] = d['cy'] ** 2
+    s = d.groupby(by, sort=True).agg(
+        n=('lx', 'size'), mx=('lx', 'mean'), my=('ly', 'mean'),
+        sxx=('sxx', 'sum'), sxy=('sxy', 'sum'), syy=('syy', 'sum'),
+    )
+
+    beta = s['sxy'] / s['sxx']
+    intercept = s['my'] - beta * s['mx']
+    sse = (s['syy'] - beta * s['sxy']).clip(lower=0)
+    dof = s['n'] - 2
+    sigma2 = sse / dof
+    beta_se = np.sqrt(sigma2 / s['sxx'])
+    intercept_se = np.sqrt(sigma2 * (1 / s['n'] + s['mx'] ** 2 / s['sxx']))
+    t_value = t.ppf((1 + level) / 2, dof)
+    half = t_value * beta_se
+
+    fits = pd.DataFrame({
+        'n': s['n'], 'beta': beta, 'intercept': intercept, 'r2': 1 - sse / s['syy'],
+        'beta_se': beta_se, 'intercept_se': intercept_se, 'cov': -s['mx'] * sigma2 / s['sxx'], 't_value': t_value,
+        'beta_low': beta - half, 'beta_high': beta + half,
+    })
+    return fits.reset_index()
+
+def fit_scaling(table, bin_fit=False, num_bins=15, level=0.95, min_cities=6,
+                x='population', y='length', by=GROUP):
+    """
+    Fit the scaling law for every (country, year, road_type) group of a
+    tidy length table. Cities with a zero length or population are left
+    out, and groups with fewer than min_cities cities are dropped (Fig4
+    skips them). With bin_fit, the fit uses the log-binned means as
+    logbinning_fitPower(bin_fit=True) does; n then counts the bins
+    and cities the cities.
+    """
+    table = table[(table[x] > 0) & (table[y] > 0)]
+    cities = table.groupby(by).size().rename('cities').reset_index()
+    cities = cities[cities['cities'] >= min_cities]
+    table = table.merge(cities[list(by)], on=list(by))
+
+    data = log_bin_groups(table, num_bins, x, y, by) if bin_fit else table
+    fits = fit_loglog(data, x, y, by, level)
+    fits = fits.merge(cities, on=list(by))
+    fits.insert(len(by), 'bin_fit', bin_fit)
+    return fits
+
+# ----- Result store -----
+
+def _fit_prefix(bin_fit):
+    return 'scaling_binned_' if bin_fit else 'scaling_'
+
+def save_fits(fits, root):
+    """Write fits to the result store (metrics scaling_* and scaling_binned_*, no city)."""
+    from .store import result_name, table_records, write_results
+    for country, group in fits.groupby('country'):
+        rows = [table_records(fit, FIT_COLUMNS, _fit_prefix(bin_fit), city='')
+                for bin_fit, fit in group.groupby('bin_fit')]
+        write_results(root, pd.concat(rows, ignore_index=True), result_name(country, 'scaling'))
+
+def load_fits(root, country=None, year=None):
+    """Fits from the result store, in the layout of fit_scaling (raw and binned fits)."""
+    from .store import read_table
+    fits = []
+    for bin_fit in [False, True]:
+        table = read_table(root, FIT_COLUMNS, _fit_prefix(bin_fit), country, year=year)
+        table.insert(len(GROUP), 'bin_fit', bin_fit)
+        fits.append(table.drop(columns='city'))
+    fits = pd.concat(fits, ignore_index=True)[GROUP + ['bin_fit'] + FIT_COLUMNS]
+    return fits.astype({'n': int, 'cities': int})
+
+# ----- Main -----
+
+def main():
+    """
+    Fit the scaling laws of every country, year and road type on the
+    lengths in the result store and write the fits back to it.
+    Replace file paths with your own data.
+    """
+    store_path = '/your_path/to/output/results'
+    population_path = '/your_path/to/{country}_population.xlsx'  # columns: city, year, population
+
+    table = load_store_tables(store_path, population_path)
+    fits = pd.concat([fit_scaling(table), fit_scaling(table, bin_fit=True)], ignore_index=True)
+    save_fits(fits, store_path)
+    print(f"{len(fits)} fits saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Zero-copy sharing of parsed city data across worker processes.
+
+Threshold sweeps, bootstrap replicates and stages run side by side on
+one city each used to parse the CSV again, or receive a pickled copy of
+the city, in every worker. Here the arrays of a parsed city (ragged
+coordinates and offsets, class codes, shared-vertex ids, segments,
+centroids and the candidate pairs of the spatial index) are written
+once as .npy files into shared memory (/dev/shm where available). Workers
+attach to them with read-only memory maps: the pages are shared by all
+processes, so memory stays flat as workers are added. Only a small
+handle (the directory) is passed to the workers.
+
+Shapely geometries and the object arrays of class names cannot be
+memory-mapped; an attached city builds them from the shared arrays and
+class codes on first use, so stages that only need the numeric arrays
+never build them. Per-vertex arrays, coord_part included, are shared.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from .citydata import CityData
+
+# Shared memory filesystem; falls back to the temporary directory
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Derived arrays computed before sharing, so workers do not compute them again
+SHARED_PROPERTIES = ['coord_part', 'lines', 'first_part', 'vertex_id', 'segment_start', 'segment_feature',
+                     'segment_lengths', 'planar_lengths', 'centroids']
+
+SharedData = namedtuple('SharedData', ['directory'])
+
+# Attached data of this process, by directory
+_ATTACHED = {}
+
+# ----- Arrays -----
+
+def share_arrays(arrays, meta=None, directory=None):
+    """
+    Write numeric arrays (a dict) and JSON metadata into a new directory
+    in shared memory. Returns the handle to pass to workers.
+    """
+    directory = directory or tempfile.mkdtemp(prefix='roadhierarchy-', dir=SHM_DIR)
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'arrays': list(arrays), 'meta': meta or {}}, f)
+    return SharedData(directory)
+
+def attach_arrays(shared):
+    """Read-only memory maps of shared arrays, and their metadata."""
+    with open(os.path.join(shared.directory, 'meta.json')) as f:
+        content = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(shared.directory, f"{name}.npy"), mmap_mode='r')
+        for name in content['arrays']
+    }
+    return arrays, content['meta']
+
+def release(shared):
+    """Remove shared data (after the workers are done)."""
+    _ATTACHED.pop(shared.directory, None)
+    shutil.rmtree(shared.directory, ignore_errors=True)
+
+@contextmanager
+def shared_arrays(arrays, meta=None):
+    """Share arrays for the duration of a with block."""
+    shared = share_arrays(arrays, meta)
+    try:
+        yield shared
+    finally:
+        release(shared)
+
+# ----- Cities -----
+
+def share_city(city, properties=SHARED_PROPERTIES, directory=None):
+    """
+    Share the arrays of a parsed city, with its derived arrays (computed
+    first if needed) and the candidate pairs already queried.
+    """
+    classes, fclass_codes = np.unique(city.fclass.astype(str), return_inverse=True)
+    arrays = {
+        'osm_id': city.osm_id, 'fclass_codes': fclass_codes.astype(np.int32),
+        'type_id': city.type_id, 'part_feature': city.part_feature,
+        'part_offsets': city.part_offsets, 'coords': city.coords,
+    }
+    if city.quantized is not None:
+        arrays['quantized'] = city.quantized
+    for name in properties:
+        arrays[name] = getattr(city, name)
+    start, end = city.endpoints
+    arrays['endpoint_start'], arrays['endpoint_end'] = start, end
+    offsets = list(city._pairs)
+    for k, offset in enumerate(offsets):
+        arrays[f'pairs{k}_i'], arrays[f'pairs{k}_j'] = city._pairs[offset]
+    meta = {
+        'classes': classes.tolist(), 'crs': None if city.crs is None else str(city.crs), 'units': city.units,
+        'properties': list(properties), 'pair_offsets': offsets, 'tile_size': city.tile_size,
+        'road_features': city.road_features,
+    }
+    return share_arrays(arrays, meta, directory)
+
+def attach_city(shared):
+    """
+    City on shared arrays (read-only, no copies). Attached once per process
+    and directory; later calls return the same city.
+    """
+    if shared.directory in _ATTACHED:
+        return _ATTACHED[shared.directory]
+    arrays, meta = attach_arrays(shared)
+    # Class names are built from the shared codes only if a stage uses them
+    city = CityData.from_arrays(
+        arrays['osm_id'], arrays['fclass_codes'], arrays['type_id'], arrays['part_feature'],
+        arrays['part_offsets'], arrays['coords'], arrays.get('quantized'), classes=meta['classes'],
+        road_features=meta['road_features'],
+    )
+    city.crs, city.units, city.tile_size = meta['crs'], meta['units'], meta['tile_size']
+    for name in meta['properties']:
+        city.__dict__[name] = arrays[name]
+    city.__dict__['endpoints'] = (arrays['endpoint_start'], arrays['endpoint_end'])
+    for k, offset in enumerate(meta['pair_offsets']):
+        city._pairs[offset] = (arrays[f'pairs{k}_i'], arrays[f'pairs{k}_j'])
+    _ATTACHED[shared.directory] = city
+    return city
+
+@contextmanager
+def shared_city(city, properties=SHARED_PROPERTIES):
+    """Share a city for the duration of a with block."""
+    shared = share_city(city, properties)
+    try:
+        yield shared
+    finally:
+        release(shared)
+
+def _call_on_city(args):
+    function, shared, item = args
+    return function(attach_city(shared), item)
+
+def map_city(function, city, items, processes=None):
+    """
+    function(city, item) for every item (e.g. the thresholds of a sweep)
+    on a process pool, the city shared once instead of pickled per task.
+    function must be importable by the workers (a module-level function).
+    """
+    with shared_city(city) as shared:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(_call_on_city, [(function, shared, item) for item in items]))
@@ -0,0 +1,185 @@
+"""
+Spacing of the road hierarchy: distance to the nearest higher class.
+
+For every counted segment of a class in the ordered hierarchy (motorway
+> trunk > primary > secondary > tertiary > residential), the distance
+from its midpoint to the nearest segment of any higher class is measured
+in a local metric projection. The segments are sorted by class, so the
+higher classes of every class are a prefix of the sorted segments: one
+STRtree per class over that prefix answers all its midpoints in one
+bulk query_nearest call, with no pairwise loops. Midpoints are used
+rather than whole segments, so a road that meets a higher class at a
+junction is not at distance 0 over its whole length.
+
+Per city the distances are summarized by class, weighted by segment
+length: quantiles, the length share in every distance bin, and the
+share of the length whose nearest higher road is of each class.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from collections import namedtuple
+
+from .citydata import CityData, class_codes
+from .engine import LENGTH_TYPES, counted_features
+from .store import records, result_name, write_results
+
+# Ordered hierarchy, from the highest class down
+SPACING_TYPES = ['motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'residential']
+# Distance bins (m) of the length distributions
+BINS = np.array([0, 25, 50, 100, 200, 400, 800, 1600, 3200, 6400, np.inf])
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+SpacingResult = namedtuple('SpacingResult', ['segments', 'summary', 'distribution', 'nearest'])
+
+# ----- Distances -----
+
+def higher_class_distances(city, road_types=SPACING_TYPES, max_distance=None):
+    """
+    Distance (coordinate units) from the midpoint of every counted segment
+    of the road types to the nearest segment of a higher class, and the
+    class of that segment. inf and no class for the top class, and beyond
+    max_distance.
+    """
+    rank = class_codes(city.road_class, road_types)
+    features = counted_features(city, LENGTH_TYPES) & (rank >= 0)
+    segments = np.flatnonzero(features[city.segment_feature])
+    segment_rank = rank[city.segment_feature[segments]]
+    order = np.argsort(segment_rank, kind='stable')
+    segments, segment_rank = segments[order], segment_rank[order]
+    bounds = np.searchsorted(segment_rank, np.arange(len(road_types) + 1))
+
+    lines = city.segment_lines(segments)
+    start = city.segment_start[segments]
+    midpoints = shapely.points((city.coords[start] + city.coords[start + 1]) / 2)
+    distance = np.full(len(segments), np.inf)
+    nearest = np.full(len(segments), -1)
+    for k in range(1, len(road_types)):
+        lo, hi = bounds[k], bounds[k + 1]
+        if lo == 0 or lo == hi:
+            continue
+        tree = shapely.STRtree(lines[:lo])
+        (i, j), d = tree.query_nearest(midpoints[lo:hi], max_distance=max_distance,
+                                       return_distance=True, all_matches=False)
+        distance[lo + i] = d
+        nearest[lo + i] = segment_rank[j]
+
+    return pd.DataFrame({
+        'segment': segments,
+        'feature': city.segment_feature[segments],
+        'road_type': pd.Categorical.from_codes(segment_rank, road_types),
+        'length': city.segment_lengths[segments],
+        'distance': distance,
+        'nearest_type': pd.Categorical.from_codes(nearest, road_types),
+    })
+
+# ----- Distributions -----
+
+def weighted_quantiles(values, weights, quantiles=QUANTILES):
+    """Quantiles of values weighted by weights (NaN when empty)."""
+    if not len(values) or weights.sum() <= 0:
+        return np.full(len(quantiles), np.nan)
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    index = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1])
+    return values[order][np.minimum(index, len(values) - 1)]
+
+def spacing_summary(table, quantiles=QUANTILES):
+    """
+    Per class: length (km), share of it with a higher class within reach,
+    and the length-weighted mean and quantiles of the distance (m).
+    """
+    rows = []
+    for road_type, group in table.groupby('road_type', observed=True):
+        distance, length = group['distance'].to_numpy(), group['length'].to_numpy()
+        finite = np.isfinite(distance)
+        if not finite.any():
+            continue
+        row = {
+            'road_type': road_type, 'length': length.sum(),
+            'matched_share': length[finite].sum() / length.sum(),
+            'mean': np.average(distance[finite], weights=length[finite]),
+        }
+        row.update(zip([f'p{round(100 * q)}' for q in quantiles],
+                       weighted_quantiles(distance[finite], length[finite], quantiles)))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def distance_distribution(table, bins=BINS):
+    """
+    Share of the length of every class in every distance bin. Returns a
+    tidy table: road_type, bin (label 'lower-upper'), lower, upper, share.
+    """
+    road_types = table['road_type'].cat.categories
+    code = table['road_type'].cat.codes.to_numpy()
+    distance, length = table['distance'].to_numpy(), table['length'].to_numpy()
+    finite = np.isfinite(distance)
+    n_bins = len(bins) - 1
+    cell = code[finite] * n_bins + np.searchsorted(bins, distance[finite], side='right') - 1
+    totals = np.bincount(code, weights=length, minlength=len(road_types))
+    lengths = np.bincount(cell, weights=length[finite], minlength=len(road_types) * n_bins).reshape(-1, n_bins)
+    shares = np.divide(lengths, totals[:, None], out=np.zeros(lengths.shape), where=totals[:, None] > 0)
+    cls, b = np.nonzero(lengths)
+    labels = np.array([f'{lower:g}-{upper:g}' for lower, upper in zip(bins[:-1], bins[1:])], dtype=object)
+    return pd.DataFrame({
+        'road_type': np.asarray(road_types, dtype=object)[cls], 'bin': labels[b],
+        'lower': bins[b], 'upper': bins[b + 1], 'share': shares[cls, b],
+    })
+
+def nearest_shares(table):
+    """Share of the length of every class whose nearest higher road is of each class."""
+    matched = table[table['nearest_type'].notna()]
+    length = matched.groupby(['road_type', 'nearest_type'], observed=True)['length'].sum()
+    share = length / length.groupby(level='road_type', observed=True).transform('sum')
+    return share.rename('share').reset_index()
+
+def hierarchy_spacing(city, projection='utm', max_distance=None, road_types=SPACING_TYPES):
+    """
+    Nearest-higher-class distances (m) of a city and their length-weighted
+    distributions. Geographic cities are projected to a local metric CRS first.
+    """
+    table = higher_class_distances(city.to_metric(projection), road_types, max_distance)
+    return SpacingResult(table, spacing_summary(table), distance_distribution(table), nearest_shares(table))
+
+def spacing_records(result, country, city, year, quantiles=QUANTILES):
+    """Rows of the result store of a SpacingResult."""
+    summary = result.summary
+    columns = ['matched_share', 'mean'] + [f'p{round(100 * q)}' for q in quantiles]
+    parts = [records(summary, country, city, year, f'higher_distance_{c}', value=c) for c in columns]
+    parts.append(records(result.distribution, country, city, year, 'higher_distance_share', other_type='bin', value='share'))
+    parts.append(records(result.nearest, country, city, year, 'nearest_higher_share', other_type='nearest_type', value='share'))
+    return pd.concat(parts, ignore_index=True)
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the hierarchy spacing of every city and year and write it to
+    the result store. Replace file paths with your own data.
+    """
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    store_path = '/your_path/to/output/results'
+    max_distance = 10000  # metres; farther segments count as unmatched
+
+    city_names = pd.read_excel(city_list_path)['city']
+    for year in range(15, 23):
+        rows = []
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            result = hierarchy_spacing(CityData.from_csv(road_path), max_distance=max_distance)
+            rows.append(spacing_records(result, country, city_clean, 2000 + year))
+            print(f"{city_clean} done for year 20{year}")
+        if rows:
+            write_results(store_path, pd.concat(rows, ignore_index=True), result_name(country, 'spacing'))
+    print(f"Hierarchy spacing saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Columnar result store.
+
+Results of every stage go into one Parquet dataset with a fixed schema:
+one row per country, city, year, road_type, other_type (the second class
+of pairwise metrics, empty otherwise), metric and value. The dataset is
+partitioned by metric and year (metric=.../year=.../{name}.parquet), so
+a query only opens the files of the metrics and years it asks for and
+filters the rest with pyarrow.
+
+Every stage names its files with result_name: {country}_{stage} for a
+batch over the cities, {country}_{city}_{stage} for one city. Writing
+rows replaces the rows with the same country, city, road_type and
+other_type in the other files of their metric and year, so a city
+rerun on its own after a batch (or the other way round) is stored once.
+Each file records its cities in its Parquet metadata, so a write only
+reads and rewrites the files that hold one of its cities.
+Tables with several value columns (scaling fits, SAMI residuals, LISA,
+clusters) are stored one metric per column with table_records and read
+back with read_table.
+"""
+
+import json
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .engine import CONNECTING_TYPES
+
+SCHEMA = pa.schema([
+    ('country', pa.string()),
+    ('city', pa.string()),
+    ('year', pa.int32()),
+    ('road_type', pa.string()),
+    ('other_type', pa.string()),
+    ('metric', pa.string()),
+    ('value', pa.float64()),
+])
+COLUMNS = SCHEMA.names
+PARTITIONS = ['metric', 'year']
+PARTITIONING = ds.partitioning(pa.schema([SCHEMA.field(p) for p in PARTITIONS]), flavor='hive')
+FILE_SCHEMA = pa.schema([f for f in SCHEMA if f.name not in PARTITIONS])
+
+KEYS = ['country', 'city', 'road_type', 'other_type']
+CITIES_METADATA = 'roadhierarchy.cities'
+
+# ----- Records -----
+
+def result_name(country, stage, city=None):
+    """File name of the rows of a stage: {country}_{stage}, or {country}_{city}_{stage} for one city."""
+    return f"{country}_{stage}" if city is None else f"{country}_{city}_{stage}"
+
+def records(frame, country, city, year, metric, road_type='road_type', other_type=None, value='value'):
+    """
+    Rows of the store from a table with a road type column and a value
+    column. country, city and year None are read from the table's columns
+    of that name; road_type None stores an empty road type.
+    """
+    return pd.DataFrame({
+        'country': frame['country'].to_numpy() if country is None else country,
+        'city': frame['city'].to_numpy() if city is None else city,
+        'year': frame['year'].to_numpy() if year is None else year,
+        'road_type': frame[road_type].to_numpy() if road_type else '',
+        'other_type': frame[other_type].astype(str).to_numpy() if other_type else '',
+        'metric': metric,
+        'value': frame[value].to_numpy(dtype=float),
+    }, index=frame.index)[COLUMNS]
+
+def table_records(frame, columns, prefix, country=None, city=None, year=None, road_type='road_type'):
+    """Rows of several value columns of a table, one metric ({prefix}{column}) per column."""
+    return pd.concat([records(frame, country, city, year, prefix + column, road_type, value=column)
+                      for column in columns], ignore_index=True)
+
+def matrix_records(matrix, road_types, country, city, year, metric):
+    """Rows of a class x class matrix."""
+    frame = pd.DataFrame(matrix, index=list(road_types), columns=list(road_types))
+    frame = frame.stack().rename('value').rename_axis(['road_type', 'other_type']).reset_index()
+    return records(frame, country, city, year, metric, other_type='other_type')
+
+def result_records(result, country, city, year):
+    """Rows of an engine CityResult: lengths, connection matrices and parallel-match counts."""
+    lengths = pd.DataFrame({'road_type': list(result.lengths), 'value': list(result.lengths.values())})
+    matches = result.matches.groupby(['match_type', 'type']).size().rename('value').reset_index()
+    parts = [
+        records(lengths, country, city, year, 'length'),
+        matrix_records(result.matrix, result.matrix_types, country, city, year, 'connection'),
+        records(matches, country, city, year, 'parallel_matches', 'match_type', 'type'),
+    ]
+    if result.counts is not None:
+        parts.append(matrix_records(result.counts, CONNECTING_TYPES, country, city, year, 'raw_connections'))
+    return pd.concat(parts, ignore_index=True)
+
+# ----- Writing and reading -----
+
+def _cities(frame):
+    """(country, city) pairs of a table of store rows."""
+    return set(zip(frame['country'], frame['city']))
+
+def _write_file(table, path):
+    """
+    Write a Parquet file, recording its cities in the file metadata,
+    through a hidden temporary file of its own, so readers never see a
+    partial file and concurrent writers never share a temporary file.
+    """
+    directory, file = os.path.split(path)
+    cities = sorted(_cities(table.select(['country', 'city']).to_pydict()))
+    table = table.replace_schema_metadata({CITIES_METADATA: json.dumps(cities)})
+    handle, temporary = tempfile.mkstemp(suffix='.tmp', prefix=f".{file}.", dir=directory)
+    os.close(handle)
+    try:
+        pq.write_table(table, temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+def _file_cities(path):
+    """Cities recorded in a file's metadata (only its footer is read), None for files without them."""
+    metadata = pq.read_schema(path).metadata or {}
+    if CITIES_METADATA.encode() not in metadata:
+        return None
+    return set(map(tuple, json.loads(metadata[CITIES_METADATA.encode()])))
+
+def _drop_keys(directory, keys, name):
+    """
+    Remove the rows with the given keys from the files of a partition
+    other than name. Only files recording one of the keys' cities are read.
+    """
+    cities = set(zip(keys.get_level_values('country'), keys.get_level_values('city')))
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith('.parquet') or file == f"{name}.parquet":
+            continue
+        path = os.path.join(directory, file)
+        stored_cities = _file_cities(path)
+        if stored_cities is not None and not stored_cities & cities:
+            continue
+        stored = pq.read_table(path, columns=KEYS).to_pandas()
+        duplicate = pd.MultiIndex.from_frame(stored).isin(keys)
+        if not duplicate.any():
+            continue
+        if duplicate.all():
+            os.remove(path)
+        else:
+            _write_file(pq.read_table(path, schema=FILE_SCHEMA).filter(pa.array(~duplicate)), path)
+
+def write_results(root, rows, name):
+    """
+    Write rows into the store as the files called name of their metrics
+    and years, replacing those files and the rows with the same keys
+    (country, city, road_type, other_type) in the other files.
+    """
+    rows = rows[COLUMNS].assign(other_type=rows['other_type'].fillna(''))
+    rows = rows.drop_duplicates(KEYS + PARTITIONS, keep='last')
+    for (metric, year), group in rows.groupby(PARTITIONS, sort=False):
+        directory = os.path.join(root, f"metric={metric}", f"year={year}")
+        os.makedirs(directory, exist_ok=True)
+        _drop_keys(directory, pd.MultiIndex.from_frame(group[KEYS]), name)
+        table = pa.Table.from_pandas(group.drop(columns=PARTITIONS), schema=FILE_SCHEMA, preserve_index=False)
+        _write_file(table, os.path.join(directory, f"{name}.parquet"))
+
+def _condition(column, value):
+    field = ds.field(column)
+    if isinstance(value, (list, tuple, set, range)):
+        return field.isin(list(value))
+    return field == value
+
+def read_results(root, metric=None, country=None, city=None, year=None, road_type=None, other_type=None):
+    """
+    Rows of the store matching the given values (a value or a list of
+    values per column). Returns a DataFrame with the store columns.
+    """
+    conditions = [
+        _condition(column, value) for column, value in [
+            ('metric', metric), ('country', country), ('city', city), ('year', year),
+            ('road_type', road_type), ('other_type', other_type),
+        ] if value is not None
+    ]
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    dataset = ds.dataset(root, schema=SCHEMA, format='parquet', partitioning=PARTITIONING)
+    return dataset.to_table(filter=expression).to_pandas()[COLUMNS]
+
+def read_table(root, columns, prefix, country=None, city=None, year=None, road_type=None):
+    """
+    Table written with table_records: one row per country, city, year
+    and road type, one column per value column.
+    """
+    rows = read_results(root, [prefix + column for column in columns], country, city, year, road_type)
+    index = ['country', 'city', 'year', 'road_type']
+    wide = rows.pivot(index=index, columns='metric', values='value').sort_index()
+    wide = wide.rename(columns=lambda metric: metric[len(prefix):])
+    return wide.reindex(columns=list(columns)).reset_index().rename_axis(columns=None)
+
+# ----- Queries -----
+
+def length_table(root, country=None, year=None):
+    """Tidy length table (country, year, city, road_type, length), the layout of scaling.read_length_table."""
+    rows = read_results(root, 'length', country=country, year=year)
+    return rows.rename(columns={'value': 'length'})[['country', 'year', 'city', 'road_type', 'length']]
+
+def lengths_wide(root, country, year):
+    """City x road type lengths of one country and year, as in the yearly length workbooks."""
+    rows = read_results(root, 'length', country=country, year=year)
+    return rows.pivot_table(index='city', columns='road_type', values='value', sort=False)
+
+def city_matrix(root, country, city, year, metric='connection'):
+    """Class x class matrix of one city and year."""
+    rows = read_results(root, metric, country=country, city=city, year=year)
+    return rows.pivot_table(index='road_type', columns='other_type', values='value', sort=False)
+
+def metric_table(root, metric, country=None, year=None, road_type=None):
+    """City x year table of one metric and road type, e.g. flow shares over the years."""
+    rows = read_results(root, metric, country=country, year=year, road_type=road_type)
+    return rows.pivot_table(index=['country', 'city'], columns='year', values='value')
@@ -0,0 +1,244 @@
+"""
+Access of the road hierarchy to metro stations and lines.
+
+For every road segment the distance to the nearest metro target is
+measured in a local metric projection, both straight-line and along the
+road network. Targets are the station points of the city (the railway or
+transport layer read with the roads), or the metro lines themselves
+(subway, light_rail, monorail, as in 4-parallel.py) when a city has no
+stations. Straight-line distances come from one bulk STRtree
+query_nearest over the segments; network distances from one Dijkstra
+run on the road graph out of a virtual source linked to the road node
+nearest to every target (KD-tree query), so the cost stays linear in the
+segments. Distances are summarized per road class with the segment
+lengths as weights: mean, median and the share of length within given
+distances of a station.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import shapely
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+
+from .citydata import CityData, LINESTRING, MULTILINESTRING, POINT, class_codes, read_city_frame
+from .engine import LENGTH_TYPES, counted_features
+from .flows import GRAPH_TYPES
+from .store import records, result_name, write_results
+
+METRO_TYPES = ['subway', 'light_rail', 'monorail']
+# Point classes of stations in the OSM railway and transport layers
+STATION_TYPES = ['railway_station', 'railway_halt', 'subway_entrance', 'station']
+ACCESS_TYPES = GRAPH_TYPES
+# Distances (m) of the within-distance length shares
+BANDS = [500, 1000, 2000]
+# Segments per nearest query, which bounds the temporary segment geometries
+CHUNK = 500_000
+
+AccessResult = namedtuple('AccessResult', ['segments', 'summary', 'target'])
+
+# ----- Targets and segments -----
+
+def read_access_city(road_path, rail_path=None, station_path=None):
+    """City with its roads, railways and (optionally) a CSV of station points."""
+    road = read_city_frame(road_path)
+    paths = [path for path in [rail_path, station_path] if path]
+    frame = pd.concat([road] + [read_city_frame(path) for path in paths], ignore_index=True)
+    return CityData(frame, len(road))
+
+def metro_targets(city, station_types=STATION_TYPES, metro_types=METRO_TYPES):
+    """
+    Rows of the station points of a city, or of its metro lines when it
+    has no stations. Returns the rows and the kind ('stations' or 'lines').
+    """
+    stations = np.flatnonzero((city.type_id == POINT) & np.isin(city.road_class, station_types))
+    if len(stations):
+        return stations, 'stations'
+    lines = np.isin(city.type_id, [LINESTRING, MULTILINESTRING]) & np.isin(city.road_class, metro_types)
+    return np.flatnonzero(lines), 'lines'
+
+def access_segments(city, road_types=ACCESS_TYPES):
+    """Segments (indices into the segment arrays) of the counted lines of the road types."""
+    features = counted_features(city, LENGTH_TYPES) & (class_codes(city.road_class, road_types) >= 0)
+    return np.flatnonzero(features[city.segment_feature])
+
+# ----- Distances -----
+
+def euclidean_distances(city, segments, targets, max_distance=None, chunk=CHUNK):
+    """
+    Distance from every segment to the nearest target geometry (coordinate
+    units), inf beyond max_distance or without targets.
+    """
+    distance = np.full(len(segments), np.inf)
+    if not len(targets):
+        return distance
+    tree = shapely.STRtree(city.geoms[targets])
+    for s in range(0, len(segments), chunk):
+        lines = city.segment_lines(segments[s:s + chunk])
+        (i, _), d = tree.query_nearest(lines, max_distance=max_distance, return_distance=True, all_matches=False)
+        distance[s + i] = d
+    return distance
+
+def _shortest_edges(u, v, weight):
+    """Keep the lightest of parallel edges (a sparse matrix would add them)."""
+    a, b = np.minimum(u, v), np.maximum(u, v)
+    order = np.lexsort([weight, b, a])
+    a, b, weight = a[order], b[order], weight[order]
+    first = np.ones(len(a), dtype=bool)
+    first[1:] = (a[1:] != a[:-1]) | (b[1:] != b[:-1])
+    return a[first], b[first], weight[first]
+
+def network_distances(city, segments, targets, max_snap=None):
+    """
+    Distance along the segments from every segment to the nearest target
+    (coordinate units): the snapping distance of the target to its
+    nearest road node plus the shortest path to the nearer segment end.
+    Targets farther than max_snap from the roads are left out; segments
+    not connected to any target get inf.
+    """
+    distance = np.full(len(segments), np.inf)
+    start = city.vertex_id[city.segment_start[segments]]
+    end = city.vertex_id[city.segment_start[segments] + 1]
+    if not len(targets) or not len(segments):
+        return distance
+    n_nodes = int(city.vertex_id.max()) + 1
+    xy = np.empty((n_nodes, 2))
+    has_id = city.vertex_id >= 0
+    xy[city.vertex_id[has_id]] = city.coords[has_id]
+
+    # Every target vertex is linked to the nearest road node, from one virtual source
+    nodes = np.unique(np.concatenate([start, end]))
+    points = shapely.get_coordinates(city.geoms[targets])
+    offset, k = cKDTree(xy[nodes]).query(points, distance_upper_bound=np.inf if max_snap is None else max_snap)
+    snapped = np.isfinite(offset)
+    source = n_nodes
+    ok = start != end
+    u = np.concatenate([start[ok], np.full(snapped.sum(), source)])
+    v = np.concatenate([end[ok], nodes[k[snapped]]])
+    length = np.hypot(*(city.coords[city.segment_start[segments] + 1] - city.coords[city.segment_start[segments]]).T)
+    # Explicit zeros would not be stored as edges
+    weight = np.maximum(np.concatenate([length[ok], offset[snapped]]), 1e-9)
+    u, v, weight = _shortest_edges(u, v, weight)
+    graph = sparse.csr_matrix((weight, (u, v)), shape=(n_nodes + 1, n_nodes + 1))
+
+    reach = dijkstra(graph, directed=False, indices=source)
+    return np.minimum(reach[start], reach[end])
+
+# ----- Summary -----
+
+def weighted_median(values, weights):
+    """Median of values weighted by weights (NaN when empty)."""
+    if not len(values):
+        return np.nan
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    return values[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+
+def access_summary(table, bands=BANDS):
+    """
+    Per road class and measure (euclidean, network): length (km), mean and
+    median distance (m) weighted by segment length over the segments that
+    reach a target, and the share of the length within every band.
+    """
+    rows = []
+    for (road_type, measure), group in table.melt(
+            id_vars=['road_type', 'length'], value_vars=['euclidean', 'network'],
+            var_name='measure', value_name='distance').groupby(['road_type', 'measure']):
+        distance, length = group['distance'].to_numpy(), group['length'].to_numpy()
+        finite = np.isfinite(distance)
+        row = {
+            'road_type': road_type, 'measure': measure, 'length': length.sum(),
+            'mean': np.average(distance[finite], weights=length[finite]) if length[finite].sum() > 0 else np.nan,
+            'median': weighted_median(distance[finite], length[finite]),
+        }
+        for band in bands:
+            row[f'within_{band}'] = length[distance <= band].sum() / length.sum() if length.sum() > 0 else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def metro_access(city, projection='utm', max_distance=None, max_snap=None, road_types=ACCESS_TYPES, bands=BANDS):
+    """
+    Straight-line and network distance (m) of every counted road segment
+    to the nearest metro target, and their summary by class. Geographic
+    cities are projected to a local metric CRS first.
+    """
+    city = city.to_metric(projection)
+    targets, kind = metro_targets(city)
+    segments = access_segments(city, road_types)
+    table = pd.DataFrame({
+        'segment': segments,
+        'feature': city.segment_feature[segments],
+        'road_type': city.road_class[city.segment_feature[segments]],
+        'length': city.segment_lengths[segments],
+        'euclidean': euclidean_distances(city, segments, targets, max_distance),
+        'network': network_distances(city, segments, targets, max_snap),
+    })
+    return AccessResult(table, access_summary(table, bands), kind)
+
+# ----- Batch -----
+
+def _city_summary(args):
+    name, road_path, rail_path, station_path, projection, max_distance = args
+    city = read_access_city(road_path, rail_path, station_path)
+    result = metro_access(city, projection, max_distance)
+    return name, result.summary.assign(target=result.target)
+
+def batch_access(tasks, projection='utm', max_distance=None, processes=None):
+    """
+    Summaries of many cities on a process pool. tasks are (name, road_path,
+    rail_path, station_path) tuples; only the summaries come back from the
+    workers. Returns {name: summary}.
+    """
+    args = [task + (projection, max_distance) for task in tasks]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return dict(pool.map(_city_summary, args))
+
+def summary_records(summary, country, city, year, bands=BANDS):
+    """Rows of the result store: metro_{measure}_{mean, median, within_band} by class."""
+    parts = []
+    for measure, group in summary.groupby('measure'):
+        for column in ['mean', 'median'] + [f'within_{band}' for band in bands]:
+            parts.append(records(group, country, city, year, f'metro_{measure}_{column}', value=column))
+    return pd.concat(parts, ignore_index=True)
+
+# ----- Main -----
+
+def main():
+    """
+    Compute the metro access summaries of every city and year in parallel
+    and write them to the result store. Replace file paths with your own data.
+    """
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    road_csv_path = '/your_output_path/20{year}/road/{city}_osm_road.csv'
+    rail_csv_path = '/your_output_path/20{year}/railway/{city}_osm_railway.csv'
+    station_csv_path = '/your_output_path/20{year}/transport/{city}_osm_transport.csv'
+    store_path = '/your_path/to/output/results'
+    max_distance = 20000  # metres; farther segments count as beyond every band
+
+    city_names = pd.read_excel(city_list_path)['city']
+    for year in range(15, 23):
+        tasks = []
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            rail_path = rail_csv_path.format(year=year, city=city_clean)
+            station_path = station_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            tasks.append((city_clean, road_path, rail_path if os.path.exists(rail_path) else None,
+                          station_path if os.path.exists(station_path) else None))
+        summaries = batch_access(tasks, max_distance=max_distance)
+        rows = [summary_records(summary, country, name, 2000 + year) for name, summary in summaries.items()]
+        if rows:
+            write_results(store_path, pd.concat(rows, ignore_index=True), result_name(country, 'transit'))
+        print(f"Metro access done for year 20{year}: {len(summaries)} cities")
+    print(f"Metro access saved to {store_path}")
+
+if __name__ == '__main__':
+    main()
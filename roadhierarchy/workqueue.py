@@ -0,0 +1,484 @@
+"""
+Multi-node execution through a shared-filesystem work queue.
+
+A coordinator publishes one task per city, year and per-city stage
+(engine, junctions, flows) into a queue directory on a filesystem that
+every host mounts (NFS or similar). Workers on any number of hosts pull
+tasks and run each one as a short `python -m roadhierarchy city` process
+that writes its results to the shared output directory and result store.
+
+The queue is plain files:
+
+    tasks/{id}.json     published tasks
+    leases/{id}.json    task claimed by a worker (exclusive create)
+    done/{id}.json      finished tasks, with runtime and peak memory
+    failed/{id}.json    tasks that failed max_attempts times or timed out
+    stale/{id}.{n}      broken leases, one per failed or lost attempt
+    logs/{id}.{n}.log   output of every attempt
+
+A worker claims a task by creating its lease with O_EXCL, which only one
+host can win, and touches the lease every `heartbeat` seconds while the
+task runs. A lease whose modification time has not changed for `timeout`
+seconds, as observed by the local clock of whoever is watching (so host
+clocks need not agree), belongs to a dead worker: it is renamed into
+stale/, which again only one watcher can do, and the task becomes
+pending again. A lease records the worker and attempt that took it, and
+a worker only touches or removes a lease that is still its own, so a
+worker that stalled past the timeout never breaks the lease of the
+worker the task was reassigned to. Results are written by replacing
+files, so a task that does run twice leaves the same results. A task
+whose process runs longer than task_timeout seconds is killed and set
+aside in failed/ without further attempts, as it would time out again.
+failed_tasks lists the failed tasks with the reason, attempts and last
+log, and retry_failed (or publish with retry=True) makes them pending
+again. The peak memory of a task is sampled over its whole process group,
+so it includes the pools the task started.
+Several workers on one machine use the same queue, which is how the
+queue is tested locally.
+"""
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as futures_wait
+
+# Directory the package is imported from, for the task processes
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUEUE_DIRS = ['tasks', 'leases', 'done', 'failed', 'stale', 'logs']
+CITY_STAGES = ['engine', 'junctions', 'flows']
+# Seconds between the memory samples (and timeout checks) of a running task
+SAMPLE_INTERVAL = 0.5
+
+# ----- Tasks -----
+
+def task_id(stage, country, year, city):
+    """File-safe id of a task."""
+    name = ''.join(ch if ch.isalnum() or ch in '-_' else '_' for ch in city)
+    return f"{stage}-{country}-{year}-{name}"
+
+def city_task(stage, country, year, city, road_path, rail_path=None, output_dir='.', store=None,
+              metric=None, grid_cell=None, simplify=None):
+    """
+    Task running one per-city stage. args are the arguments of the
+    `python -m roadhierarchy city` command; store is the result store root.
+    """
+    args = [road_path, '--stage', stage, '--output', output_dir]
+    if rail_path:
+        args += ['--rail', rail_path]
+    if store:
+        args += ['--store', store, '--country', country, '--year', str(year)]
+    if stage == 'engine' and metric:
+        args += ['--metric', metric]
+    if stage == 'engine' and grid_cell:
+        args += ['--grid', str(grid_cell)]
+    if simplify:
+        args += ['--simplify', str(simplify)]
+    return {
+        'id': task_id(stage, country, year, city), 'stage': stage, 'country': country,
+        'year': year, 'city': city, 'args': args,
+    }
+
+def _path(root, directory, name, suffix='.json'):
+    return os.path.join(root, directory, f"{name}{suffix}")
+
+def _write_json(path, data):
+    """Write a JSON file atomically (readers never see a partial file)."""
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def _ids(root, directory):
+    return {name[:-5] for name in os.listdir(os.path.join(root, directory)) if name.endswith('.json')}
+
+# ----- Coordinator -----
+
+def init_queue(root):
+    """Create the queue directories."""
+    for directory in QUEUE_DIRS:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+def publish(root, tasks, retry=False):
+    """
+    Add tasks to the queue, leaving out finished ones. Failed tasks stay
+    set aside unless retry is set. Returns the number published.
+    """
+    init_queue(root)
+    done = _ids(root, 'done')
+    if retry:
+        retry_failed(root, [task['id'] for task in tasks])
+    published = 0
+    for task in tasks:
+        if task['id'] not in done:
+            _write_json(_path(root, 'tasks', task['id']), task)
+            published += 1
+    return published
+
+def queue_status(root):
+    """Ids of the pending, running, done and failed tasks."""
+    tasks, leases = _ids(root, 'tasks'), _ids(root, 'leases')
+    done, failed = _ids(root, 'done'), _ids(root, 'failed')
+    return {
+        'pending': tasks - leases - done - failed, 'running': leases - done,
+        'done': done, 'failed': failed - done,
+    }
+
+def failed_tasks(root):
+    """
+    Failed tasks, by id: why they were set aside ('timeout' or 'attempts'),
+    their number of attempts and the log of the last one.
+    """
+    failed = {}
+    for tid in _ids(root, 'failed') - _ids(root, 'done'):
+        try:
+            record = _read_json(_path(root, 'failed', tid))
+        except FileNotFoundError:
+            continue
+        n = record.get('attempts', record.get('attempt', 0))
+        failed[tid] = {
+            'reason': 'timeout' if record.get('timed_out') else 'attempts', 'attempts': n,
+            'log': _path(root, 'logs', f"{tid}.{n}", '.log'),
+        }
+    return failed
+
+def retry_failed(root, ids=None):
+    """
+    Make failed tasks (all, or those of ids) pending again with a fresh
+    count of attempts. Returns the ids of the tasks put back.
+    """
+    failed = _ids(root, 'failed')
+    retried = sorted(failed if ids is None else failed & set(ids))
+    stale = os.listdir(os.path.join(root, 'stale'))
+    for tid in retried:
+        for name in stale:
+            if name.startswith(f"{tid}."):
+                os.remove(os.path.join(root, 'stale', name))
+        os.remove(_path(root, 'failed', tid))
+    return retried
+
+def attempts(root, tid):
+    """Number of failed or lost attempts of a task."""
+    return sum(name.startswith(f"{tid}.") for name in os.listdir(os.path.join(root, 'stale')))
+
+def reclaim_stale(root, timeout, seen):
+    """
+    Break the leases whose heartbeat stopped for timeout seconds, so
+    their tasks are claimed again. seen maps every lease to the last
+    modification time observed and when it was first observed; the
+    caller keeps it between calls. Returns the ids of reclaimed tasks.
+    """
+    now = time.monotonic()
+    reclaimed = []
+    current = set()
+    for name in os.listdir(os.path.join(root, 'leases')):
+        path = os.path.join(root, 'leases', name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        current.add(name)
+        if seen.get(name, (None,))[0] != mtime:
+            seen[name] = (mtime, now)
+        elif now - seen[name][1] > timeout:
+            tid = name[:-5]
+            try:
+                os.rename(path, os.path.join(root, 'stale', f"{tid}.{uuid.uuid4().hex}"))
+            except FileNotFoundError:
+                continue
+            reclaimed.append(tid)
+            print(f"Lease of {tid} expired, task reassigned")
+    for name in set(seen) - current:
+        del seen[name]
+    return reclaimed
+
+def wait(root, timeout=60, poll=5):
+    """Watch the queue until every task is done or failed, reassigning the tasks of dead workers."""
+    seen = {}
+    while True:
+        reclaim_stale(root, timeout, seen)
+        status = queue_status(root)
+        if not status['pending'] and not status['running']:
+            return status
+        print(' '.join(f"{key}: {len(ids)}" for key, ids in status.items()))
+        time.sleep(poll)
+
+# ----- Workers -----
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _load_tasks(root, ids, cache):
+    """Published tasks by id; tasks do not change once published, so they are read once per worker."""
+    for tid in ids:
+        if tid not in cache:
+            try:
+                cache[tid] = _read_json(_path(root, 'tasks', tid))
+            except FileNotFoundError:
+                continue
+    return {tid: cache[tid] for tid in ids if tid in cache}
+
+def task_order(tasks):
+    """
+    Ids of the pending tasks in the order they are claimed: largest
+    predicted runtime first (see costmodel.plan_tasks), then by id.
+    """
+    return sorted(tasks, key=lambda tid: (-tasks[tid].get('seconds', 0), tid))
+
+def claim(root, worker, max_attempts=3, memory=None, cache=None):
+    """
+    Claim a pending task. Returns the task and its attempt number, or
+    None when no task could be claimed. With memory (MB), only tasks
+    whose predicted peak memory fits are considered. Tasks that used up
+    their attempts are moved to failed/.
+    """
+    tasks = _load_tasks(root, queue_status(root)['pending'], {} if cache is None else cache)
+    for tid in task_order(tasks):
+        if memory is not None and tasks[tid].get('memory_mb', 0) > memory:
+            continue
+        lease = _path(root, 'leases', tid)
+        try:
+            fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        attempt = attempts(root, tid) + 1
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker, 'attempt': attempt, 'claimed': time.time()}, f)
+        if os.path.exists(_path(root, 'done', tid)):
+            os.remove(lease)
+            continue
+        if attempt > max_attempts:
+            _write_json(_path(root, 'failed', tid), {'id': tid, 'attempts': attempt - 1, 'timed_out': False})
+            os.remove(lease)
+            continue
+        return tasks[tid], attempt
+    return None
+
+def _owns(lease, worker, attempt):
+    """Whether the lease is still the one the worker took for this attempt."""
+    try:
+        owner = _read_json(lease)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    return owner.get('worker') == worker and owner.get('attempt') == attempt
+
+def _heartbeat(lease, worker, attempt, interval, stop):
+    """Touch the lease until stopped; stops early if the lease was broken or reassigned."""
+    while not stop.wait(interval):
+        if not _owns(lease, worker, attempt):
+            return
+        try:
+            os.utime(lease)
+        except FileNotFoundError:
+            return
+
+def group_rss_mb(pgid):
+    """
+    Resident memory (MB) of the processes of a process group, summed from
+    /proc (0 without it). Pages shared by forked pool workers are counted
+    in each of them, so this bounds the group's memory from above.
+    """
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except FileNotFoundError:
+        return 0.0
+    pages = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+            # Fields after the command name (which may hold spaces): state, ppid, pgrp, ...
+            if int(stat[stat.rindex(')') + 2:].split()[2]) != pgid:
+                continue
+            with open(f'/proc/{pid}/statm') as f:
+                pages += int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def run_task(root, task, worker, attempt=1, heartbeat=10, task_timeout=None):
+    """
+    Run a task in a child process while heartbeating its lease. Returns
+    the run record: worker, attempt, exit code, seconds, the peak memory
+    (MB) of the child and the pools it started (sampled every
+    SAMPLE_INTERVAL seconds) and whether it was killed after task_timeout
+    seconds.
+    """
+    lease = _path(root, 'leases', task['id'])
+    log = _path(root, 'logs', f"{task['id']}.{attempt}", '.log')
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(lease, worker, attempt, heartbeat, stop), daemon=True)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PACKAGE_PARENT, os.environ.get('PYTHONPATH')])))
+    start = time.monotonic()
+    with open(log, 'w') as out:
+        # In its own process group, so a timeout also kills the pools it started
+        child = subprocess.Popen([sys.executable, '-m', 'roadhierarchy', 'city'] + task['args'],
+                                 stdout=out, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+        beat.start()
+        # Poll instead of blocking in wait4: the memory of the whole group is
+        # sampled, and while the child is not reaped its process group id
+        # cannot be reused, so the timeout only ever signals this task
+        peak, timed_out = 0.0, False
+        while True:
+            pid, status, usage = os.wait4(child.pid, os.WNOHANG)
+            if pid:
+                break
+            peak = max(peak, group_rss_mb(child.pid))
+            if task_timeout is not None and not timed_out and time.monotonic() - start > task_timeout:
+                os.killpg(child.pid, signal.SIGKILL)
+                timed_out = True
+            time.sleep(SAMPLE_INTERVAL)
+        child.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    stop.set()
+    beat.join()
+    return {
+        'id': task['id'], 'worker': worker, 'attempt': attempt, 'returncode': child.returncode,
+        'seconds': time.monotonic() - start, 'max_rss_mb': max(peak, usage.ru_maxrss / 1024),
+        'timed_out': timed_out,
+    }
+
+def _finish(root, worker, task, record):
+    """
+    Record a finished attempt: done, failed after a timeout, or a stale
+    lease counting as a failed attempt. The lease is only released if it
+    is still this worker's; a reassigned lease belongs to another worker.
+    """
+    tid = task['id']
+    lease = _path(root, 'leases', tid)
+    if record['returncode'] == 0:
+        # The results do not depend on who ran the task
+        _write_json(_path(root, 'done', tid), dict(task, **record))
+        print(f"Worker {worker}: {tid} done in {record['seconds']:.1f} s")
+    elif record['timed_out']:
+        _write_json(_path(root, 'failed', tid), dict(task, **record))
+        print(f"Worker {worker}: {tid} killed after {record['seconds']:.1f} s, marked failed")
+    if not _owns(lease, worker, record['attempt']):
+        print(f"Worker {worker}: lease of {tid} was reassigned while it ran")
+        return record['returncode'] == 0
+    try:
+        if record['returncode'] == 0 or record['timed_out']:
+            os.remove(lease)
+        else:
+            # The failed attempt is counted like a lost lease
+            os.rename(lease, os.path.join(root, 'stale', f"{tid}.{uuid.uuid4().hex}"))
+            print(f"Worker {worker}: {tid} failed (attempt {record['attempt']}, exit code {record['returncode']})")
+    except FileNotFoundError:
+        # The lease was broken since it was checked
+        pass
+    return record['returncode'] == 0
+
+def run_worker(root, worker=None, heartbeat=10, timeout=60, max_attempts=3, poll=5, until_empty=True,
+               memory_budget=None, slots=1, task_timeout=None):
+    """
+    Pull and run tasks until the queue is empty (or forever without
+    until_empty). Also reassigns the tasks of dead workers. Returns the
+    number of tasks this worker finished.
+
+    Up to slots tasks run at the same time. With memory_budget (MB), a
+    task is only started while the predicted peak memory of the running
+    tasks plus its own stays within the budget; a task larger than the
+    whole budget runs alone. With task_timeout (seconds), a task running
+    longer is killed and marked failed.
+    """
+    worker = worker or worker_name()
+    init_queue(root)
+    seen, cache, running = {}, {}, {}
+    finished = 0
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        while True:
+            reclaim_stale(root, timeout, seen)
+            for future in [f for f in running if f.done()]:
+                task, _ = running.pop(future)
+                finished += _finish(root, worker, task, future.result())
+
+            claimed = None
+            if len(running) < slots:
+                in_use = sum(task.get('memory_mb', 0) for task, _ in running.values())
+                memory = memory_budget - in_use if memory_budget is not None and running else None
+                claimed = claim(root, worker, max_attempts, memory, cache)
+            if claimed is not None:
+                task, attempt = claimed
+                running[pool.submit(run_task, root, task, worker, attempt, heartbeat, task_timeout)] = claimed
+                continue
+
+            if not running:
+                status = queue_status(root)
+                if until_empty and not status['pending'] and not status['running']:
+                    print(f"Worker {worker}: queue empty, {finished} tasks done")
+                    return finished
+                time.sleep(poll)
+            else:
+                futures_wait(list(running), timeout=poll, return_when=FIRST_COMPLETED)
+
+def run_local_workers(root, processes, **kwargs):
+    """Run several workers on this machine (e.g. to test the queue) and wait for them."""
+    import multiprocessing
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(root, f"{worker_name()}-{i}"), kwargs=kwargs)
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return queue_status(root)
+
+# ----- Main -----
+
+def main():
+    """
+    Publish the per-city tasks of every city and year, largest predicted
+    first, and watch the queue. Start workers on each host with
+        python -m roadhierarchy worker /shared/queue --memory 60000 --slots 8
+    Replace file paths with your own data (all on the shared filesystem).
+    """
+    import pandas as pd
+    from .costmodel import load_cost_model, plan_tasks
+
+    country = 'China'
+    city_list_path = 'city_name.xlsx'
+    queue_path = '/shared/queue'
+    road_csv_path = '/shared/20{year}/road/{city}_osm_road.csv'
+    rail_csv_path = '/shared/20{year}/railway/{city}_osm_railway.csv'
+    output_path = '/shared/output/20{year}'
+    store_path = '/shared/output/results'
+    model_path = '/shared/queue/cost_model.json'
+    worker_memory = 60000
+    stages = CITY_STAGES
+
+    city_names = pd.read_excel(city_list_path)['city']
+    tasks = []
+    for year in range(15, 23):
+        for city in city_names:
+            city_clean = city.replace("'", "")
+            road_path = road_csv_path.format(year=year, city=city_clean)
+            if not os.path.exists(road_path):
+                print(f"File not found: {road_path}")
+                continue
+            rail_path = rail_csv_path.format(year=year, city=city_clean)
+            for stage in stages:
+                tasks.append(city_task(
+                    stage, country, 2000 + year, city_clean, road_path,
+                    rail_path if os.path.exists(rail_path) else None,
+                    output_path.format(year=year), store_path,
+                ))
+    tasks = plan_tasks(tasks, load_cost_model(model_path), worker_memory)
+    print(f"{publish(queue_path, tasks)} tasks published to {queue_path}")
+    status = wait(queue_path)
+    print(f"{len(status['done'])} tasks done, {len(status['failed'])} failed")
+    for tid, failure in sorted(failed_tasks(queue_path).items()):
+        print(f"  {tid}: {failure['reason']} after {failure['attempts']} attempts, log {failure['log']}")
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,6 @@ Generates a two-panel figure showing city-level population and location.
 import pandas as pd
 import geopandas as gpd
 import matplotlib.pyplot as plt
-from shapely.geometry import Point
 from matplotlib.ticker import FuncFormatter, MultipleLocator
 
 # Set font for plotting
@@ -30,20 +29,34 @@ def dms_to_dd(dms):
     except:
         return None
 
+def dms_series_to_dd(values):
+    """Vectorized dms_to_dd for a Series of DMS strings (NaN where a value cannot be parsed)."""
+    dms = (values.astype(str).str.replace('°', ' ', regex=False).str.replace('′', ' ', regex=False)
+           .str.replace("''", ' ', regex=False).str.strip())
+    is_negative = dms.str.contains('S|W', regex=True)
+    parts = dms.str.replace('[NSEW]', '', regex=True).str.split(expand=True).reindex(columns=range(3))
+    numbers = parts.apply(pd.to_numeric, errors='coerce')
+    invalid = (parts.notna() & numbers.isna()).any(axis=1) | numbers[0].isna()
+    dd = numbers[0] + numbers[1].fillna(0) / 60 + numbers[2].fillna(0) / 3600
+    return dd.where(~is_negative, -dd).mask(invalid)
+
 def format_lon(x, pos): return f"{abs(x):.0f}°{'E' if x >= 0 else 'W'}"
 def format_lat(y, pos): return f"{abs(y):.0f}°{'N' if y >= 0 else 'S'}"
 
 # ----- Plotting Functions -----
 
-def plot_china(china_gdf, china_base, ax, nine_line=None):
-    """Plot Chinese cities and background."""
-    china_base.to_crs(epsg=4326).plot(ax=ax, fc="white", ec="gray", lw=0.6, alpha=0.7)
+def plot_china(china_gdf, china_base, ax, nine_line=None, base_wgs84=None):
+    """Plot Chinese cities and background (base_wgs84: china_base already reprojected to EPSG:4326)."""
+    if base_wgs84 is None:
+        base_wgs84 = china_base.to_crs(epsg=4326)
+    base_wgs84.plot(ax=ax, fc="white", ec="gray", lw=0.6, alpha=0.7)
     colors = {'Municipalities': '#E21C21', 'Prefectural-level': '#3A7CB5', 'County-level': '#51AE4F'}
 
     for level, color in colors.items():
         subset = china_gdf[china_gdf['rank'] == level]
         size = 12 if level != 'County-level' else 3
-        ax.scatter(subset['lon'], subset['lat'], s=subset['normalized_pop']/size, c=color, edgecolor='lightgray', lw=0.5, label=level)
+        ax.scatter(subset['lon'], subset['lat'], s=subset['normalized_pop']/size, c=color, edgecolor='lightgray', lw=0.5, label=level,
+                   rasterized=True)
 
     if nine_line is not None:
         ax_inset = ax.inset_axes([0.7, 0.07, 0.4, 0.3])
@@ -56,53 +69,73 @@ def plot_china(china_gdf, china_base, ax, nine_line=None):
     ax.xaxis.set_major_formatter(FuncFormatter(format_lon))
     ax.yaxis.set_major_formatter(FuncFormatter(format_lat))
 
-def plot_usa(usa_gdf, usa_base, ax):
-    """Plot US MSAs and μSAs."""
-    usa_base.to_crs(epsg=4326).plot(ax=ax, fc="white", ec="gray", lw=0.6, alpha=0.7)
+def plot_usa(usa_gdf, usa_base, ax, base_wgs84=None):
+    """Plot US MSAs and μSAs (base_wgs84: usa_base already reprojected to EPSG:4326)."""
+    if base_wgs84 is None:
+        base_wgs84 = usa_base.to_crs(epsg=4326)
+    base_wgs84.plot(ax=ax, fc="white", ec="gray", lw=0.6, alpha=0.7)
     colors = {'M1': '#3A7CB5', 'M2': '#51AE4F'}
 
     for label, color in colors.items():
         subset = usa_gdf[usa_gdf['LSAD'] == label]
         factor = 100000 if label == 'M1' else 7600
-        ax.scatter(subset['lon'], subset['lat'], s=subset['normalized_pop']/factor, c=color, edgecolor='lightgray', lw=0.5, label=label)
+        ax.scatter(subset['lon'], subset['lat'], s=subset['normalized_pop']/factor, c=color, edgecolor='lightgray', lw=0.5, label=label,
+                   rasterized=True)
 
     ax.set_xlim(-128, -66); ax.set_ylim(22, 54)
     ax.legend(frameon=False)
     ax.xaxis.set_major_formatter(FuncFormatter(format_lon))
     ax.yaxis.set_major_formatter(FuncFormatter(format_lat))
 
-# ----- Main Execution -----
-
-def main():
-    # Load and preprocess Chinese city data
-    # Placeholder: replace with actual file paths
-    china_base = gpd.read_file("path/to/china_boundary.shp")
-    china_gdf = pd.read_excel("path/to/china_city_data.xlsx")
-    nine_line = gpd.read_file("path/to/nine_line.shp")
-    china_gdf['lat'] = china_gdf['lat'].astype(str).apply(dms_to_dd)
-    china_gdf['lon'] = china_gdf['lon'].astype(str).apply(dms_to_dd)
-    china_gdf['geometry'] = [Point(xy) for xy in zip(china_gdf['lon'], china_gdf['lat'])]
-    china_gdf = gpd.GeoDataFrame(china_gdf, geometry='geometry', crs='EPSG:4326')
-    china_gdf['normalized_pop'] = china_gdf['2022pop']
-
-    # Load and preprocess US city data
-    usa_base = gpd.read_file("path/to/usa_boundary.shp")
-    usa_gdf = pd.read_excel("path/to/usa_city_data.xlsx")
-    usa_gdf['lat'] = usa_gdf['lat'].astype(str).apply(dms_to_dd)
-    usa_gdf['lon'] = usa_gdf['lon'].astype(str).apply(dms_to_dd)
-    usa_gdf['geometry'] = [Point(xy) for xy in zip(usa_gdf['lon'], usa_gdf['lat'])]
-    usa_gdf = gpd.GeoDataFrame(usa_gdf, geometry='geometry', crs='EPSG:4326')
-    usa_gdf['normalized_pop'] = usa_gdf['dp1_0001c']
-
-    # Plotting
+# ----- Data Preparation -----
+
+# Input files of the figure (placeholders: replace with actual file paths)
+INPUTS = {
+    'china_base': "path/to/china_boundary.shp",
+    'china_city': "path/to/china_city_data.xlsx",
+    'nine_line': "path/to/nine_line.shp",
+    'usa_base': "path/to/usa_boundary.shp",
+    'usa_city': "path/to/usa_city_data.xlsx",
+}
+
+def city_points(path, pop_col):
+    """Read a city table with DMS coordinates into a GeoDataFrame of points."""
+    cities = pd.read_excel(path)
+    cities['lat'] = dms_series_to_dd(cities['lat'])
+    cities['lon'] = dms_series_to_dd(cities['lon'])
+    cities['normalized_pop'] = cities[pop_col]
+    return gpd.GeoDataFrame(cities, geometry=gpd.points_from_xy(cities['lon'], cities['lat']), crs='EPSG:4326')
+
+def prepare_data(inputs=INPUTS):
+    """Read and preprocess every input of the figure (the part cached by visualization/build.py)."""
+    china_base = gpd.read_file(inputs['china_base'])
+    usa_base = gpd.read_file(inputs['usa_base'])
+    return {
+        'china_base': china_base,
+        'china_base_wgs84': china_base.to_crs(epsg=4326),
+        'china_gdf': city_points(inputs['china_city'], '2022pop'),
+        'nine_line': gpd.read_file(inputs['nine_line']),
+        'usa_base_wgs84': usa_base.to_crs(epsg=4326),
+        'usa_gdf': city_points(inputs['usa_city'], 'dp1_0001c'),
+    }
+
+def render(data):
+    """Draw the figure from prepared data."""
     fig, axes = plt.subplots(1, 2, figsize=(9, 3.3), dpi=300)
-    plot_usa(usa_gdf, usa_base, axes[0])
+    plot_usa(data['usa_gdf'], None, axes[0], base_wgs84=data['usa_base_wgs84'])
     axes[0].set_title("USA Cities", fontsize=12)
 
-    plot_china(china_gdf, china_base, axes[1], nine_line=nine_line)
+    plot_china(data['china_gdf'], data['china_base'], axes[1], nine_line=data['nine_line'],
+               base_wgs84=data['china_base_wgs84'])
     axes[1].set_title("China Cities", fontsize=12)
 
     plt.tight_layout()
+    return fig
+
+# ----- Main Execution -----
+
+def main():
+    render(prepare_data())
     plt.savefig("figures/figure1_spatial_distribution.pdf")
     plt.show()
 
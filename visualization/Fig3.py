@@ -1,31 +1,30 @@
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties
 from matplotlib.ticker import MultipleLocator
 from sklearn.metrics import r2_score
+from roadhierarchy.sami import SAMI_COLUMNS, load_residuals, top_n_split
 
 # ===========================
 # Function Definitions
 # ===========================
 
-def compute_residuals(n, x_log, y_log, population):
-    """Compute residuals for top-n and remaining cities based on population size"""
-    sorted_indices = np.argsort(population)[::-1]
-    top_n_indices = sorted_indices[:n]
-    remaining_indices = sorted_indices[n:]
-
-    residuals_top_n = np.array(y_log)[top_n_indices] - np.array(x_log)[top_n_indices]
-    residuals_remaining = np.array(y_log)[remaining_indices] - np.array(x_log)[remaining_indices]
-
-    mean_top_n = np.mean(np.abs(residuals_top_n))
-    mean_remaining = np.mean(np.abs(residuals_remaining))
-
-    print(f"Mean absolute residual (Top {n}): {mean_top_n}")
-    print(f"Mean absolute residual (Others): {mean_remaining}")
-
-    return (np.mean(residuals_top_n), mean_remaining,
-            top_n_indices, remaining_indices,
-            residuals_top_n, residuals_remaining)
+def covered_lengths(sami, road_types):
+    """
+    OSM length of every city summed over the SAMI road types an official
+    statistic covers, with the population and pop_rank of the SAMI table.
+    """
+    covered = sami[sami['road_type'].isin(road_types)]
+    return covered.groupby(['country', 'city'], as_index=False).agg(
+        population=('population', 'first'), pop_rank=('pop_rank', 'min'), length=('length', 'sum'))
+
+def split_residuals(cities, n):
+    """Top-n most populous cities and the others (sami.top_n_split), printing their mean absolute residuals"""
+    top, others = top_n_split(cities, n)
+    print(f"Mean absolute residual (Top {n}): {np.mean(np.abs(top['residual']))}")
+    print(f"Mean absolute residual (Others): {np.mean(np.abs(others['residual']))}")
+    return top, others
 
 def filter_zeros(bin_centers, hist):
     """Remove bins with zero count"""
@@ -76,127 +75,162 @@ label_offset_y = 1.12
 country_label_offset = 0.04
 
 # ===========================
-# Create Figure
+# Data Preparation
 # ===========================
 
-fig, ax = plt.subplots(1, 2, figsize=(10, 5), sharex=True, sharey=True)
-plt.xticks([]); plt.yticks([])
+# Input files of the figure: the result store and the official lengths
+# (columns: country, city, length; placeholder, replace with your actual data)
+INPUTS = {
+    'store': 'results',
+    'official': 'your_official_lengths.xlsx',
+}
+# Metrics read from the store
+METRICS = [f'sami_{column}' for column in SAMI_COLUMNS]
+year = 2020
+# SAMI road types counted by the official statistics (FHWA public roads,
+# MoHURD urban roads): no footways or rail
+OFFICIAL_TYPES = ['motorway*', 'primary', 'secondary', 'tertiary', 'residential*']
+
+def prepare_data(inputs=INPUTS):
+    """
+    OSM road length of the types in OFFICIAL_TYPES, official road length,
+    population and population rank of every city, all but the official
+    length from the SAMI table (the part cached by visualization/build.py).
+    The residual is log10(OSM length) - log10(official length); the top-n
+    split uses the stored pop_rank, so the top n are those of the n most
+    populous cities of the country that have official data.
+    """
+    osm = covered_lengths(load_residuals(inputs['store'], year=year), OFFICIAL_TYPES)
+    official = pd.read_excel(inputs['official'])
+    merged = osm.merge(official, on=['country', 'city'], suffixes=('_osm', '_official'))
+    merged['residual'] = np.log10(merged['length_osm']) - np.log10(merged['length_official'])
+    return {'usa': merged[merged['country'] == 'USA'], 'china': merged[merged['country'] == 'China']}
+
+def render(data):
+    """Draw the figure from prepared data."""
+    usa, china = data['usa'], data['china']
+
+    # ===========================
+    # Create Figure
+    # ===========================
+
+    fig, ax = plt.subplots(1, 2, figsize=(10, 5), sharex=True, sharey=True)
+    plt.xticks([]); plt.yticks([])
+
+    # ===========================
+    # Plot: USA
+    # ===========================
+
+    ax = fig.add_subplot(1, 2, 1)
+
+    top, other = split_residuals(usa, n)
+    residuals_top, residuals_other = top['residual'], other['residual']
+
+    # Scatter plot
+    ax.scatter(np.log10(top['length_official']), np.log10(top['length_osm']), color='none', edgecolors=top_color,
+               alpha=alpha, marker='o', s=top['population'] / 20000, rasterized=True)
+    ax.scatter(np.log10(other['length_official']), np.log10(other['length_osm']), color='none',
+               edgecolors=other_color, alpha=alpha, marker='o', s=other['population'] / 20000, rasterized=True)
+    ax.plot(usa_xlim, usa_xlim, linestyle='--', color='grey', linewidth=3)
+
+    # Axes styling
+    for side in ['top', 'bottom', 'left', 'right']:
+        ax.spines[side].set_linewidth(1.5)
+    ax.set_xlim(usa_xlim)
+    ax.set_ylim(usa_xlim)
+    ax.set_xlabel(r'$Road \, Length \, (FHWA)$', fontsize=label_size)
+    ax.set_ylabel(r'$Road \, Length \, (OSM)$', fontsize=label_size)
+    ax.tick_params(width=1.5, labelsize=tick_font_size + 1)
+
+    # R² annotation
+    print("R² (USA):", r2_score(usa['length_official'], usa['length_osm']))
+
+    # Add panel label and country label
+    ax.text(label_offset_x, label_offset_y, label_a, fontsize=text_size + 5, transform=ax.transAxes)
+    ax.text(country_label_offset, 1 - country_label_offset, 'USA',
+            fontsize=font_size_country, transform=ax.transAxes,
+            fontproperties=FontProperties().set_weight(font_weight))
+
+    # Inset: Residual Distribution (USA)
+    inset_usa = fig.add_axes([inset_x, inset_y, inset_width, inset_height])
+    x_top, y_top = probability_density_constant(residuals_top, bins=8)
+    x_other, y_other = probability_density_constant(residuals_other, bins=13)
+    inset_usa.plot(x_top, y_top, color=top_color, linewidth=inset_linewidth, label=f'Top {n}')
+    inset_usa.plot(x_other, y_other, color=other_color, linewidth=inset_linewidth, label='Others')
+    inset_usa.axvline(x=0, linestyle='--', color='black', alpha=inset_alpha + 0.5)
+    inset_usa.fill_between(x_top, y_top, color=top_color, alpha=inset_alpha)
+    inset_usa.fill_between(x_other, y_other, color=other_color, alpha=inset_alpha)
+
+    inset_usa.set_xlabel(r'$\Delta$', fontsize=inset_font, labelpad=0)
+    inset_usa.set_ylabel(r'$P(\Delta)$', fontsize=inset_font, labelpad=0)
+    inset_usa.tick_params(labelsize=inset_font, direction='in')
+    inset_usa.set_xlim(inset_xlim)
+    inset_usa.set_ylim(inset_ylim)
+    inset_usa.yaxis.set_major_locator(MultipleLocator(0.15))
+    inset_usa.legend(loc='upper right', fontsize=inset_font - 2, frameon=False)
+
+    # ===========================
+    # Plot: China
+    # ===========================
+
+    ax = fig.add_subplot(1, 2, 2)
+
+    top_c, other_c = split_residuals(china, n)
+    residuals_top_c, residuals_other_c = top_c['residual'], other_c['residual']
+
+    # Scatter plot
+    ax.scatter(np.log10(top_c['length_official']), np.log10(top_c['length_osm']), color='none',
+               edgecolors=top_color, alpha=alpha, marker='o', s=top_c['population'] / 2, rasterized=True)
+    ax.scatter(np.log10(other_c['length_official']), np.log10(other_c['length_osm']), color='none',
+               edgecolors=other_color, alpha=alpha, marker='o', s=other_c['population'] / 2, rasterized=True)
+    ax.plot(china_xlim, china_xlim, linestyle='--', color='grey', linewidth=3)
+
+    # Axes styling
+    for side in ['top', 'bottom', 'left', 'right']:
+        ax.spines[side].set_linewidth(1.5)
+    ax.set_xlim(china_xlim)
+    ax.set_ylim(china_xlim)
+    ax.set_xlabel(r'$Road \, Length \, (MoHURD)$', fontsize=label_size)
+    ax.tick_params(width=1.5, labelsize=tick_font_size + 1)
+
+    # R² annotation
+    print("R² (China):", r2_score(china['length_official'], china['length_osm']))
+
+    # Add panel label and country label
+    ax.text(label_offset_x, label_offset_y, chr(ord(label_a) + 1), fontsize=text_size + 5, transform=ax.transAxes)
+    ax.text(country_label_offset, 1 - country_label_offset, 'China',
+            fontsize=font_size_country, transform=ax.transAxes,
+            fontproperties=FontProperties().set_weight(font_weight))
+
+    # Inset: Residual Distribution (China)
+    inset_china = fig.add_axes([inset_x + 0.48, inset_y, inset_width, inset_height])
+    x_top_c, y_top_c = probability_density_constant(residuals_top_c, bins=6)
+    x_other_c, y_other_c = probability_density_constant(residuals_other_c, bins=13)
+    inset_china.plot(x_top_c, y_top_c, color=top_color, linewidth=inset_linewidth, label=f'Top {n}')
+    inset_china.plot(x_other_c, y_other_c, color=other_color, linewidth=inset_linewidth, label='Others')
+    inset_china.axvline(x=0, linestyle='--', color='black', alpha=inset_alpha + 0.5)
+    inset_china.fill_between(x_top_c, y_top_c, color=top_color, alpha=inset_alpha)
+    inset_china.fill_between(x_other_c, y_other_c, color=other_color, alpha=inset_alpha)
+
+    inset_china.set_xlabel(r'$\Delta$', fontsize=inset_font, labelpad=0)
+    inset_china.set_ylabel(r'$P(\Delta)$', fontsize=inset_font, labelpad=0)
+    inset_china.tick_params(labelsize=inset_font, direction='in')
+    inset_china.set_xlim(inset_xlim)
+    inset_china.set_ylim(inset_ylim)
+    inset_china.yaxis.set_major_locator(MultipleLocator(0.15))
+    inset_china.legend(loc='upper right', fontsize=inset_font - 2, frameon=False)
+
+    plt.tight_layout()
+    fig.patch.set_alpha(0.0)
+    return fig
 
 # ===========================
-# Plot: USA
+# Main Execution
 # ===========================
 
-ax = fig.add_subplot(1, 2, 1)
-
-log_fhwa = np.log10(usa_yy)
-log_osm = np.log10(usa_y4)
-
-(mean_resid_top, mean_resid_others,
- top_idx, other_idx,
- residuals_top, residuals_other) = compute_residuals(n, log_fhwa, log_osm, usa_xx)
-
-# Scatter plot
-ax.scatter(log_fhwa[top_idx], log_osm[top_idx], color='none', edgecolors=top_color,
-           alpha=alpha, marker='o', s=np.array(usa_xx)[top_idx] / 20000)
-ax.scatter(log_fhwa[other_idx], log_osm[other_idx], color='none', edgecolors=other_color,
-           alpha=alpha, marker='o', s=np.array(usa_xx)[other_idx] / 20000)
-ax.plot(usa_xlim, usa_xlim, linestyle='--', color='grey', linewidth=3)
-
-# Axes styling
-for side in ['top', 'bottom', 'left', 'right']:
-    ax.spines[side].set_linewidth(1.5)
-ax.set_xlim(usa_xlim)
-ax.set_ylim(usa_xlim)
-ax.set_xlabel(r'$Road \, Length \, (FHWA)$', fontsize=label_size)
-ax.set_ylabel(r'$Road \, Length \, (OSM)$', fontsize=label_size)
-ax.tick_params(width=1.5, labelsize=tick_font_size + 1)
-
-# R² annotation
-print("R² (USA):", r2_score(usa_yy, usa_y4))
-
-# Add panel label and country label
-ax.text(label_offset_x, label_offset_y, label_a, fontsize=text_size + 5, transform=ax.transAxes)
-ax.text(country_label_offset, 1 - country_label_offset, 'USA',
-        fontsize=font_size_country, transform=ax.transAxes,
-        fontproperties=FontProperties().set_weight(font_weight))
-
-# Inset: Residual Distribution (USA)
-inset_usa = fig.add_axes([inset_x, inset_y, inset_width, inset_height])
-x_top, y_top = probability_density_constant(residuals_top, bins=8)
-x_other, y_other = probability_density_constant(residuals_other, bins=13)
-inset_usa.plot(x_top, y_top, color=top_color, linewidth=inset_linewidth, label=f'Top {n}')
-inset_usa.plot(x_other, y_other, color=other_color, linewidth=inset_linewidth, label='Others')
-inset_usa.axvline(x=0, linestyle='--', color='black', alpha=inset_alpha + 0.5)
-inset_usa.fill_between(x_top, y_top, color=top_color, alpha=inset_alpha)
-inset_usa.fill_between(x_other, y_other, color=other_color, alpha=inset_alpha)
-
-inset_usa.set_xlabel(r'$\Delta$', fontsize=inset_font, labelpad=0)
-inset_usa.set_ylabel(r'$P(\Delta)$', fontsize=inset_font, labelpad=0)
-inset_usa.tick_params(labelsize=inset_font, direction='in')
-inset_usa.set_xlim(inset_xlim)
-inset_usa.set_ylim(inset_ylim)
-inset_usa.yaxis.set_major_locator(MultipleLocator(0.15))
-inset_usa.legend(loc='upper right', fontsize=inset_font - 2, frameon=False)
-
-# ===========================
-# Plot: China
-# ===========================
-
-ax = fig.add_subplot(1, 2, 2)
-
-log_mohurd = np.log10(china_yy)
-log_osm_c = np.log10(china_y2)
-
-(mean_resid_top_c, mean_resid_others_c,
- top_idx_c, other_idx_c,
- residuals_top_c, residuals_other_c) = compute_residuals(n, log_mohurd, log_osm_c, china_xx)
-
-# Scatter plot
-ax.scatter(log_mohurd[top_idx_c], log_osm_c[top_idx_c], color='none', edgecolors=top_color,
-           alpha=alpha, marker='o', s=np.array(china_xx)[top_idx_c] / 2)
-ax.scatter(log_mohurd[other_idx_c], log_osm_c[other_idx_c], color='none', edgecolors=other_color,
-           alpha=alpha, marker='o', s=np.array(china_xx)[other_idx_c] / 2)
-ax.plot(china_xlim, china_xlim, linestyle='--', color='grey', linewidth=3)
-
-# Axes styling
-for side in ['top', 'bottom', 'left', 'right']:
-    ax.spines[side].set_linewidth(1.5)
-ax.set_xlim(china_xlim)
-ax.set_ylim(china_xlim)
-ax.set_xlabel(r'$Road \, Length \, (MoHURD)$', fontsize=label_size)
-ax.tick_params(width=1.5, labelsize=tick_font_size + 1)
-
-# R² annotation
-print("R² (China):", r2_score(china_yy, china_y2))
-
-# Add panel label and country label
-ax.text(label_offset_x, label_offset_y, chr(ord(label_a) + 1), fontsize=text_size + 5, transform=ax.transAxes)
-ax.text(country_label_offset, 1 - country_label_offset, 'China',
-        fontsize=font_size_country, transform=ax.transAxes,
-        fontproperties=FontProperties().set_weight(font_weight))
-
-# Inset: Residual Distribution (China)
-inset_china = fig.add_axes([inset_x + 0.48, inset_y, inset_width, inset_height])
-x_top_c, y_top_c = probability_density_constant(residuals_top_c, bins=6)
-x_other_c, y_other_c = probability_density_constant(residuals_other_c, bins=13)
-inset_china.plot(x_top_c, y_top_c, color=top_color, linewidth=inset_linewidth, label=f'Top {n}')
-inset_china.plot(x_other_c, y_other_c, color=other_color, linewidth=inset_linewidth, label='Others')
-inset_china.axvline(x=0, linestyle='--', color='black', alpha=inset_alpha + 0.5)
-inset_china.fill_between(x_top_c, y_top_c, color=top_color, alpha=inset_alpha)
-inset_china.fill_between(x_other_c, y_other_c, color=other_color, alpha=inset_alpha)
-
-inset_china.set_xlabel(r'$\Delta$', fontsize=inset_font, labelpad=0)
-inset_china.set_ylabel(r'$P(\Delta)$', fontsize=inset_font, labelpad=0)
-inset_china.tick_params(labelsize=inset_font, direction='in')
-inset_china.set_xlim(inset_xlim)
-inset_china.set_ylim(inset_ylim)
-inset_china.yaxis.set_major_locator(MultipleLocator(0.15))
-inset_china.legend(loc='upper right', fontsize=inset_font - 2, frameon=False)
-
-# ===========================
-# Save & Show
-# ===========================
+def main():
+    render(prepare_data())
+    plt.show()
 
-plt.tight_layout()
-fig.patch.set_alpha(0.0)
-plt.show()
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from scipy.optimize import curve_fit
 from scipy.stats import linregress, t
 from sklearn.metrics import r2_score
 from matplotlib.font_manager import FontProperties
+from roadhierarchy.scaling import FIGURE_TYPES, FIT_COLUMNS, load_fits, load_store_tables, log_bin
 
 # ---------- Utility Functions (unchanged) ---------- #
 
@@ -21,33 +22,13 @@ def line_func(x, a, b):
     return b * x + a
 
 def log_avg(x, y, num):
-    min_x, max_x = min(x), max(x)
-    bins = np.logspace(np.log10(min_x), np.log10(max_x), num)
-    bins_all = {bins[i]: [] for i in range(len(bins) - 1)}
-
-    for i in range(len(x)):
-        added = False
-        for j in range(1, len(bins)):
-            if x[i] <= bins[j]:
-                bins_all[bins[j - 1]].append(y[i])
-                added = True
-                break
-        if not added:
-            bins_all[bins[-2]].append(y[i])
-
-    x_avg, y_avg = [], []
-    for i in range(len(bins) - 1):
-        value = bins_all[bins[i]]
-        if value:
-            midpoint = (bins[i] + bins[i + 1]) / 2
-            y_avg.append(np.mean(value))
-            x_avg.append(midpoint)
-    return x_avg, y_avg
+    x_avg, y_avg = log_bin(x, y, num)
+    return list(x_avg), list(y_avg)
 
 # ---------- Core Fitting and Plotting Function ---------- #
 
 def logbinning_fitPower(x, y, num_bins, ax, label, x_loc, y_loc_up, y_loc_down,
-                        scatter_color, bin_color, bin_fit=False, confidence_band=False, word_up=True):
+                        scatter_color, bin_color, bin_fit=False, confidence_band=False, word_up=True, fit=None):
     """
     Perform log-binning and power-law fitting on data, and plot results.
 
@@ -62,6 +43,8 @@ def logbinning_fitPower(x, y, num_bins, ax, label, x_loc, y_loc_up, y_loc_down,
         bin_fit          : Whether to fit on binned values
         confidence_band  : Show 95% CI of fit
         word_up          : Place annotation at top or bottom
+        fit              : Row of the scaling fits table (roadhierarchy/scaling.py);
+                           when given, the fit is read from it instead of refitted
     """
     if len(x) <= 5:
         return
@@ -77,14 +60,23 @@ def logbinning_fitPower(x, y, num_bins, ax, label, x_loc, y_loc_up, y_loc_down,
     x_fit = np.log10(x_bin if bin_fit else x)
     y_fit = np.log10(y_bin if bin_fit else y)
 
-    popt, pcov = curve_fit(line_func, x_fit, y_fit)
-    fit_y = line_func(x_fit, *popt)
-    r2 = r2_score(y_fit, fit_y)
-
-    dof = max(0, len(x_fit) - len(popt))
-    t_value = t.ppf(0.975, dof)
-    se_b = np.sqrt(np.diag(pcov))[1]
-    ci_b = t_value * se_b
+    if fit is None:
+        popt, pcov = curve_fit(line_func, x_fit, y_fit)
+        fit_y = line_func(x_fit, *popt)
+        r2 = r2_score(y_fit, fit_y)
+
+        dof = max(0, len(x_fit) - len(popt))
+        t_value = t.ppf(0.975, dof)
+        se_b = np.sqrt(np.diag(pcov))[1]
+        ci_b = t_value * se_b
+    else:
+        popt = np.array([fit['intercept'], fit['beta']])
+        pcov = np.array([[fit['intercept_se'] ** 2, fit['cov']],
+                         [fit['cov'], fit['beta_se'] ** 2]])
+        fit_y = line_func(x_fit, *popt)
+        r2 = fit['r2']
+        t_value = fit['t_value']
+        ci_b = t_value * fit['beta_se']
 
     ci = t_value * np.sqrt(
         np.diag(pcov)[0]**2 +
@@ -93,7 +85,7 @@ def logbinning_fitPower(x, y, num_bins, ax, label, x_loc, y_loc_up, y_loc_down,
     )
 
     ax.loglog()
-    ax.scatter(x, y, s=7, c=bin_color, alpha=0.8, edgecolors='none', label='Raw data')
+    ax.scatter(x, y, s=7, c=bin_color, alpha=0.8, edgecolors='none', label='Raw data', rasterized=True)
     ax.scatter(10**x_fit, 10**y_fit, s=24, facecolors='none', edgecolors=scatter_color, alpha=1, label='Binned avg')
     ax.plot(10**x_fit, 10**fit_y, 'r-', linewidth=1, label='Fit')
 
@@ -112,7 +104,7 @@ def logbinning_fitPower(x, y, num_bins, ax, label, x_loc, y_loc_up, y_loc_down,
 
 # ---------- Plotting Entrypoint ---------- #
 
-def plot_scaling_relationships(usa_data, usa_combined_df, usa_valid_indices_no_dis, year):
+def plot_scaling_relationships(usa_data, usa_combined_df, usa_valid_indices_no_dis, year, fits=None):
     """
     Create subplots for different road types vs population scaling relationships.
 
@@ -121,6 +113,11 @@ def plot_scaling_relationships(usa_data, usa_combined_df, usa_valid_indices_no_d
         usa_combined_df        : DataFrame with aggregated road length by type
         usa_valid_indices_no_dis : Boolean index for valid entries (non-zero)
         year                   : Year string (e.g. "2022")
+        fits                   : Scaling fits from the result store (load_fits);
+                                 if None, each road type is refitted while plotting.
+                                 With fits, every road type is plotted on the sample
+                                 of its fit (cities with a positive population and
+                                 length of that type, as in scaling.fit_scaling)
     """
     columns = ['metro', 'motorway*', 'primary', 'secondary', 'tertiary', 'residential*', 'footway']
     pop_col = 'dp1_0001c'  # USA population column
@@ -148,17 +145,70 @@ def plot_scaling_relationships(usa_data, usa_combined_df, usa_valid_indices_no_d
                 fontsize=font, color='black')
 
         # Data selection per road type
-        if column == 'metro':
+        if fits is not None:
+            sample = (usa_data[pop_col] > 0) & (usa_combined_df[column] > 0)
+            x = usa_data.loc[sample, pop_col]
+            y = usa_combined_df[column].loc[sample]
+        elif column == 'metro':
             x = usa_data.loc[usa_combined_df['metro'] != 0, pop_col]
             y = usa_combined_df['metro'].loc[usa_combined_df['metro'] != 0]
         else:
             x = usa_data.loc[usa_valid_indices_no_dis, pop_col]
             y = usa_combined_df[column].loc[usa_valid_indices_no_dis]
 
+        # Fit from the precomputed table, if available
+        fit = None
+        if fits is not None:
+            row = fits[(fits['country'] == 'USA') & (fits['year'] == int(year)) &
+                       (fits['road_type'] == column) & (~fits['bin_fit'])]
+            fit = row.iloc[0] if len(row) else None
+
         # Plot
         logbinning_fitPower(x, y, 15, ax, f"{year} {column}", 0.7, 0.5, 0.07,
                             scatter_color="#501d8a", bin_color="#c6ccdc", bin_fit=False,
-                            confidence_band=False, word_up=False)
+                            confidence_band=False, word_up=False, fit=fit)
 
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    return fig
+
+# ---------- Data Preparation ---------- #
+
+# Input files of the figure: the result store (lengths and scaling fits) and
+# the USA city populations (columns: city, year, population)
+INPUTS = {
+    'store': 'results',
+    'population': 'path/to/USA_population.xlsx',
+}
+# Metrics read from the store
+METRICS = ['length'] + [f'scaling_{column}' for column in FIT_COLUMNS]
+YEAR = 2022
+
+def prepare_data(inputs=INPUTS):
+    """
+    Population and figure road type lengths of every USA city, and the
+    scaling fits of the year (the part cached by visualization/build.py).
+    """
+    table = load_store_tables(inputs['store'], inputs['population'], countries=('USA',), years=[YEAR - 2000])
+    usa_data = table.groupby('city')['population'].first().rename('dp1_0001c').to_frame()
+    usa_combined_df = table.pivot_table(index='city', columns='road_type', values='length', fill_value=0)
+    usa_combined_df = usa_combined_df.reindex(index=usa_data.index, columns=list(FIGURE_TYPES), fill_value=0)
+    roads = [column for column in FIGURE_TYPES if column != 'metro']
+    valid = (usa_data['dp1_0001c'] > 0) & (usa_combined_df[roads] > 0).all(axis=1)
+    return {
+        'usa_data': usa_data, 'usa_combined_df': usa_combined_df, 'valid': valid,
+        'fits': load_fits(inputs['store'], 'USA', YEAR),
+    }
+
+def render(data):
+    """Draw the figure from prepared data."""
+    return plot_scaling_relationships(data['usa_data'], data['usa_combined_df'], data['valid'], str(YEAR),
+                                      fits=data['fits'])
+
+# ---------- Main Execution ---------- #
+
+def main():
+    render(prepare_data())
+    plt.show()
+
+if __name__ == "__main__":
+    main()
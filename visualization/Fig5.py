@@ -2,6 +2,9 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 from matplotlib.colors import LinearSegmentedColormap
+from roadhierarchy.engine import CLASS_GROUPS
+from roadhierarchy.scaling import FIGURE_TYPES, combine_types
+from roadhierarchy.store import length_table, read_results
 
 # Define hierarchical road types (first letter uppercase)
 columns = ['metro', 'motorway*', 'primary', 'secondary', 'tertiary', 'residential*', 'footway']
@@ -19,7 +22,6 @@ colors = [
 cmap = LinearSegmentedColormap.from_list("custom_cmap", colors, N=256)
 
 # Layout & formatting parameters
-fig, axes = plt.subplots(2, 2, figsize=(12, 11))
 a = 0.07
 font = 30
 fontsize = 18
@@ -32,16 +34,28 @@ text_b = text_position_b + 0.1
 # Labels for subplots
 subplot_labels = ['B', 'C', 'E', 'F']
 
+# Road types of the stacked length shares (rail excluded)
+share_columns = ['motorway*', 'primary', 'secondary', 'tertiary', 'residential*', 'footway']
+legend_labels = [col[0].upper() for col in share_columns]
+bar_width = 0.7
+
+# Position of subplot label (A, B, etc.)
+text_offset_x = -0.12
+text_offset_y = 1.13
+first_label_char = 'A'
+
 def plot_heatmap(matrix, ax, label, title, colorbar_offset):
     """Plot heatmap with formatted colorbar and annotations."""
+    fig = ax.figure
+    labels = road_types[-len(matrix):]
     heatmap = sns.heatmap(
         matrix, annot=True, fmt='.3f', cmap=cmap, cbar=True, ax=ax,
         vmin=0, vmax=0.8, annot_kws={"fontsize": 12},
         cbar_kws={"shrink": shrink_size, 'ticks': np.arange(0, 0.9, 0.2)}
     )
 
-    ax.set_xticklabels(road_types, fontsize=fontsize)
-    ax.set_yticklabels(road_types, fontsize=fontsize)
+    ax.set_xticklabels(labels, fontsize=fontsize)
+    ax.set_yticklabels(labels, fontsize=fontsize)
     ax.set_xlabel('$Hierarchy$', fontsize=fontsize+3)
     ax.set_ylabel('$Hierarchy$', fontsize=fontsize+3)
     ax.set_title(title, fontsize=fontsize+3, y=1.01)
@@ -64,111 +78,134 @@ def plot_heatmap(matrix, ax, label, title, colorbar_offset):
     new_cbar.set_ticks(np.arange(0, 0.9, 0.2))
     new_cbar.ax.tick_params(labelsize=fontsize-2)
 
-# Define the matrices
-connecting_usa = np.array([...])   # Replace with your matrix
-connecting_china = np.array([...]) # Replace with your matrix
-parallel_usa = np.array([...])     # Replace with your matrix
-parallel_china = np.array([...])   # Replace with your matrix
-
-# Plot all four heatmaps
-plot_heatmap(connecting_usa, axes[0, 0], subplot_labels[0], '$Connecting$', [0.035, 0.043, -0.044])
-plot_heatmap(parallel_usa, axes[0, 1], subplot_labels[1], '$Parallel$', [0.083, 0.043, -0.044])
-plot_heatmap(connecting_china, axes[1, 0], subplot_labels[2], '$Connecting$', [0.035, 0.0026, -0.045])
-plot_heatmap(parallel_china, axes[1, 1], subplot_labels[3], '$Parallel$', [0.083, 0.0025, -0.045])
+def plot_shares(ax, percentages_df, label):
+    """Stacked bars of the length share of every road type by year."""
+    years = percentages_df['Year']
+    x = np.arange(len(years))
+    bottom = np.zeros(len(years))
+    for i, category in enumerate(share_columns):
+        ax.bar(x, percentages_df[category], bottom=bottom, width=bar_width,
+               label=legend_labels[i], color=colors[i])
+        bottom += np.array(percentages_df[category])
+
+    ax.set_ylabel('Percentage', fontsize=fontsize + 3)
+    ax.set_xlabel('Year', fontsize=fontsize + 3)
+    ax.set_xticks(x, years, fontsize=fontsize)
+    ax.tick_params(axis='y', labelsize=fontsize)
+    ax.set_ylim(0, 1)
+    ax.grid(False)
+    ax.text(text_offset_x, text_offset_y, label, ha="left", va="top",
+            transform=ax.transAxes, fontsize=font, color='black')
+
+# ----- Data Preparation -----
+
+# Input files of the figure: the result store (roadhierarchy/store.py)
+INPUTS = {
+    'store': 'results',
+}
+# Metrics read from the store
+METRICS = ['connection', 'parallel_matches', 'length']
+year = 2022
+years = range(2015, 2023)
+
+def connecting_matrix(store, country, year):
+    """Connection matrix of the merged classes, averaged over the cities as engine.main does."""
+    rows = read_results(store, 'connection', country=country, year=year)
+    matrix = rows.pivot_table(index='road_type', columns='other_type', values='value', aggfunc='mean')
+    return matrix.reindex(index=list(CLASS_GROUPS), columns=list(CLASS_GROUPS), fill_value=0).to_numpy()
+
+def parallel_matrix(store, country, year, groups=FIGURE_TYPES):
+    """
+    Share of the parallel matches of every figure road type that are of
+    each other type, summed over the cities (matches within a type are dropped).
+    """
+    mapping = {rt: group for group, types in groups.items() for rt in types}
+    rows = read_results(store, 'parallel_matches', country=country, year=year)
+    rows = rows.assign(road_type=rows['road_type'].map(mapping), other_type=rows['other_type'].map(mapping))
+    rows = rows.dropna(subset=['road_type', 'other_type'])
+    rows = rows[rows['road_type'] != rows['other_type']]
+    counts = rows.pivot_table(index='road_type', columns='other_type', values='value', aggfunc='sum')
+    counts = counts.reindex(index=list(groups), columns=list(groups), fill_value=0).fillna(0)
+    totals = counts.sum(axis=1).to_numpy()[:, None]
+    return np.divide(counts.to_numpy(), totals, out=np.zeros(counts.shape), where=totals > 0)
+
+def length_shares(store, country, years=years):
+    """Share of the total length of every road type, one row per year."""
+    table = combine_types(length_table(store, country, list(years)))
+    totals = table.pivot_table(index='year', columns='road_type', values='length', aggfunc='sum')
+    totals = totals.reindex(columns=share_columns, fill_value=0).fillna(0)
+    return totals.div(totals.sum(axis=1), axis=0).rename_axis('Year').reset_index()
+
+def prepare_data(inputs=INPUTS):
+    """Matrices and length shares of both countries (the part cached by visualization/build.py)."""
+    store = inputs['store']
+    return {
+        'connecting_usa': connecting_matrix(store, 'USA', year),
+        'connecting_china': connecting_matrix(store, 'China', year),
+        'parallel_usa': parallel_matrix(store, 'USA', year),
+        'parallel_china': parallel_matrix(store, 'China', year),
+        'usa_percentages_df': length_shares(store, 'USA'),
+        'china_percentages_df': length_shares(store, 'China'),
+    }
+
+def render_matrices(data):
+    """Connecting and parallel heatmaps of both countries (panels B, C, E, F)."""
+    fig, axes = plt.subplots(2, 2, figsize=(12, 11))
+
+    # Plot all four heatmaps
+    plot_heatmap(data['connecting_usa'], axes[0, 0], subplot_labels[0], '$Connecting$', [0.035, 0.043, -0.044])
+    plot_heatmap(data['parallel_usa'], axes[0, 1], subplot_labels[1], '$Parallel$', [0.083, 0.043, -0.044])
+    plot_heatmap(data['connecting_china'], axes[1, 0], subplot_labels[2], '$Connecting$', [0.035, 0.0026, -0.045])
+    plot_heatmap(data['parallel_china'], axes[1, 1], subplot_labels[3], '$Parallel$', [0.083, 0.0025, -0.045])
+
+    # Adjust spacing
+    plt.subplots_adjust(wspace=0.55, hspace=0.5)
+    fig.patch.set_alpha(0.0)
+    return fig
+
+def render_shares(data):
+    """Length shares of the road types by year (panels A and D)."""
+    # Subplot configuration: 2 rows × 3 columns
+    fig, axes = plt.subplots(2, 3, figsize=(16, 11), constrained_layout=False)
+
+    ### --- USA: Top Left Subplot ---
+    plot_shares(axes[0, 0], data['usa_percentages_df'], first_label_char)
+
+    # Legend for USA subplot (on the right)
+    legend = axes[0, 0].legend(
+        bbox_to_anchor=(1, 0.5),
+        loc='center left',
+        frameon=False,
+        fontsize=fontsize - 3,
+        ncol=1
+    )
+    for handle in legend.legend_handles:
+        handle.set_edgecolor('black')
+        handle.set_linewidth(1)
 
-# Adjust spacing and show the plot
-plt.subplots_adjust(wspace=0.55, hspace=0.5)
-fig.patch.set_alpha(0.0)
-plt.show()
+    ### --- China: Bottom Left Subplot ---
+    plot_shares(axes[1, 0], data['china_percentages_df'], chr(ord(first_label_char) + 3))
 
+    # Disable unused subplots
+    axes[0, 1].axis('off')
+    axes[1, 1].axis('off')
+    axes[0, 2].axis('off')
+    axes[1, 2].axis('off')
 
+    # Adjust layout
+    plt.subplots_adjust(hspace=0.5)
+    fig.patch.set_alpha(0.0)
+    return fig
 
-import matplotlib.pyplot as plt
-import numpy as np
+def render(data):
+    """Draw the two parts of the figure from prepared data."""
+    return [render_shares(data), render_matrices(data)]
 
-# Prepare columns and display settings
-columns = ['motorway*', 'primary', 'secondary', 'tertiary', 'residential*', 'footway']
-legend_labels = [col[0].upper() for col in columns]
+# ----- Main Execution -----
 
-# Define color scheme (consistent order)
-colors = [
-    (57/255, 81/255, 162/255),
-    (114/255, 170/255, 207/255),
-    (202/255, 232/255, 242/255),
-    (254/255, 251/255, 186/255),
-    (253/255, 185/255, 107/255),
-    (236/255, 93/255, 59/255)
-]
-
-# Subplot configuration: 2 rows × 3 columns
-fig, axes = plt.subplots(2, 3, figsize=(16, 11), constrained_layout=False)
-
-# General styling parameters
-fontsize = 18
-font = 30
-bar_width = 0.7
-years = usa_percentages_df['Year']  # Ensure 'Year' is a column
-x = np.arange(len(years))
-
-# Position of subplot label (A, B, etc.)
-text_offset_x = -0.12
-text_offset_y = 1.13
-first_label_char = 'A'
+def main():
+    render(prepare_data())
+    plt.show()
 
-### --- USA: Top Left Subplot ---
-bottom = np.zeros(len(years))
-for i, category in enumerate(columns):
-    axes[0, 0].bar(x, usa_percentages_df[category], bottom=bottom, width=bar_width,
-                   label=legend_labels[i], color=colors[i])
-    bottom += np.array(usa_percentages_df[category])
-
-axes[0, 0].set_ylabel('Percentage', fontsize=fontsize + 3)
-axes[0, 0].set_xlabel('Year', fontsize=fontsize + 3)
-axes[0, 0].set_xticks(x, years, fontsize=fontsize)
-axes[0, 0].set_yticks(axes[0, 0].get_yticks(), fontsize=fontsize)
-axes[0, 0].set_ylim(0, 1)
-axes[0, 0].grid(False)
-axes[0, 0].text(text_offset_x, text_offset_y, first_label_char, ha="left", va="top",
-                transform=axes[0, 0].transAxes, fontsize=font, color='black')
-
-# Legend for USA subplot (on the right)
-legend = axes[0, 0].legend(
-    bbox_to_anchor=(1, 0.5),
-    loc='center left',
-    frameon=False,
-    fontsize=fontsize - 3,
-    ncol=1
-)
-for handle in legend.legendHandles:
-    handle.set_edgecolor('black')
-    handle.set_linewidth(1)
-
-### --- China: Bottom Left Subplot ---
-bottom = np.zeros(len(years))
-for i, category in enumerate(columns):
-    axes[1, 0].bar(x, china_percentages_df[category], bottom=bottom, width=bar_width,
-                   label=legend_labels[i], color=colors[i])
-    bottom += np.array(china_percentages_df[category])
-
-axes[1, 0].set_ylabel('Percentage', fontsize=fontsize + 3)
-axes[1, 0].set_xlabel('Year', fontsize=fontsize + 3)
-axes[1, 0].set_xticks(x, years, fontsize=fontsize)
-axes[1, 0].set_yticks(axes[1, 0].get_yticks(), fontsize=fontsize)
-axes[1, 0].set_ylim(0, 1)
-axes[1, 0].grid(False)
-axes[1, 0].text(text_offset_x, text_offset_y, chr(ord(first_label_char) + 3), ha="left", va="top",
-                transform=axes[1, 0].transAxes, fontsize=font, color='black')
-
-# Disable unused subplots
-axes[0, 1].axis('off')
-axes[1, 1].axis('off')
-axes[0, 2].axis('off')
-axes[1, 2].axis('off')
-
-# Adjust layout
-plt.subplots_adjust(hspace=0.5)
-fig.patch.set_alpha(0.0)
-
-# Save or show the plot
-# plt.savefig('road_type_distribution_usa_china.pdf', dpi=300)
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
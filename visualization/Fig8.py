@@ -3,13 +3,16 @@ import matplotlib.pyplot as plt
 from matplotlib.patches import Patch
 from matplotlib.ticker import MultipleLocator, FuncFormatter
 from matplotlib.colors import ListedColormap
+from roadhierarchy.lisa import LISA_STATS, lisa_columns, load_lisa
+from roadhierarchy.sami import SAMI_COLUMNS, load_residuals
 
 def plot_lisa_dual_maps(gdf, base_map, colors, colors_new, names_new, set_edgecolor):
     """
     Plot dual LISA cluster maps (e.g., motorway and footway) on USA map.
 
     Parameters:
-    - gdf: GeoDataFrame containing LISA clustering results.
+    - gdf: GeoDataFrame containing LISA clustering results
+      (LISA_CL_M / LISA_CL_F columns, from roadhierarchy.lisa.lisa_columns).
     - base_map: GeoDataFrame for national boundaries.
     - colors: List of colormap values.
     - colors_new: Colors for custom legend patches.
@@ -42,7 +45,7 @@ def plot_lisa_dual_maps(gdf, base_map, colors, colors_new, names_new, set_edgeco
     axes[0].yaxis.set_major_formatter(FuncFormatter(lambda y, _: f"{abs(y):.0f}°{'N' if y >= 0 else 'S'}"))
     axes[0].text(text_position_a, text_position_b, 'C', fontsize=text_size, transform=axes[0].transAxes)
     axes[0].text(-130.7, 32.3, "Motorway", fontsize=9)
-    axes[0].legend([Patch(facecolor=color, edgecolor='gray', label=name, linewidth=0.5)
+    axes[0].legend(handles=[Patch(facecolor=color, edgecolor='gray', label=name, linewidth=0.5)
                     for color, name in zip(colors_new, names_new)],
                    loc='lower left', frameon=False, fontsize=7.5, handletextpad=0.8, labelspacing=0.25)
 
@@ -59,7 +62,7 @@ def plot_lisa_dual_maps(gdf, base_map, colors, colors_new, names_new, set_edgeco
     axes[1].yaxis.set_major_formatter(FuncFormatter(lambda y, _: f"{abs(y):.0f}°{'N' if y >= 0 else 'S'}"))
     axes[1].text(text_position_a, text_position_b, 'D', fontsize=text_size, transform=axes[1].transAxes)
     axes[1].text(-130.7, 32.3, "Footway", fontsize=10)
-    axes[1].legend([Patch(facecolor=color, edgecolor='gray', label=name, linewidth=0.5)
+    axes[1].legend(handles=[Patch(facecolor=color, edgecolor='gray', label=name, linewidth=0.5)
                     for color, name in zip(colors_new, names_new)],
                    loc='lower left', frameon=False, fontsize=7.5, handletextpad=0.8, labelspacing=0.25)
 
@@ -70,7 +73,6 @@ def plot_lisa_dual_maps(gdf, base_map, colors, colors_new, names_new, set_edgeco
 import geopandas as gpd
 import matplotlib.pyplot as plt
 import pandas as pd
-from shapely.geometry import Point
 from sklearn.preprocessing import MinMaxScaler
 from matplotlib.ticker import MultipleLocator, FuncFormatter
 
@@ -93,8 +95,7 @@ def plot_sami_distribution(base_map, sami_df, column, region_name, color_gt, col
     s_conficient = 300
 
     # Convert to GeoDataFrame
-    geometry = [Point(lon, lat) for lon, lat in zip(sami_df['lon'], sami_df['lat'])]
-    gdf = gpd.GeoDataFrame(sami_df, geometry=geometry, crs="EPSG:4326")
+    gdf = gpd.GeoDataFrame(sami_df, geometry=gpd.points_from_xy(sami_df['lon'], sami_df['lat']), crs="EPSG:4326")
 
     # Normalize population (optional)
     # scaler = MinMaxScaler(feature_range=(0.3, 1))
@@ -112,7 +113,7 @@ def plot_sami_distribution(base_map, sami_df, column, region_name, color_gt, col
     for i, (group, subset) in enumerate(gt0.groupby('group')):
         if not subset.empty:
             subset.plot(ax=ax, color=color_gt, edgecolor='lightgray',
-                        markersize=s_conficient * size_coefficient[i], alpha=1, lw=0.5)
+                        markersize=s_conficient * size_coefficient[i], alpha=1, lw=0.5, rasterized=True)
         ax.scatter([], [], c=color_gt, s=s_conficient * size_coefficient[i],
                    label=f'{group.left:.2f} - {group.right:.2f}', ec="lightgray", alpha=0.8, lw=0.5)
 
@@ -126,7 +127,7 @@ def plot_sami_distribution(base_map, sami_df, column, region_name, color_gt, col
         idx = len(bins_le) - 2 - i  # reverse index for negative values
         if not subset.empty:
             subset.plot(ax=ax, color=color_le, edgecolor='lightgray',
-                        markersize=s_conficient * size_coefficient[idx], alpha=1, lw=0.5)
+                        markersize=s_conficient * size_coefficient[idx], alpha=1, lw=0.5, rasterized=True)
         ax.scatter([], [], c=color_le, s=s_conficient * size_coefficient[idx],
                    label=f'{group.left:.2f} - {group.right:.2f}', ec="lightgray", alpha=0.8, lw=0.5)
 
@@ -144,3 +145,66 @@ def plot_sami_distribution(base_map, sami_df, column, region_name, color_gt, col
 
     fig.patch.set_alpha(0.0)
     return fig
+
+# ----- Data Preparation -----
+
+# Input files of the figure (placeholders: replace with actual file paths)
+INPUTS = {
+    'store': 'results',
+    'usa_base': "path/to/usa_boundary.shp",
+    'usa_msa': "path/to/usa_msa.shp",  # MSA polygons, city name in MSA_NAME
+    'china_base': "path/to/china_boundary.shp",
+    'coords': "path/to/city_coordinates.xlsx",  # columns: city, lon, lat (decimal degrees)
+}
+# Metrics read from the store
+METRICS = [f'lisa_{column}' for column in LISA_STATS] + [f'sami_{column}' for column in SAMI_COLUMNS]
+MSA_NAME = 'NAME'
+year = 2022
+sami_type = 'motorway*'
+sami_column = f'residual_{year % 100}_motorway'
+
+# GeoDa cluster codes: 0 not significant, 1 HH, 2 LL, 3 LH, 4 HL
+lisa_colors = ['#f0f0f0', '#d7191c', '#2c7bb6', '#abd9e9', '#fdae61']
+lisa_names = ['Not significant', 'High-High', 'Low-Low', 'Low-High', 'High-Low']
+
+def set_lisa_edgecolor(row, column):
+    """Darker edges for the significant clusters."""
+    return 'gray' if row[column] == 0 else 'black'
+
+def prepare_data(inputs=INPUTS):
+    """
+    LISA clusters on the USA MSA polygons and motorway SAMIs at the city
+    coordinates of both countries (the part cached by visualization/build.py).
+    """
+    lisa = lisa_columns(load_lisa(inputs['store'], 'USA', year), 'USA', year)
+    msa = gpd.read_file(inputs['usa_msa']).to_crs(epsg=4326)
+    coords = pd.read_excel(inputs['coords'])[['city', 'lon', 'lat']]
+    sami = load_residuals(inputs['store'], year=year, road_type=sami_type).merge(coords, on='city')
+    sami = sami.rename(columns={'residual': sami_column}).dropna(subset=[sami_column])
+    return {
+        'lisa_gdf': msa.merge(lisa, left_on=MSA_NAME, right_on='city'),
+        'usa_base': gpd.read_file(inputs['usa_base']).to_crs(epsg=4326),
+        'china_base': gpd.read_file(inputs['china_base']).to_crs(epsg=4326),
+        'usa_sami': sami[sami['country'] == 'USA'],
+        'china_sami': sami[sami['country'] == 'China'],
+    }
+
+def render(data):
+    """Draw the LISA maps and the SAMI maps of both countries from prepared data."""
+    return [
+        plot_lisa_dual_maps(data['lisa_gdf'].copy(), data['usa_base'], lisa_colors, lisa_colors, lisa_names,
+                            set_lisa_edgecolor),
+        plot_sami_distribution(data['usa_base'], data['usa_sami'], sami_column, 'USA', '#FB8402', '#68BED9',
+                               (-127, 25), ((-128, -66), (22, 54))),
+        plot_sami_distribution(data['china_base'], data['china_sami'], sami_column, 'China', '#FB8402', '#68BED9',
+                               (72, 18), ((70, 139), (15, 55))),
+    ]
+
+# ----- Main Execution -----
+
+def main():
+    render(prepare_data())
+    plt.show()
+
+if __name__ == "__main__":
+    main()
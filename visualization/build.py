@@ -0,0 +1,199 @@
+"""
+Build the figures, rendering only those whose inputs changed.
+
+Every figure module is split into prepare_data / render and declares the
+files it reads in INPUTS; a result store input ('store') is narrowed to
+the metric directories listed in the module's METRICS. Input files are
+hashed (hashes are reused while a file's size and modification time are
+unchanged) and a figure is rendered again only when the hash of its
+script and inputs differs from the last build. Prepared data is cached
+as a pickle keyed on the input hash and on the prepare side of the
+module: the source of prepare_data, of the module functions it calls
+and the values of the module parameters they read (a figure's year,
+road type, ...). render is left out, so restyling a figure does not
+re-read shapefiles, reproject basemaps or query the store. Renders run
+in parallel processes with the Agg backend and are saved as PDF under
+figures/ (one page per figure when render returns several).
+
+Usage (from the repository root):
+    python -m visualization.build [Fig1 Fig6 ...] [--force] [--processes N]
+"""
+
+import argparse
+import glob
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+FIG_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = '.figure_cache'
+OUTPUT_DIR = 'figures'
+
+# Figure modules, each with INPUTS, prepare_data and render
+FIGURES = ['Fig1', 'Fig3', 'Fig4', 'Fig5', 'Fig6', 'Fig7', 'Fig8']
+
+# ----- Hashing -----
+
+def input_files(path):
+    """A file and, for a shapefile, its sidecar files; the Parquet files of a store directory."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '**', '*.parquet'), recursive=True))
+    if path.endswith('.shp'):
+        return sorted(glob.glob(os.path.splitext(path)[0] + '.*')) or [path]
+    return [path]
+
+def file_digest(path, hashes):
+    """SHA-1 of a file, reused from hashes while its size and mtime are unchanged."""
+    if not os.path.exists(path):
+        return 'missing'
+    stat = os.stat(path)
+    signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+    cached = hashes.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    hashes[path] = (signature, sha1.hexdigest())
+    return hashes[path][1]
+
+def combined_digest(paths, hashes):
+    """One digest over several files."""
+    sha1 = hashlib.sha1()
+    for path in paths:
+        for file in input_files(path):
+            sha1.update(f"{file}={file_digest(file, hashes)};".encode())
+    return sha1.hexdigest()
+
+def _global_names(code):
+    """Global names read by a code object and the functions, lambdas and comprehensions nested in it."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+def prepare_digest(module):
+    """
+    Digest of the prepare side of a figure module: the source and defaults
+    of prepare_data and of the module functions it calls, and the values
+    of the module parameters they read. render and its helpers are not
+    included unless prepare_data uses them.
+    """
+    sha1 = hashlib.sha1()
+    pending, seen = [module.prepare_data], set()
+    while pending:
+        function = pending.pop()
+        sha1.update(inspect.getsource(function).encode())
+        sha1.update(repr(function.__defaults__).encode())
+        for name in sorted(_global_names(function.__code__) - seen):
+            seen.add(name)
+            value = vars(module).get(name)
+            if inspect.isfunction(value):
+                if value.__module__ == module.__name__:
+                    pending.append(value)
+            elif name in vars(module) and not inspect.ismodule(value) and not callable(value):
+                sha1.update(f"{name}={value!r};".encode())
+    return sha1.hexdigest()
+
+def figure_inputs(name):
+    """Input paths of a figure: its INPUTS, with the store replaced by the directories of its METRICS."""
+    module = importlib.import_module(f'visualization.{name}')
+    paths = []
+    for key, path in module.INPUTS.items():
+        if key == 'store':
+            paths += [os.path.join(path, f"metric={metric}") for metric in module.METRICS]
+        else:
+            paths.append(path)
+    return paths
+
+# ----- Rendering -----
+
+def render_figure(args):
+    """Render one figure to PDF (runs in a worker process)."""
+    name, data_key, output_dir, cache_dir, refresh = args
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    module = importlib.import_module(f'visualization.{name}')
+    cache_path = os.path.join(cache_dir, f"{name}-{data_key}.pkl")
+    if os.path.exists(cache_path) and not refresh:
+        with open(cache_path, 'rb') as f:
+            data = pickle.load(f)
+    else:
+        data = module.prepare_data()
+        for stale in glob.glob(os.path.join(cache_dir, f"{name}-*.pkl")):
+            os.remove(stale)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    figures = module.render(data)
+    if not isinstance(figures, (list, tuple)):
+        figures = [figures]
+
+    output_path = os.path.join(output_dir, f"{name}.pdf")
+    with PdfPages(output_path) as pdf:
+        for fig in figures:
+            pdf.savefig(fig, dpi=300)
+    plt.close('all')
+    return name, output_path
+
+def build(names=None, force=False, processes=None, output_dir=OUTPUT_DIR, cache_dir=CACHE_DIR):
+    """
+    Render the figures whose script or inputs changed since the last build
+    (all figures with force, which also re-prepares cached data).
+    Returns the names of the rendered figures.
+    """
+    names = names or FIGURES
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = {'hashes': {}, 'figures': {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+    hashes = {path: tuple(value) for path, value in index['hashes'].items()}
+
+    tasks, keys = [], {}
+    for name in names:
+        module = importlib.import_module(f'visualization.{name}')
+        data_key = hashlib.sha1(
+            f"{combined_digest(figure_inputs(name), hashes)}-{prepare_digest(module)}".encode()
+        ).hexdigest()
+        script_key = file_digest(os.path.join(FIG_DIR, f"{name}.py"), hashes)
+        keys[name] = f"{script_key}-{data_key}"
+        output_path = os.path.join(output_dir, f"{name}.pdf")
+        if force or index['figures'].get(name) != keys[name] or not os.path.exists(output_path):
+            tasks.append((name, data_key, output_dir, cache_dir, force))
+
+    rendered = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for name, output_path in pool.map(render_figure, tasks):
+                index['figures'][name] = keys[name]
+                rendered.append(name)
+                print(f"{name} saved to {output_path}")
+
+    index['hashes'] = hashes
+    with open(index_path, 'w') as f:
+        json.dump(index, f, indent=1)
+    print(f"{len(rendered)} of {len(names)} figures rendered, {len(names) - len(rendered)} up to date.")
+    return rendered
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the figures whose inputs changed.")
+    parser.add_argument('figures', nargs='*', help="figures to build (default: all)")
+    parser.add_argument('--force', action='store_true', help="render and re-prepare every figure")
+    parser.add_argument('--processes', type=int, default=None, help="number of render processes")
+    parser.add_argument('--output', default=OUTPUT_DIR, help="output directory")
+    args = parser.parse_args()
+    build(args.figures, args.force, args.processes, args.output)
+
+if __name__ == '__main__':
+    main()